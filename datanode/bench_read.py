@@ -0,0 +1,118 @@
+import gzip
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+
+import dfs_pb2
+from compression import ChunkCodec, read_file_range, read_mapped_range
+from storage import FileStore
+
+CHUNK_SIZE = 64 * 1024 * 1024
+CHUNKS = 4
+READERS = 8
+ROUNDS = 4
+
+
+def legacy_read(store, chunk_id):
+    # The original read path: whole file, then a full decompressed copy
+    with store.open(chunk_id) as f:
+        return gzip.decompress(f.read())
+
+
+def stream_read(store, chunk_id):
+    with store.open(chunk_id) as f:
+        return read_file_range(f)
+
+
+def mmap_read(store, chunk_id):
+    with store.map(chunk_id) as chunk:
+        return read_mapped_range(chunk.view)
+
+
+READ_PATHS = {"legacy": legacy_read, "stream": stream_read, "mmap": mmap_read}
+
+
+def populate(root, codec):
+    # Half random, half zeros: compressible like typical file data
+    store = FileStore(root)
+    for i in range(CHUNKS):
+        data = os.urandom(CHUNK_SIZE // 2) + bytes(CHUNK_SIZE // 2)
+        if codec == "gzip":
+            # Legacy format, as written before codecs were pluggable
+            store.put(f"chunk{i}", [gzip.compress(data)])
+        else:
+            encoded = ChunkCodec(codec, adaptive=False).encode([data])
+            store.put(f"chunk{i}", encoded)
+
+
+def anonymous_rss():
+    # Resident memory not backed by files, in MB (Linux only). ru_maxrss also
+    # counts mapped page-cache pages, which the kernel can drop at will.
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) // 1024
+    return 0
+
+
+def run(root, read_path):
+    # Concurrent full-chunk reads, each turned into a response message the
+    # way RetrieveChunk does; prints throughput and this process's peak RSS
+    store = FileStore(root)
+    peak_anonymous = [0]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.002):
+            peak_anonymous[0] = max(peak_anonymous[0], anonymous_rss())
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    read = READ_PATHS[read_path]
+
+    def reader(n):
+        for i in range(ROUNDS):
+            chunk_id = f"chunk{(n + i) % CHUNKS}"
+            dfs_pb2.Chunk(chunk_id=chunk_id, data=read(store, chunk_id))
+
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(READERS) as pool:
+        list(pool.map(reader, range(READERS)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    sampler.join()
+    total = READERS * ROUNDS * CHUNK_SIZE / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    print(f"{total / elapsed:.0f} {peak} {peak_anonymous[0]}")
+
+
+def main():
+    print(f"{READERS} concurrent readers, {CHUNK_SIZE >> 20}MB chunks")
+    print(f"{'stored as':<10}{'read path':<10}{'MB/s':>8}"
+          f"{'peak RSS MB':>13}{'peak anon MB':>14}")
+    for codec in ("gzip", "zlib", "none"):
+        with tempfile.TemporaryDirectory() as root:
+            populate(root, codec)
+            for read_path in READ_PATHS:
+                if read_path == "legacy" and codec != "gzip":
+                    continue
+                # A fresh process per run so peak RSS is not shared
+                output = subprocess.run(
+                    [sys.executable, __file__, root, read_path],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                throughput, peak, anonymous = output.split()
+                print(f"{codec:<10}{read_path:<10}"
+                      f"{throughput:>8}{peak:>13}{anonymous:>14}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        run(sys.argv[1], sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+
+
+class ChunkCache:
+    def __init__(self, capacity, protected_ratio=0.8):
+        """
+        Byte-budgeted segmented LRU cache of decoded chunk data. New entries
+        start in a probation segment and only move to the protected segment
+        when they are hit again, so one pass over many cold chunks (a scan)
+        cannot push out the chunks that are read over and over.
+        :param capacity: Budget in bytes for all cached values
+        :param protected_ratio: Share of the budget for the protected segment
+        """
+        self.capacity = capacity
+        self.protected_capacity = int(capacity * protected_ratio)
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+        # chunk_id -> keys cached for it, for invalidation
+        self._keys = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Look up a cached value.
+        :param key: (chunk_id, part) tuple
+        :return: The value, or None on a miss
+        """
+        with self._lock:
+            value = self._protected.get(key)
+            if value is not None:
+                self._protected.move_to_end(key)
+                self.hits += 1
+                return value
+            value = self._probation.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            # Second hit: promote, demoting protected entries to make room
+            self._probation_bytes -= len(value)
+            self._protected[key] = value
+            self._protected_bytes += len(value)
+            while self._protected_bytes > self.protected_capacity:
+                old_key, old_value = self._protected.popitem(last=False)
+                self._protected_bytes -= len(old_value)
+                self._probation[old_key] = old_value
+                self._probation_bytes += len(old_value)
+            self._evict()
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Cache a value. Values bigger than the probation segment are skipped.
+        :param key: (chunk_id, part) tuple
+        :param value: bytes-like value; its length is charged to the budget
+        """
+        if len(value) > self.capacity - self.protected_capacity:
+            return
+        with self._lock:
+            if key in self._protected or key in self._probation:
+                return
+            self._probation[key] = value
+            self._probation_bytes += len(value)
+            self._keys.setdefault(key[0], set()).add(key)
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held
+        while self._probation_bytes + self._protected_bytes > self.capacity:
+            if self._probation:
+                key, value = self._probation.popitem(last=False)
+                self._probation_bytes -= len(value)
+            else:
+                key, value = self._protected.popitem(last=False)
+                self._protected_bytes -= len(value)
+            self._forget(key)
+            self.evictions += 1
+
+    def _forget(self, key):
+        keys = self._keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[key[0]]
+
+    def invalidate(self, chunk_id):
+        """
+        Drop everything cached for a chunk.
+        :param chunk_id: ID of the chunk
+        """
+        with self._lock:
+            for key in self._keys.pop(chunk_id, ()):
+                value = self._probation.pop(key, None)
+                if value is not None:
+                    self._probation_bytes -= len(value)
+                value = self._protected.pop(key, None)
+                if value is not None:
+                    self._protected_bytes -= len(value)
+                self.invalidations += 1
+
+    def stats(self):
+        """Return the cache counters as a {name: count} dict."""
+        with self._lock:
+            return {
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cache_evictions": self.evictions,
+                "cache_invalidations": self.invalidations,
+                "cache_bytes": self._probation_bytes + self._protected_bytes,
+                "cache_capacity": self.capacity,
+                "cache_entries": len(self._probation) + len(self._protected),
+            }
@@ -0,0 +1,84 @@
+import hashlib
+
+# Optional faster hashes; only needed when a cluster selects them
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_ALGORITHM = "sha256"
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _blake3(data):
+    return blake3.blake3(data).hexdigest()
+
+
+def _xxh3(data):
+    # 128-bit variant: non-cryptographic, but wide enough to key chunks
+    return xxhash.xxh3_128_hexdigest(data)
+
+
+ALGORITHMS = {"sha256": _sha256, "blake3": _blake3, "xxh3": _xxh3}
+# Hex digits in each algorithm's digest
+DIGEST_LENGTHS = {"sha256": 64, "blake3": 64, "xxh3": 32}
+# Modules each algorithm needs beyond the standard library
+_REQUIRES = {"blake3": blake3, "xxh3": xxhash}
+
+
+def available_algorithms():
+    """Return the names of the hash algorithms usable in this process."""
+    return [name for name in ALGORITHMS if _REQUIRES.get(name, hashlib) is not None]
+
+
+def get_hasher(algorithm):
+    """
+    Look up a content hash function.
+    :param algorithm: "sha256", "blake3" or "xxh3"
+    :return: Function mapping bytes to a hex digest
+    :raises ValueError: If the algorithm is unknown or its package is missing
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown chunk hash algorithm: {algorithm}")
+    if algorithm not in available_algorithms():
+        raise ValueError(f"Chunk hash algorithm {algorithm} is not installed")
+    return ALGORITHMS[algorithm]
+
+
+def make_chunk_id(digest, algorithm):
+    """
+    Build a chunk id from a digest. SHA-256 ids stay bare hex so chunks
+    stored before hashing was pluggable keep their ids; other algorithms
+    are prefixed so ids from a mixed cluster never collide.
+    """
+    if algorithm == DEFAULT_ALGORITHM:
+        return digest
+    return f"{algorithm}-{digest}"
+
+
+def algorithm_of(chunk_id):
+    """Return the hash algorithm a chunk id was made with."""
+    algorithm, sep, _ = chunk_id.partition("-")
+    return algorithm if sep and algorithm in ALGORITHMS else DEFAULT_ALGORITHM
+
+
+def is_valid_chunk_id(chunk_id):
+    """
+    Check that a chunk id from a client is built the way make_chunk_id
+    builds one: a lowercase hex digest of the right length for its
+    algorithm, prefixed unless it is SHA-256.
+    """
+    algorithm = algorithm_of(chunk_id)
+    digest = chunk_id
+    if algorithm != DEFAULT_ALGORITHM:
+        digest = chunk_id[len(algorithm) + 1 :]
+    return len(digest) == DIGEST_LENGTHS[algorithm] and all(
+        c in "0123456789abcdef" for c in digest
+    )
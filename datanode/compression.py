@@ -0,0 +1,405 @@
+import bisect
+import io
+import struct
+import zlib
+
+# Optional codecs; only needed when a data node is configured to use them
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Header of every chunk written by this module: magic, codec id. Chunks
+# without it are legacy gzip streams, which always start with GZIP_MAGIC.
+CHUNK_HEADER = struct.Struct("<4sB")
+CHUNK_MAGIC = b"DFSC"
+GZIP_MAGIC = b"\x1f\x8b"
+# Framed chunks are a series of independently compressed frames followed
+# by a frame index (one entry per frame) and a footer, so a range can be
+# decoded from just the frames it covers.
+FRAMED_MAGIC = b"DFSF"
+# Stored length, raw length, whether the frame is compressed
+FRAME_ENTRY = struct.Struct("<IIB")
+# Number of frames, magic
+FRAME_FOOTER = struct.Struct("<I4s")
+FOOTER_MAGIC = b"DFSI"
+DEFAULT_FRAME_SIZE = 256 * 1024
+# Cache keys are (chunk_id, part): a frame number, the frame index, or the
+# whole decoded chunk for unframed compressed chunks
+INDEX_PART = "index"
+WHOLE_PART = "all"
+
+CODECS = {"none": 0, "zlib": 1, "lz4": 2, "zstd": 3}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODECS.items()}
+DEFAULT_LEVELS = {"none": 0, "zlib": 6, "lz4": 0, "zstd": 3}
+# Modules each codec needs beyond the standard library
+_REQUIRES = {"lz4": lz4, "zstd": zstandard}
+
+# Adaptive mode compresses this much of a chunk first and stores the chunk
+# uncompressed unless the sample shrinks to at most MIN_RATIO of its size
+SAMPLE_SIZE = 256 * 1024
+MIN_RATIO = 0.9
+# Compressed input fed to a decompressor per step
+DECODE_BLOCK_SIZE = 256 * 1024
+
+
+def available_codecs():
+    """Return the names of the codecs usable in this process."""
+    return [name for name in CODECS if _REQUIRES.get(name, zlib) is not None]
+
+
+def _check_codec(codec):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown chunk codec: {codec}")
+    if codec not in available_codecs():
+        raise ValueError(f"Chunk codec {codec} is not installed")
+
+
+def _compressor(codec, level):
+    # Object with compress(data) -> bytes and flush() -> bytes
+    if codec == "zlib":
+        return zlib.compressobj(level)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if codec == "lz4":
+        return _Lz4Compressor(level)
+    raise ValueError(f"Codec {codec} does not compress")
+
+
+class _Lz4Compressor:
+    def __init__(self, level):
+        self._compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self._begun = False
+
+    def compress(self, data):
+        prefix = b""
+        if not self._begun:
+            prefix = self._compressor.begin()
+            self._begun = True
+        return prefix + self._compressor.compress(data)
+
+    def flush(self):
+        return self.compress(b"") + self._compressor.flush()
+
+
+def _frame_compressor(codec, level):
+    # One-shot compression of a whole frame
+    if codec == "zlib":
+        return lambda data: zlib.compress(data, level)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress
+    if codec == "lz4":
+        return lambda data: lz4.frame.compress(data, compression_level=level)
+    raise ValueError(f"Codec {codec} does not compress")
+
+
+def _decompress_frame(codec, data):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "lz4":
+        return lz4.frame.decompress(data)
+    raise ValueError(f"Unknown chunk codec: {codec}")
+
+
+def _decompressor(codec_id):
+    # Object with decompress(data) -> bytes
+    if codec_id == CODECS["zlib"]:
+        return zlib.decompressobj()
+    if codec_id == CODECS["zstd"]:
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec_id == CODECS["lz4"]:
+        return lz4.frame.LZ4FrameDecompressor()
+    raise ValueError(f"Unknown chunk codec id: {codec_id}")
+
+
+class ChunkCodec:
+    def __init__(
+        self, codec="zlib", level=None, adaptive=True, frame_size=DEFAULT_FRAME_SIZE
+    ):
+        """
+        Encodes chunks for storage and decodes stored ranges.
+        :param codec: "none", "zlib", "lz4" or "zstd"
+        :param level: Compression level, None for the codec's default
+        :param adaptive: Store a chunk uncompressed when a sample of it
+                         does not compress well
+        :param frame_size: Raw bytes per independently compressed frame, 0 to
+                           compress each chunk as a single stream
+        :raises ValueError: If the codec is unknown or its package is missing
+        """
+        _check_codec(codec)
+        self.codec = codec
+        self.level = DEFAULT_LEVELS[codec] if level is None else level
+        self.adaptive = adaptive and codec != "none"
+        self.frame_size = frame_size
+
+    def _worth_compressing(self, sample):
+        compressor = _compressor(self.codec, self.level)
+        size = len(compressor.compress(sample)) + len(compressor.flush())
+        return size <= len(sample) * MIN_RATIO
+
+    def encode(self, parts):
+        """
+        Encode a chunk for storage, part by part.
+        :param parts: Iterable of the chunk's raw bytes, in order
+        :return: Generator of the stored bytes
+        """
+        parts = iter(parts)
+        codec = self.codec
+        if self.adaptive:
+            # Hold back the first parts until a full sample is available
+            head = []
+            sampled = 0
+            for part in parts:
+                head.append(part)
+                sampled += len(part)
+                if sampled >= SAMPLE_SIZE:
+                    break
+            sample = b"".join(head)[:SAMPLE_SIZE]
+            if sample and not self._worth_compressing(sample):
+                codec = "none"
+            parts = _chain(head, parts)
+
+        if codec != "none" and self.frame_size:
+            yield from self._encode_frames(parts, codec)
+            return
+        yield CHUNK_HEADER.pack(CHUNK_MAGIC, CODECS[codec])
+        if codec == "none":
+            yield from parts
+            return
+        compressor = _compressor(codec, self.level)
+        for part in parts:
+            data = compressor.compress(part)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def _encode_frames(self, parts, codec):
+        compress = _frame_compressor(codec, self.level)
+        index = []
+
+        def frame(data):
+            # Frames that do not shrink are kept raw
+            compressed = compress(data)
+            if len(compressed) < len(data):
+                index.append(FRAME_ENTRY.pack(len(compressed), len(data), 1))
+                return compressed
+            index.append(FRAME_ENTRY.pack(len(data), len(data), 0))
+            return data
+
+        yield CHUNK_HEADER.pack(FRAMED_MAGIC, CODECS[codec])
+        # Cut the parts into frame_size frames without copying whole parts
+        pending = b""
+        for part in parts:
+            view = memoryview(part)
+            if pending:
+                needed = self.frame_size - len(pending)
+                pending += view[:needed]
+                view = view[needed:]
+                if len(pending) < self.frame_size:
+                    continue
+                yield frame(pending)
+                pending = b""
+            while len(view) >= self.frame_size:
+                yield frame(view[: self.frame_size])
+                view = view[self.frame_size :]
+            pending = bytes(view)
+        if pending:
+            yield frame(pending)
+        yield b"".join(index) + FRAME_FOOTER.pack(len(index), FOOTER_MAGIC)
+
+
+def _chain(head, rest):
+    yield from head
+    yield from rest
+
+
+def _parse_header(stored):
+    # (codec name, whether the chunk is framed)
+    if bytes(stored[:2]) == GZIP_MAGIC:
+        return "gzip", False
+    if len(stored) < CHUNK_HEADER.size:
+        raise ValueError("Truncated chunk header")
+    magic, codec_id = CHUNK_HEADER.unpack(bytes(stored[: CHUNK_HEADER.size]))
+    if magic not in (CHUNK_MAGIC, FRAMED_MAGIC) or codec_id not in CODEC_NAMES:
+        raise ValueError("Unknown stored chunk format")
+    return CODEC_NAMES[codec_id], magic == FRAMED_MAGIC
+
+
+def codec_of(stored):
+    """
+    Return the name of the codec a stored chunk was written with.
+    :param stored: The first bytes of the stored chunk
+    """
+    return _parse_header(stored)[0]
+
+
+def _read_framed_range(read_at, size, codec, offset, length, cache, chunk_id):
+    # Decode [offset, offset + length) of a framed chunk from only the
+    # frames it covers. read_at(position, count) reads stored bytes.
+    index = cache.get((chunk_id, INDEX_PART)) if cache is not None else None
+    if index is None:
+        count, magic = FRAME_FOOTER.unpack(
+            bytes(read_at(size - FRAME_FOOTER.size, FRAME_FOOTER.size))
+        )
+        if magic != FOOTER_MAGIC:
+            raise ValueError("Framed chunk has no frame index")
+        index_size = count * FRAME_ENTRY.size
+        index = bytes(read_at(size - FRAME_FOOTER.size - index_size, index_size))
+        if cache is not None:
+            cache.put((chunk_id, INDEX_PART), index)
+    frames = []  # (stored offset, stored length, compressed)
+    raw_starts = []
+    stored_position = CHUNK_HEADER.size
+    raw_position = 0
+    for stored_length, raw_length, compressed in FRAME_ENTRY.iter_unpack(index):
+        frames.append((stored_position, stored_length, compressed))
+        raw_starts.append(raw_position)
+        stored_position += stored_length
+        raw_position += raw_length
+
+    end = min(offset + length, raw_position) if length else raw_position
+    # Frames are written out as they are decoded, so only one decoded frame
+    # is held besides the result (BytesIO hands over its buffer uncopied)
+    out = io.BytesIO()
+    first = max(bisect.bisect_right(raw_starts, offset) - 1, 0)
+    for i in range(first, len(frames)):
+        if raw_starts[i] >= end:
+            break
+        stored_offset, stored_length, compressed = frames[i]
+        if compressed:
+            # Raw frames are served from the page cache instead
+            data = cache.get((chunk_id, i)) if cache is not None else None
+            if data is None:
+                data = _decompress_frame(codec, read_at(stored_offset, stored_length))
+                if cache is not None:
+                    cache.put((chunk_id, i), data)
+        else:
+            data = read_at(stored_offset, stored_length)
+        start = max(offset - raw_starts[i], 0)
+        out.write(memoryview(data)[start : end - raw_starts[i]])
+    return out.getvalue()
+
+
+def _decode_blocks(blocks, codec, offset, length):
+    # Decompress from the start, keeping only [offset, offset + length)
+    if codec == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    else:
+        _check_codec(codec)
+        decompressor = _decompressor(CODECS[codec])
+    # zlib can bound each step's output, so a skipped prefix is never held
+    bounded = codec in ("gzip", "zlib")
+    end = offset + length if length else None
+    position = 0
+    parts = []
+    blocks = iter(blocks)
+    while end is None or position < end:
+        if bounded and decompressor.unconsumed_tail:
+            block = decompressor.unconsumed_tail
+        else:
+            block = next(blocks, b"")
+            if not block:
+                break
+        if bounded:
+            data = decompressor.decompress(block, DECODE_BLOCK_SIZE)
+        else:
+            data = decompressor.decompress(block)
+        start = max(offset - position, 0)
+        stop = len(data) if end is None else min(end - position, len(data))
+        if start < stop:
+            parts.append(data[start:stop])
+        position += len(data)
+    return parts[0] if len(parts) == 1 else b"".join(parts)
+
+
+def _read_stream_range(decode, offset, length, cache, chunk_id):
+    # Unframed compressed chunks cannot be decoded piecewise, so they are
+    # cached whole, once a read has decoded all of them anyway
+    data = cache.get((chunk_id, WHOLE_PART)) if cache is not None else None
+    if data is not None:
+        return data[offset : offset + length if length else len(data)]
+    data = decode(offset, length)
+    if cache is not None and not offset and not length:
+        cache.put((chunk_id, WHOLE_PART), data)
+    return data
+
+
+def read_file_range(f, offset=0, length=0, cache=None, chunk_id=None):
+    """
+    Read a range of a stored chunk from a file object, decompressing only
+    as far as the range needs.
+    :param f: Readable, seekable file object of the stored chunk
+    :param offset: First byte of the range
+    :param length: Number of bytes to read, 0 to read to the end
+    :param cache: Optional ChunkCache of decoded data
+    :param chunk_id: ID of the chunk, needed with a cache
+    :return: Binary data of the range
+    """
+    codec, framed = _parse_header(f.read(CHUNK_HEADER.size))
+    if framed:
+
+        def read_at(position, count):
+            f.seek(position)
+            return f.read(count)
+
+        return _read_framed_range(
+            read_at, f.seek(0, 2), codec, offset, length, cache, chunk_id
+        )
+    if codec == "none":
+        f.seek(CHUNK_HEADER.size + offset)
+        return f.read(length or -1)
+
+    def decode(offset, length):
+        f.seek(0 if codec == "gzip" else CHUNK_HEADER.size)
+        blocks = iter(lambda: f.read(DECODE_BLOCK_SIZE), b"")
+        return _decode_blocks(blocks, codec, offset, length)
+
+    return _read_stream_range(decode, offset, length, cache, chunk_id)
+
+
+def read_mapped_range(view, offset=0, length=0, cache=None, chunk_id=None):
+    """
+    Read a range of a stored chunk from a memory mapping. Uncompressed
+    chunks are sliced straight out of the mapping, so the returned bytes
+    are the only copy; compressed chunks are decoded from the mapping
+    without reading the stored data into memory first.
+    :param view: memoryview of the stored chunk
+    :param offset: First byte of the range
+    :param length: Number of bytes to read, 0 to read to the end
+    :param cache: Optional ChunkCache of decoded data
+    :param chunk_id: ID of the chunk, needed with a cache
+    :return: Binary data of the range
+    """
+    codec, framed = _parse_header(view[: CHUNK_HEADER.size])
+    if framed:
+        return _read_framed_range(
+            lambda position, count: view[position : position + count],
+            len(view),
+            codec,
+            offset,
+            length,
+            cache,
+            chunk_id,
+        )
+    if codec == "none":
+        data = view[CHUNK_HEADER.size :]
+        return bytes(data[offset : offset + length if length else len(data)])
+
+    def decode(offset, length):
+        payload = view if codec == "gzip" else view[CHUNK_HEADER.size :]
+        if codec in ("gzip", "zlib") and not offset and not length:
+            wbits = 16 + zlib.MAX_WBITS if codec == "gzip" else zlib.MAX_WBITS
+            return zlib.decompress(payload, wbits)
+        blocks = (
+            payload[i : i + DECODE_BLOCK_SIZE]
+            for i in range(0, len(payload), DECODE_BLOCK_SIZE)
+        )
+        return _decode_blocks(blocks, codec, offset, length)
+
+    return _read_stream_range(decode, offset, length, cache, chunk_id)
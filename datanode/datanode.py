@@ -1,51 +1,241 @@
 import grpc
 from concurrent import futures
 import os
-import gzip
+import queue
+import threading
 import dfs_pb2_grpc
 import dfs_pb2
+import chunk_hash
+from chunk_cache import ChunkCache
+from compression import ChunkCodec, read_file_range, read_mapped_range
+from single_flight import SingleFlight
+from storage import FileStore, SegmentStore
 
 CHUNK_DIR = "./chunks/"
+# A full 64MB chunk plus protobuf framing must fit in a single message
+MAX_MESSAGE_LENGTH = 65 * 1024 * 1024
+CHANNEL_OPTIONS = [
+    ("grpc.max_send_message_length", MAX_MESSAGE_LENGTH),
+    ("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH),
+]
+# How often a frame waiting for room in the forward queue checks whether
+# the next hop has given up
+FORWARD_POLL_INTERVAL = 0.5
+
+
+def open_store():
+    """
+    Create the chunk store selected by STORAGE_ENGINE: "file" keeps one file
+    per chunk, "segment" appends chunks to large log-structured segments.
+    """
+    engine = os.getenv("STORAGE_ENGINE", "file")
+    if engine == "file":
+        return FileStore(CHUNK_DIR)
+    if engine == "segment":
+        return SegmentStore(
+            CHUNK_DIR,
+            segment_size=int(
+                os.getenv("SEGMENT_SIZE", str(1024 * 1024 * 1024))),
+            compact_ratio=float(os.getenv("SEGMENT_COMPACT_RATIO", "0.5")),
+            compact_interval=float(
+                os.getenv("SEGMENT_COMPACT_INTERVAL", "60")),
+            checkpoint_bytes=int(
+                os.getenv("SEGMENT_CHECKPOINT_BYTES", str(256 * 1024 * 1024))),
+        )
+    raise ValueError(f"Unknown STORAGE_ENGINE: {engine}")
 
 
 class DataNodeService(dfs_pb2_grpc.DataNodeServiceServicer):
-    def __init__(self):
-        if not os.path.exists(CHUNK_DIR):
-            os.makedirs(CHUNK_DIR)
+    def __init__(self, store=None):
+        self.store = store or open_store()
+        # How chunks are compressed at rest; with CHUNK_CODEC_ADAPTIVE,
+        # chunks that barely compress (media, archives) are stored as is.
+        # Compressed chunks are cut into CHUNK_FRAME_SIZE frames so ranged
+        # reads only decompress the frames they touch.
+        level = os.getenv("CHUNK_CODEC_LEVEL")
+        self.codec = ChunkCodec(
+            os.getenv("CHUNK_CODEC", "zlib"),
+            level=int(level) if level else None,
+            adaptive=os.getenv("CHUNK_CODEC_ADAPTIVE", "1") == "1",
+            frame_size=int(os.getenv("CHUNK_FRAME_SIZE", str(256 * 1024))),
+        )
+        # Decoded frames/chunks of hot chunks; CHUNK_CACHE_BYTES=0 disables it
+        cache_bytes = int(os.getenv("CHUNK_CACHE_BYTES", str(256 * 1024 * 1024)))
+        self.cache = ChunkCache(cache_bytes) if cache_bytes else None
+        # "mmap" serves reads from memory mappings, "stream" through read()
+        self.mmap_reads = os.getenv("READ_PATH", "mmap") == "mmap"
+        # Concurrent requests for the same chunk range share one read/decode
+        self._reads = SingleFlight()
+        # Long-lived channels to the data nodes we forward pipelined chunks to
+        self._stubs = {}
+        self._stubs_lock = threading.Lock()
+        # Frames of a pipelined chunk buffered for the next hop; a slow hop
+        # slows the upload down instead of piling the chunk up in memory
+        self.forward_queue_frames = int(
+            os.getenv("PIPELINE_QUEUE_FRAMES", "16"))
+        # Most seconds the next hop gets, whatever the caller's deadline
+        self.pipeline_timeout = float(os.getenv("PIPELINE_TIMEOUT", "60"))
+
+    def _get_stub(self, data_node):
+        with self._stubs_lock:
+            stub = self._stubs.get(data_node)
+            if stub is None:
+                channel = grpc.insecure_channel(data_node, options=CHANNEL_OPTIONS)
+                stub = dfs_pb2_grpc.DataNodeServiceStub(channel)
+                self._stubs[data_node] = stub
+            return stub
+
+    @staticmethod
+    def _key(context, block_pool, chunk_id):
+        # Store key of a chunk: each block pool (namespace partition) keeps
+        # its own copy, so deletes from one leader never hit another's
+        # chunks. ":" never occurs in chunk ids. Keys name files under
+        # CHUNK_DIR, so neither part may lead out of it.
+        if not chunk_hash.is_valid_chunk_id(chunk_id):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          f"Invalid chunk id: {chunk_id!r}")
+        if any(part in block_pool for part in ("/", "\\", "..")):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          f"Invalid block pool: {block_pool!r}")
+        return f"{block_pool}:{chunk_id}" if block_pool else chunk_id
 
     def StoreChunk(self, request, context):
-        chunk_id = request.chunk_id
-        chunk_data = gzip.compress(request.data)
-        with open(f"{CHUNK_DIR}{chunk_id}", "wb") as f:
-            f.write(chunk_data)
+        key = self._key(context, request.block_pool, request.chunk_id)
+        self.store.put(key, self.codec.encode([request.data]))
+        return dfs_pb2.StoreChunkResponse(success=True, message="Chunk stored")
+
+    def StoreChunkPipeline(self, request_iterator, context):
+        header = next(request_iterator, None)
+        if header is None or header.WhichOneof("frame") != "header":
+            context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT,
+                "Pipeline stream must start with a header frame",
+            )
+        chunk_id = header.header.chunk_id
+        block_pool = header.header.block_pool
+        key = self._key(context, block_pool, chunk_id)
+        downstream = list(header.header.downstream)
+
+        # Open the next hop of the chain before any data arrives. It
+        # inherits this call's deadline, and is cancelled with it, so two
+        # nodes forwarding to each other cannot hold their threads forever.
+        forward = next_hop = None
+        if downstream:
+            forward = queue.Queue(maxsize=self.forward_queue_frames)
+            # Without a deadline grpc reports an enormous time remaining
+            remaining = context.time_remaining()
+            timeout = self.pipeline_timeout if remaining is None else min(
+                remaining, self.pipeline_timeout)
+            next_hop = self._get_stub(downstream[0]).StoreChunkPipeline.future(
+                self._forward_frames(
+                    chunk_id, block_pool, downstream[1:], forward),
+                timeout=timeout,
+            )
+            context.add_callback(next_hop.cancel)
+
+        # Stream each frame on and encode it into the store as it arrives
+        try:
+            self.store.put(key, self.codec.encode(
+                self._receive_frames(request_iterator, forward, next_hop)))
+        except Exception:
+            if forward is not None:
+                next_hop.cancel()
+            raise
+        if forward is not None:
+            self._forward(forward, None, next_hop)
+
+        # Only ack once the rest of the chain has committed the chunk too
+        if forward is not None:
+            try:
+                response = next_hop.result()
+            except grpc.RpcError as e:
+                response = dfs_pb2.StoreChunkResponse(
+                    success=False,
+                    message=f"Forwarding to {downstream[0]} failed: {e.details()}",
+                )
+            if not response.success:
+                return response
         return dfs_pb2.StoreChunkResponse(success=True, message="Chunk stored")
 
+    @classmethod
+    def _receive_frames(cls, request_iterator, forward, next_hop):
+        for frame in request_iterator:
+            # Once the next hop fails, keep storing here; its result says why
+            if forward is not None and not cls._forward(
+                    forward, frame.data, next_hop):
+                forward = None
+            yield frame.data
+
+    @staticmethod
+    def _forward(forward, data, next_hop):
+        """
+        Queue a frame for the next hop, waiting while the queue is full.
+        :return: False if the next hop finished, and takes no more frames
+        """
+        while not next_hop.done():
+            try:
+                forward.put(data, timeout=FORWARD_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _forward_frames(self, chunk_id, block_pool, downstream, forward):
+        yield dfs_pb2.ChunkFrame(
+            header=dfs_pb2.ChunkPipelineHeader(
+                chunk_id=chunk_id, downstream=downstream,
+                block_pool=block_pool)
+        )
+        while True:
+            data = forward.get()
+            if data is None:
+                return
+            yield dfs_pb2.ChunkFrame(data=data)
+
     def RetrieveChunk(self, request, context):
         chunk_id = request.chunk_id
+        key = self._key(context, request.block_pool, chunk_id)
         try:
-            with open(f"{CHUNK_DIR}{chunk_id}", "rb") as f:
-                chunk_data = gzip.decompress(f.read())
-            return dfs_pb2.Chunk(chunk_id=chunk_id, data=chunk_data)
+            chunk_data = self._reads.do(
+                (key, request.offset, request.length), self._read_range,
+                key, request.offset, request.length)
+            return dfs_pb2.Chunk(chunk_id=chunk_id, data=chunk_data,
+                                 block_pool=request.block_pool)
         except FileNotFoundError:
             context.set_code(grpc.StatusCode.NOT_FOUND)
             context.set_details("Chunk not found")
             return dfs_pb2.Chunk()
 
+    def _read_range(self, key, offset, length):
+        if self.mmap_reads:
+            with self.store.map(key) as chunk:
+                return read_mapped_range(
+                    chunk.view, offset, length, self.cache, key)
+        with self.store.open(key) as f:
+            return read_file_range(f, offset, length, self.cache, key)
+
     def DeleteChunk(self, request, context):
-        chunk_id = request.chunk_id
+        key = self._key(context, request.block_pool, request.chunk_id)
         try:
-            os.remove(f"{CHUNK_DIR}{chunk_id}")
+            self.store.delete(key)
+            if self.cache is not None:
+                self.cache.invalidate(key)
             return dfs_pb2.DeleteChunkResponse(success=True, message="Chunk deleted")
         except FileNotFoundError:
             return dfs_pb2.DeleteChunkResponse(success=False, message="Chunk not found")
 
     def Heartbeat(self, request, context):
-        return dfs_pb2.HeartbeatResponse(alive=True)
+        stats = self.cache.stats() if self.cache is not None else {}
+        stats["reads_coalesced"] = self._reads.coalesced
+        return dfs_pb2.HeartbeatResponse(alive=True, stats=stats)
 
 
 # Start gRPC server
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        options=CHANNEL_OPTIONS,
+    )
     dfs_pb2_grpc.add_DataNodeServiceServicer_to_server(
         DataNodeService(), server)
     server.add_insecure_port("[::]:5001")
@@ -0,0 +1,475 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+
+class MappedChunk:
+    """
+    Read-only memory mapping of a stored chunk. view is a memoryview of the
+    chunk's bytes; slicing it does not copy. Close (or use as a context
+    manager) once no slices of the view are in use any more.
+    """
+
+    def __init__(self, fd, offset, length):
+        if length == 0:
+            # Empty ranges cannot be mapped
+            self._map = None
+            self.view = memoryview(b"")
+            return
+        # Mappings must start on an allocation boundary
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        self._map = mmap.mmap(
+            fd, offset - start + length, access=mmap.ACCESS_READ, offset=start
+        )
+        self.view = memoryview(self._map)[offset - start :]
+
+    def close(self):
+        self.view.release()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FileStore:
+    """One file per chunk under a directory (the original layout)."""
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def _path(self, chunk_id):
+        return os.path.join(self.root, chunk_id)
+
+    def put(self, chunk_id, parts):
+        """
+        Store a chunk, writing its parts as they are produced.
+        :param chunk_id: ID of the chunk
+        :param parts: Iterable of the stored bytes, in order
+        """
+        tmp_path = self._path(chunk_id) + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for part in parts:
+                    f.write(part)
+            os.replace(tmp_path, self._path(chunk_id))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, chunk_id):
+        """
+        Open a stored chunk for reading.
+        :raises FileNotFoundError: If the chunk is not stored
+        """
+        return open(self._path(chunk_id), "rb")
+
+    def map(self, chunk_id):
+        """
+        Memory-map a stored chunk.
+        :raises FileNotFoundError: If the chunk is not stored
+        :return: MappedChunk over the whole chunk
+        """
+        with open(self._path(chunk_id), "rb") as f:
+            return MappedChunk(f.fileno(), 0, os.fstat(f.fileno()).st_size)
+
+    def delete(self, chunk_id):
+        """
+        Delete a stored chunk.
+        :raises FileNotFoundError: If the chunk is not stored
+        """
+        os.remove(self._path(chunk_id))
+
+    def close(self):
+        pass
+
+
+class _RangeReader:
+    # File-like view of one record's data inside a segment file. Reads go
+    # through its own duplicate of the segment's descriptor, so the reader
+    # stays valid if compaction deletes the segment meanwhile.
+
+    def __init__(self, fd, offset, length):
+        self._fd = fd
+        self._start = offset
+        self._position = offset
+        self._end = offset + length
+
+    def read(self, size=-1):
+        remaining = self._end - self._position
+        if size < 0 or size > remaining:
+            size = remaining
+        data = os.pread(self._fd, size, self._position) if size else b""
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = self._end if whence == os.SEEK_END else self._start
+        self._position = min(max(base + offset, self._start), self._end)
+        return self._position - self._start
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SegmentStore:
+    """
+    Log-structured store: chunks are appended to large segment files and
+    located through an in-memory chunk_id -> (segment, offset, length)
+    index. The index is checkpointed to disk by a background thread every
+    checkpoint_bytes of log, so a restart only replays the log written
+    since; writes carry on while a checkpoint is encoded and synced.
+    Another background thread compacts segments whose space is mostly
+    taken by deleted or replaced chunks and by deletion records.
+    """
+
+    # magic, record type, chunk id length, data length, data crc32
+    RECORD_HEADER = struct.Struct("<4sBHQI")
+    MAGIC = b"DSEG"
+    PUT = 0
+    DELETE = 1
+    INDEX_FILE = "index.json"
+
+    def __init__(
+        self,
+        root,
+        segment_size=1024 * 1024 * 1024,
+        checkpoint_bytes=256 * 1024 * 1024,
+        compact_ratio=0.5,
+        compact_interval=60,
+        sync=False,
+    ):
+        """
+        :param root: Directory holding the segment files and index checkpoint
+        :param segment_size: Size at which the active segment is rolled over
+        :param checkpoint_bytes: Index checkpoint after this many bytes of log
+        :param compact_ratio: Fraction of dead bytes that makes a sealed
+                              segment eligible for compaction
+        :param compact_interval: Seconds between compaction passes (0 disables)
+        :param sync: fsync every record before acknowledging it
+        """
+        self.root = root
+        self.segment_size = segment_size
+        self.checkpoint_bytes = checkpoint_bytes
+        self.compact_ratio = compact_ratio
+        self.sync = sync
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+        self._lock = threading.Lock()
+        self._index = {}  # chunk_id -> (segment, data offset, data length)
+        self._dead = {}  # segment -> bytes no longer referenced
+        # segment -> ids of chunks whose replaced or deleted records it holds
+        self._shadowed = {}
+        # segment -> ids of chunks whose deletion records it holds
+        self._tombstones = {}
+        self._fds = {}  # segment -> read descriptor
+        self._appended = 0  # bytes of log written since the last checkpoint
+        # Checkpoints are written one at a time, in the order taken
+        self._checkpoint_lock = threading.Lock()
+        self._recover()
+
+        self._closed = threading.Event()
+        self._checkpoint_requested = threading.Event()
+        self._checkpointer = threading.Thread(
+            target=self._checkpoint_loop, daemon=True
+        )
+        self._checkpointer.start()
+        if compact_interval:
+            self._compactor = threading.Thread(
+                target=self._compact_loop, args=(compact_interval,), daemon=True
+            )
+            self._compactor.start()
+
+    # -- files -------------------------------------------------------------
+
+    def _segment_path(self, segment):
+        return os.path.join(self.root, f"{segment:08d}.seg")
+
+    def _segments(self):
+        return sorted(
+            int(name[:-4]) for name in os.listdir(self.root) if name.endswith(".seg")
+        )
+
+    def _open_segment(self, segment):
+        self._active = segment
+        self._writer = open(self._segment_path(segment), "ab")
+        self._active_size = self._writer.tell()
+        self._fds[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        self._dead.setdefault(segment, 0)
+
+    # -- recovery ----------------------------------------------------------
+
+    def _recover(self):
+        # Start from the last checkpoint, then replay what was appended after
+        segment, offset = 0, 0
+        index_path = os.path.join(self.root, self.INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                checkpoint = json.load(f)
+            self._index = {k: tuple(v) for k, v in checkpoint["index"].items()}
+            self._dead = {int(k): v for k, v in checkpoint["dead"].items()}
+            self._shadowed = {
+                int(k): set(v) for k, v in checkpoint["shadowed"].items()
+            }
+            self._tombstones = {
+                int(k): set(v) for k, v in checkpoint["tombstones"].items()
+            }
+            segment, offset = checkpoint["segment"], checkpoint["offset"]
+
+        segments = [s for s in self._segments() if s >= segment]
+        for s in segments:
+            self._replay(s, offset if s == segment else 0)
+        # Segments compacted away after the checkpoint leave stale entries
+        existing = self._segments()
+        self._dead = {s: d for s, d in self._dead.items() if s in existing}
+        self._shadowed = {
+            s: ids for s, ids in self._shadowed.items() if s in existing
+        }
+        self._tombstones = {
+            s: ids for s, ids in self._tombstones.items() if s in existing
+        }
+        for s in existing:
+            self._fds.setdefault(s, os.open(self._segment_path(s), os.O_RDONLY))
+            self._dead.setdefault(s, 0)
+        self._open_segment(segments[-1] if segments else segment)
+
+    def _replay(self, segment, offset):
+        path = self._segment_path(segment)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(self.RECORD_HEADER.size)
+                if len(header) < self.RECORD_HEADER.size:
+                    break
+                magic, kind, id_length, length, crc = self.RECORD_HEADER.unpack(header)
+                chunk_id = f.read(id_length).decode()
+                data_offset = f.tell()
+                data = f.read(length) if kind == self.PUT else b""
+                if magic != self.MAGIC or len(data) != length or (
+                    zlib.crc32(data) != crc
+                ):
+                    break
+                self._apply(kind, chunk_id, (segment, data_offset, length))
+                offset = f.tell()
+        # Drop a record torn by a crash so new appends start on a boundary
+        if os.path.getsize(path) > offset:
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+    def _record_size(self, chunk_id, length):
+        return self.RECORD_HEADER.size + len(chunk_id.encode()) + length
+
+    def _apply(self, kind, chunk_id, location):
+        # A replaced record is dead whole, header included. So is a deletion
+        # record from the start: it is only kept while an older segment
+        # still holds a record it hides
+        old = self._index.pop(chunk_id, None)
+        if old is not None:
+            size = self._record_size(chunk_id, old[2])
+            self._dead[old[0]] = self._dead.get(old[0], 0) + size
+            self._shadowed.setdefault(old[0], set()).add(chunk_id)
+        if kind == self.PUT:
+            self._index[chunk_id] = location
+        else:
+            segment = location[0]
+            size = self._record_size(chunk_id, 0)
+            self._dead[segment] = self._dead.get(segment, 0) + size
+            self._tombstones.setdefault(segment, set()).add(chunk_id)
+
+    def _checkpoint(self):
+        # Called without the lock: only the snapshot is taken under it (the
+        # index values are immutable tuples, so a shallow copy will do), and
+        # encoding and syncing it hold up no reads or writes
+        with self._checkpoint_lock:
+            with self._lock:
+                self._writer.flush()
+                log_fd = os.dup(self._writer.fileno())
+                checkpoint = {
+                    "segment": self._active,
+                    "offset": self._active_size,
+                    "index": dict(self._index),
+                    "dead": dict(self._dead),
+                    "shadowed": {
+                        s: sorted(ids) for s, ids in self._shadowed.items()
+                    },
+                    "tombstones": {
+                        s: sorted(ids) for s, ids in self._tombstones.items()
+                    },
+                }
+                self._appended = 0
+            # The log is synced first so the index never points past data
+            # that is actually on disk
+            try:
+                os.fsync(log_fd)
+            finally:
+                os.close(log_fd)
+            index_path = os.path.join(self.root, self.INDEX_FILE)
+            with open(index_path + ".tmp", "w") as f:
+                json.dump(checkpoint, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(index_path + ".tmp", index_path)
+
+    def _checkpoint_loop(self):
+        while True:
+            self._checkpoint_requested.wait()
+            if self._closed.is_set():
+                return
+            self._checkpoint_requested.clear()
+            try:
+                self._checkpoint()
+            except OSError as e:
+                # The log still holds everything; the next request retries
+                print(f"Index checkpoint failed: {e!r}")
+
+    # -- writes ------------------------------------------------------------
+
+    def _append(self, kind, chunk_id, data=b""):
+        # Called with the lock held
+        if self._active_size >= self.segment_size:
+            self._writer.close()
+            self._open_segment(self._active + 1)
+        encoded_id = chunk_id.encode()
+        header = self.RECORD_HEADER.pack(
+            self.MAGIC, kind, len(encoded_id), len(data), zlib.crc32(data)
+        )
+        data_offset = self._active_size + len(header) + len(encoded_id)
+        self._writer.write(header + encoded_id)
+        self._writer.write(data)
+        self._writer.flush()
+        if self.sync:
+            os.fsync(self._writer.fileno())
+        self._appended += data_offset + len(data) - self._active_size
+        self._active_size = data_offset + len(data)
+        self._apply(kind, chunk_id, (self._active, data_offset, len(data)))
+        if self._appended >= self.checkpoint_bytes:
+            self._checkpoint_requested.set()
+
+    def put(self, chunk_id, parts):
+        """
+        Store a chunk. The parts are gathered first so the record is
+        appended in one go without holding up other writers.
+        :param chunk_id: ID of the chunk
+        :param parts: Iterable of the stored bytes, in order
+        """
+        data = b"".join(parts)
+        with self._lock:
+            self._append(self.PUT, chunk_id, data)
+
+    def open(self, chunk_id):
+        """
+        Open a stored chunk for reading.
+        :raises FileNotFoundError: If the chunk is not stored
+        """
+        with self._lock:
+            location = self._index.get(chunk_id)
+            if location is None:
+                raise FileNotFoundError(chunk_id)
+            segment, offset, length = location
+            return _RangeReader(os.dup(self._fds[segment]), offset, length)
+
+    def map(self, chunk_id):
+        """
+        Memory-map a stored chunk. The mapping keeps the segment's pages
+        alive on its own, so compaction may delete the segment meanwhile.
+        :raises FileNotFoundError: If the chunk is not stored
+        :return: MappedChunk over the chunk's record data
+        """
+        with self._lock:
+            location = self._index.get(chunk_id)
+            if location is None:
+                raise FileNotFoundError(chunk_id)
+            segment, offset, length = location
+            return MappedChunk(self._fds[segment], offset, length)
+
+    def delete(self, chunk_id):
+        """
+        Delete a stored chunk; its space is reclaimed by compaction.
+        :raises FileNotFoundError: If the chunk is not stored
+        """
+        with self._lock:
+            if chunk_id not in self._index:
+                raise FileNotFoundError(chunk_id)
+            self._append(self.DELETE, chunk_id)
+
+    # -- compaction --------------------------------------------------------
+
+    def _compact_loop(self, interval):
+        while not self._closed.wait(interval):
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the live chunks of sealed segments that are mostly dead into
+        the active segment, then delete those segments. A deletion record is
+        carried over only while an older segment still holds a record of
+        the chunk it deleted, which replay would otherwise bring back.
+        :return: Number of segments reclaimed
+        """
+        with self._lock:
+            victims = [
+                segment
+                for segment, dead in self._dead.items()
+                if segment != self._active
+                and dead >= self.compact_ratio
+                * os.path.getsize(self._segment_path(segment))
+            ]
+        for segment in victims:
+            with self._lock:
+                live = [
+                    (chunk_id, location)
+                    for chunk_id, location in self._index.items()
+                    if location[0] == segment
+                ]
+            for chunk_id, (_, offset, length) in live:
+                data = os.pread(self._fds[segment], length, offset)
+                with self._lock:
+                    # Skip chunks deleted or replaced while we were copying
+                    if self._index.get(chunk_id) == (segment, offset, length):
+                        self._append(self.PUT, chunk_id, data)
+            with self._lock:
+                for chunk_id in sorted(self._tombstones.get(segment, ())):
+                    if chunk_id not in self._index and any(
+                        older < segment and chunk_id in ids
+                        for older, ids in self._shadowed.items()
+                    ):
+                        self._append(self.DELETE, chunk_id)
+            # Persist the new locations before the old copies disappear
+            self._checkpoint()
+            with self._lock:
+                os.close(self._fds.pop(segment))
+                del self._dead[segment]
+                self._shadowed.pop(segment, None)
+                self._tombstones.pop(segment, None)
+                os.remove(self._segment_path(segment))
+        return len(victims)
+
+    def close(self):
+        self._closed.set()
+        self._checkpoint_requested.set()
+        self._checkpointer.join()
+        self._checkpoint()
+        with self._lock:
+            self._writer.close()
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
@@ -0,0 +1,101 @@
+from chunk_cache import ChunkCache
+
+
+def _value(size):
+    return b"x" * size
+
+
+def test_miss_then_hit():
+    cache = ChunkCache(1000)
+    assert cache.get(("a", 0)) is None
+    cache.put(("a", 0), b"data")
+    assert cache.get(("a", 0)) == b"data"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_second_hit_promotes_to_protected():
+    cache = ChunkCache(1000, protected_ratio=0.8)
+    cache.put(("hot", 0), _value(100))
+    assert ("hot", 0) in cache._probation
+    cache.get(("hot", 0))
+    assert ("hot", 0) in cache._protected
+    assert ("hot", 0) not in cache._probation
+
+
+def test_scan_does_not_evict_protected_entries():
+    cache = ChunkCache(1000, protected_ratio=0.8)
+    cache.put(("hot", 0), _value(100))
+    cache.get(("hot", 0))
+    # A scan of cold entries, each read once, cycles through probation only
+    for i in range(50):
+        cache.put(("cold", i), _value(100))
+    assert cache.get(("hot", 0)) == _value(100)
+    assert cache.get(("cold", 0)) is None
+    assert cache.get(("cold", 49)) == _value(100)
+
+
+def test_evicts_least_recently_used_within_the_budget():
+    cache = ChunkCache(1000, protected_ratio=0.5)
+    for i in range(5):
+        cache.put(("c", i), _value(100))
+    # 1100 bytes would be over the budget: the oldest entry goes
+    cache.put(("c", 5), _value(300))
+    cache.put(("c", 6), _value(300))
+    stats = cache.stats()
+    assert stats["cache_bytes"] <= 1000
+    assert cache.get(("c", 0)) is None
+    assert cache.get(("c", 1)) == _value(100)
+    assert cache.get(("c", 6)) == _value(300)
+    assert stats["cache_evictions"] == 1
+
+
+def test_protected_overflow_is_demoted_to_probation():
+    cache = ChunkCache(1000, protected_ratio=0.5)
+    for i in range(6):
+        cache.put(("c", i), _value(100))
+        cache.get(("c", i))
+    # Protected holds 500 bytes; older promoted entries went back to
+    # probation rather than out of the cache
+    assert sum(map(len, cache._protected.values())) <= 500
+    assert ("c", 0) in cache._probation
+    assert cache.stats()["cache_entries"] == 6
+    assert cache.evictions == 0
+
+
+def test_values_bigger_than_probation_are_not_cached():
+    cache = ChunkCache(1000, protected_ratio=0.8)
+    cache.put(("big", 0), _value(201))
+    assert cache.get(("big", 0)) is None
+    cache.put(("fits", 0), _value(200))
+    assert cache.get(("fits", 0)) == _value(200)
+
+
+def test_invalidate_drops_every_part_of_a_chunk():
+    cache = ChunkCache(10000)
+    for part in (0, 1, 2, "index"):
+        cache.put(("a", part), _value(10))
+        cache.put(("b", part), _value(10))
+    # Spread a's parts over both segments
+    cache.get(("a", 1))
+    cache.get(("a", "index"))
+    cache.invalidate("a")
+    for part in (0, 1, 2, "index"):
+        assert cache.get(("a", part)) is None
+        assert cache.get(("b", part)) == _value(10)
+    stats = cache.stats()
+    assert stats["cache_entries"] == 4
+    assert stats["cache_bytes"] == 40
+    assert stats["cache_invalidations"] == 4
+    # Nothing left to drop the second time
+    cache.invalidate("a")
+    assert cache.invalidations == 4
+
+
+def test_evicted_parts_are_not_invalidated_again():
+    cache = ChunkCache(100, protected_ratio=0.5)
+    cache.put(("a", 0), _value(50))
+    cache.put(("b", 0), _value(50))
+    cache.put(("b", 1), _value(50))
+    assert cache.get(("a", 0)) is None
+    cache.invalidate("a")
+    assert cache.invalidations == 0
@@ -0,0 +1,148 @@
+import gzip
+import io
+import random
+
+import pytest
+
+from chunk_cache import ChunkCache
+from compression import (
+    CHUNK_HEADER,
+    INDEX_PART,
+    SAMPLE_SIZE,
+    WHOLE_PART,
+    ChunkCodec,
+    codec_of,
+    read_file_range,
+    read_mapped_range,
+)
+
+FRAME_SIZE = 1000
+
+
+def _compressible(size, seed=0):
+    # Text-like data that zlib shrinks well
+    rng = random.Random(seed)
+    words = [b"alpha", b"beta", b"gamma", b"delta", b"chunk", b"frame"]
+    out = bytearray()
+    while len(out) < size:
+        out += rng.choice(words) + b" "
+    return bytes(out[:size])
+
+
+def _incompressible(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def _store(data, **kwargs):
+    codec = ChunkCodec(**kwargs)
+    # Uneven parts, so frames are cut across part boundaries
+    parts = [data[i : i + 777] for i in range(0, len(data), 777)]
+    return b"".join(codec.encode(parts))
+
+
+def _read_file(stored, offset=0, length=0, cache=None, chunk_id=None):
+    return read_file_range(io.BytesIO(stored), offset, length, cache, chunk_id)
+
+
+def _read_mapped(stored, offset=0, length=0, cache=None, chunk_id=None):
+    return read_mapped_range(memoryview(stored), offset, length, cache, chunk_id)
+
+
+@pytest.fixture(params=[_read_file, _read_mapped], ids=["file", "mapped"])
+def read(request):
+    return request.param
+
+
+RANGES = [
+    (0, 0),
+    (0, 1),
+    (FRAME_SIZE - 1, 2),  # straddles the first frame boundary
+    (FRAME_SIZE, FRAME_SIZE),  # exactly one frame
+    (FRAME_SIZE // 2, FRAME_SIZE * 3),  # several frames, partial at both ends
+    (4321, 0),  # to the end
+    (9990, 100),  # past the end
+    (20000, 10),  # starts past the end
+]
+
+
+@pytest.mark.parametrize("offset,length", RANGES)
+def test_framed_ranges(read, offset, length):
+    data = _compressible(10000)
+    stored = _store(data, codec="zlib", frame_size=FRAME_SIZE)
+    assert codec_of(stored) == "zlib"
+    assert len(stored) < len(data)
+    end = offset + length if length else len(data)
+    assert read(stored, offset, length) == data[offset:end]
+
+
+def test_framed_range_decodes_only_its_frames(read):
+    data = _compressible(10000)
+    stored = _store(data, codec="zlib", frame_size=FRAME_SIZE)
+    cache = ChunkCache(1 << 20)
+    offset, length = FRAME_SIZE * 2 + 10, FRAME_SIZE
+    assert read(stored, offset, length, cache, "c") == data[offset : offset + length]
+    assert cache._keys["c"] == {("c", INDEX_PART), ("c", 2), ("c", 3)}
+    # Served from the cached frames the second time
+    assert read(stored, offset, length, cache, "c") == data[offset : offset + length]
+    assert cache.hits == 3
+
+
+def test_frames_that_do_not_shrink_are_kept_raw(read):
+    data = _compressible(3000) + _incompressible(3000) + _compressible(3000, seed=1)
+    stored = _store(data, codec="zlib", frame_size=FRAME_SIZE, adaptive=False)
+    for offset, length in [(0, 0), (2500, 1000), (5500, 1000), (2999, 3002)]:
+        end = offset + length if length else len(data)
+        assert read(stored, offset, length) == data[offset:end]
+
+
+def test_adaptive_stores_incompressible_chunks_as_is(read):
+    data = _incompressible(SAMPLE_SIZE + 5000)
+    stored = _store(data, codec="zlib", frame_size=FRAME_SIZE)
+    assert codec_of(stored) == "none"
+    assert stored[CHUNK_HEADER.size :] == data
+    assert read(stored) == data
+    assert (
+        read(stored, SAMPLE_SIZE - 10, 20) == data[SAMPLE_SIZE - 10 : SAMPLE_SIZE + 10]
+    )
+
+
+def test_adaptive_still_compresses_compressible_chunks():
+    stored = _store(_compressible(SAMPLE_SIZE + 5000), codec="zlib")
+    assert codec_of(stored) == "zlib"
+    stored = _store(_incompressible(5000), codec="zlib", adaptive=False)
+    assert codec_of(stored) == "zlib"
+
+
+@pytest.mark.parametrize("offset,length", RANGES)
+def test_unframed_stream_ranges(read, offset, length):
+    data = _compressible(10000)
+    stored = _store(data, codec="zlib", frame_size=0)
+    end = offset + length if length else len(data)
+    assert read(stored, offset, length) == data[offset:end]
+
+
+@pytest.mark.parametrize("offset,length", RANGES)
+def test_legacy_gzip_chunks(read, offset, length):
+    data = _compressible(10000)
+    stored = gzip.compress(data)
+    assert codec_of(stored) == "gzip"
+    end = offset + length if length else len(data)
+    assert read(stored, offset, length) == data[offset:end]
+
+
+def test_legacy_gzip_chunk_cached_whole(read):
+    data = _compressible(10000)
+    stored = gzip.compress(data)
+    cache = ChunkCache(1 << 20)
+    assert read(stored, 100, 50, cache, "g") == data[100:150]
+    # Only a read of the whole chunk is worth caching
+    assert "g" not in cache._keys
+    assert read(stored, 0, 0, cache, "g") == data
+    assert cache._keys["g"] == {("g", WHOLE_PART)}
+    assert read(stored, 100, 50, cache, "g") == data[100:150]
+    assert cache.hits == 1
+
+
+def test_unknown_format_is_rejected(read):
+    with pytest.raises(ValueError):
+        read(b"XXXX\x01payload")
@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+from storage import SegmentStore
+
+
+def _open(root, **kwargs):
+    kwargs.setdefault("segment_size", 4096)
+    kwargs.setdefault("compact_interval", 0)
+    return SegmentStore(str(root), **kwargs)
+
+
+def _read(store, chunk_id):
+    with store.open(chunk_id) as f:
+        return f.read()
+
+
+def _crash(store):
+    # Stop the background checkpointer and drop the store without the
+    # checkpoint close() would write
+    store._closed.set()
+    store._checkpoint_requested.set()
+    store._checkpointer.join()
+    store._writer.flush()
+
+
+def _segments(root):
+    return sorted(name for name in os.listdir(root) if name.endswith(".seg"))
+
+
+def test_torn_tail_record_is_dropped(tmp_path):
+    store = _open(tmp_path)
+    store.put("a", [b"first"])
+    store.put("b", [b"sec", b"ond"])
+    _crash(store)
+    path = tmp_path / _segments(tmp_path)[-1]
+    intact = path.stat().st_size
+    with open(path, "ab") as f:
+        # A record cut short by the crash: header and part of its data
+        header = SegmentStore.RECORD_HEADER.pack(SegmentStore.MAGIC, 0, 1, 100, 0)
+        f.write(header + b"c" + b"x" * 10)
+
+    store = _open(tmp_path)
+    assert _read(store, "a") == b"first"
+    assert _read(store, "b") == b"second"
+    with pytest.raises(FileNotFoundError):
+        store.open("c")
+    # New records start where the torn one did
+    assert path.stat().st_size == intact
+    store.put("c", [b"third"])
+    store.close()
+    store = _open(tmp_path)
+    assert _read(store, "c") == b"third"
+    store.close()
+
+
+def test_recovers_from_checkpoint_and_log(tmp_path):
+    store = _open(tmp_path)
+    for i in range(20):
+        store.put(f"old{i}", [bytes([i]) * 300])
+    store.delete("old3")
+    store._checkpoint()
+    # Written after the checkpoint: only in the log
+    store.put("new", [b"fresh"])
+    store.put("old4", [b"replaced"])
+    store.delete("old5")
+    _crash(store)
+
+    store = _open(tmp_path)
+    assert _read(store, "new") == b"fresh"
+    assert _read(store, "old4") == b"replaced"
+    assert _read(store, "old6") == bytes([6]) * 300
+    for deleted in ("old3", "old5"):
+        with pytest.raises(FileNotFoundError):
+            store.open(deleted)
+    store.close()
+
+
+def test_compaction_keeps_live_data_and_deletes(tmp_path):
+    store = _open(tmp_path)
+    live = {}
+    for i in range(30):
+        store.put(f"c{i}", [bytes([i]) * 500])
+        live[f"c{i}"] = bytes([i]) * 500
+    for i in range(0, 30, 3):
+        store.put(f"c{i}", [b"v2" * 100])
+        live[f"c{i}"] = b"v2" * 100
+    for i in range(1, 30, 3):
+        store.delete(f"c{i}")
+        del live[f"c{i}"]
+    before = _segments(tmp_path)
+    assert store.compact() > 0
+    assert len(_segments(tmp_path)) < len(before)
+
+    def check(store):
+        for chunk_id, data in live.items():
+            assert _read(store, chunk_id) == data
+        for i in range(1, 30, 3):
+            with pytest.raises(FileNotFoundError):
+                store.open(f"c{i}")
+
+    check(store)
+    store.close()
+    store = _open(tmp_path)
+    check(store)
+    store.close()
+    # Replaying every segment, without the checkpoint, must not bring
+    # deleted chunks back either
+    os.remove(tmp_path / SegmentStore.INDEX_FILE)
+    store = _open(tmp_path)
+    check(store)
+    store.close()
+
+
+def test_segments_of_deletion_records_are_compacted(tmp_path):
+    store = _open(tmp_path)
+    for i in range(100):
+        store.put(f"t{i}", [b""])
+        store.delete(f"t{i}")
+    store.put("keep", [b"k" * 5000])
+    store.put("last", [b"l"])
+    first = _segments(tmp_path)[0]
+    assert store.compact() >= 1
+    assert first not in _segments(tmp_path)
+    assert _read(store, "keep") == b"k" * 5000
+    store.close()
@@ -44,6 +44,12 @@ class LeaderServiceStub(object):
             response_deserializer=dfs__pb2.FileUploadResponse.FromString,
             _registered_method=True,
         )
+        self.UploadFileStream = channel.stream_unary(
+            "/dfs.LeaderService/UploadFileStream",
+            request_serializer=dfs__pb2.FileUploadFrame.SerializeToString,
+            response_deserializer=dfs__pb2.FileUploadResponse.FromString,
+            _registered_method=True,
+        )
         self.ReadFile = channel.unary_stream(
             "/dfs.LeaderService/ReadFile",
             request_serializer=dfs__pb2.FileReadRequest.SerializeToString,
@@ -56,6 +62,72 @@ class LeaderServiceStub(object):
             response_deserializer=dfs__pb2.FileDeleteResponse.FromString,
             _registered_method=True,
         )
+        self.AllocateChunks = channel.unary_unary(
+            "/dfs.LeaderService/AllocateChunks",
+            request_serializer=dfs__pb2.AllocateChunksRequest.SerializeToString,
+            response_deserializer=dfs__pb2.AllocateChunksResponse.FromString,
+            _registered_method=True,
+        )
+        self.CommitFile = channel.unary_unary(
+            "/dfs.LeaderService/CommitFile",
+            request_serializer=dfs__pb2.CommitFileRequest.SerializeToString,
+            response_deserializer=dfs__pb2.FileUploadResponse.FromString,
+            _registered_method=True,
+        )
+        self.GetFileLocations = channel.unary_unary(
+            "/dfs.LeaderService/GetFileLocations",
+            request_serializer=dfs__pb2.FileReadRequest.SerializeToString,
+            response_deserializer=dfs__pb2.FileLocationsResponse.FromString,
+            _registered_method=True,
+        )
+        self.FindChunks = channel.unary_unary(
+            "/dfs.LeaderService/FindChunks",
+            request_serializer=dfs__pb2.FindChunksRequest.SerializeToString,
+            response_deserializer=dfs__pb2.FindChunksResponse.FromString,
+            _registered_method=True,
+        )
+        self.Stat = channel.unary_unary(
+            "/dfs.LeaderService/Stat",
+            request_serializer=dfs__pb2.StatRequest.SerializeToString,
+            response_deserializer=dfs__pb2.FileStat.FromString,
+            _registered_method=True,
+        )
+        self.BatchStat = channel.unary_unary(
+            "/dfs.LeaderService/BatchStat",
+            request_serializer=dfs__pb2.BatchStatRequest.SerializeToString,
+            response_deserializer=dfs__pb2.BatchStatResponse.FromString,
+            _registered_method=True,
+        )
+        self.ListFiles = channel.unary_unary(
+            "/dfs.LeaderService/ListFiles",
+            request_serializer=dfs__pb2.ListFilesRequest.SerializeToString,
+            response_deserializer=dfs__pb2.ListFilesResponse.FromString,
+            _registered_method=True,
+        )
+        self.MakeDirectory = channel.unary_unary(
+            "/dfs.LeaderService/MakeDirectory",
+            request_serializer=dfs__pb2.DirectoryRequest.SerializeToString,
+            response_deserializer=dfs__pb2.NamespaceResponse.FromString,
+            _registered_method=True,
+        )
+        self.DeleteDirectory = channel.unary_unary(
+            "/dfs.LeaderService/DeleteDirectory",
+            request_serializer=dfs__pb2.DirectoryRequest.SerializeToString,
+            response_deserializer=dfs__pb2.NamespaceResponse.FromString,
+            _registered_method=True,
+        )
+        self.Rename = channel.unary_unary(
+            "/dfs.LeaderService/Rename",
+            request_serializer=dfs__pb2.RenameRequest.SerializeToString,
+            response_deserializer=dfs__pb2.NamespaceResponse.FromString,
+            _registered_method=True,
+        )
+        self.GetPartitionMap = channel.unary_unary(
+            "/dfs.LeaderService/GetPartitionMap",
+            request_serializer=dfs__pb2.PartitionMapRequest.SerializeToString,
+            response_deserializer=dfs__pb2.PartitionMap.FromString,
+            _registered_method=True,
+        )
 
 
 class LeaderServiceServicer(object):
@@ -67,6 +139,12 @@ class LeaderServiceServicer(object):
         context.set_details("Method not implemented!")
         raise NotImplementedError("Method not implemented!")
 
+    def UploadFileStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
     def ReadFile(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -79,6 +157,82 @@ class LeaderServiceServicer(object):
         context.set_details("Method not implemented!")
         raise NotImplementedError("Method not implemented!")
 
+    def AllocateChunks(self, request, context):
+        """Metadata-only data path: clients move chunk bytes to and from the data
+        nodes themselves and only ask the leader where chunks go or live.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def CommitFile(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def GetFileLocations(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def FindChunks(self, request, context):
+        """Which of these chunk ids are already stored (and need not be sent again)"""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def Stat(self, request, context):
+        """Namespace queries. Names are "/"-separated paths; uploading a file
+        creates its missing parent directories.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def BatchStat(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def ListFiles(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def MakeDirectory(self, request, context):
+        """Directory operations. Failures carry the POSIX errno in the "errno"
+        trailing metadata.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def DeleteDirectory(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def Rename(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def GetPartitionMap(self, request, context):
+        """Federation: each leader owns one partition of the namespace. A call
+        for a path another leader owns fails with FAILED_PRECONDITION and the
+        owner's "partition" and "leader" address in the trailing metadata;
+        renames across partitions fail with EXDEV.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
 
 def add_LeaderServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -87,6 +241,11 @@ def add_LeaderServiceServicer_to_server(servicer, server):
             request_deserializer=dfs__pb2.FileUploadRequest.FromString,
             response_serializer=dfs__pb2.FileUploadResponse.SerializeToString,
         ),
+        "UploadFileStream": grpc.stream_unary_rpc_method_handler(
+            servicer.UploadFileStream,
+            request_deserializer=dfs__pb2.FileUploadFrame.FromString,
+            response_serializer=dfs__pb2.FileUploadResponse.SerializeToString,
+        ),
         "ReadFile": grpc.unary_stream_rpc_method_handler(
             servicer.ReadFile,
             request_deserializer=dfs__pb2.FileReadRequest.FromString,
@@ -97,6 +256,61 @@ def add_LeaderServiceServicer_to_server(servicer, server):
             request_deserializer=dfs__pb2.FileDeleteRequest.FromString,
             response_serializer=dfs__pb2.FileDeleteResponse.SerializeToString,
         ),
+        "AllocateChunks": grpc.unary_unary_rpc_method_handler(
+            servicer.AllocateChunks,
+            request_deserializer=dfs__pb2.AllocateChunksRequest.FromString,
+            response_serializer=dfs__pb2.AllocateChunksResponse.SerializeToString,
+        ),
+        "CommitFile": grpc.unary_unary_rpc_method_handler(
+            servicer.CommitFile,
+            request_deserializer=dfs__pb2.CommitFileRequest.FromString,
+            response_serializer=dfs__pb2.FileUploadResponse.SerializeToString,
+        ),
+        "GetFileLocations": grpc.unary_unary_rpc_method_handler(
+            servicer.GetFileLocations,
+            request_deserializer=dfs__pb2.FileReadRequest.FromString,
+            response_serializer=dfs__pb2.FileLocationsResponse.SerializeToString,
+        ),
+        "FindChunks": grpc.unary_unary_rpc_method_handler(
+            servicer.FindChunks,
+            request_deserializer=dfs__pb2.FindChunksRequest.FromString,
+            response_serializer=dfs__pb2.FindChunksResponse.SerializeToString,
+        ),
+        "Stat": grpc.unary_unary_rpc_method_handler(
+            servicer.Stat,
+            request_deserializer=dfs__pb2.StatRequest.FromString,
+            response_serializer=dfs__pb2.FileStat.SerializeToString,
+        ),
+        "BatchStat": grpc.unary_unary_rpc_method_handler(
+            servicer.BatchStat,
+            request_deserializer=dfs__pb2.BatchStatRequest.FromString,
+            response_serializer=dfs__pb2.BatchStatResponse.SerializeToString,
+        ),
+        "ListFiles": grpc.unary_unary_rpc_method_handler(
+            servicer.ListFiles,
+            request_deserializer=dfs__pb2.ListFilesRequest.FromString,
+            response_serializer=dfs__pb2.ListFilesResponse.SerializeToString,
+        ),
+        "MakeDirectory": grpc.unary_unary_rpc_method_handler(
+            servicer.MakeDirectory,
+            request_deserializer=dfs__pb2.DirectoryRequest.FromString,
+            response_serializer=dfs__pb2.NamespaceResponse.SerializeToString,
+        ),
+        "DeleteDirectory": grpc.unary_unary_rpc_method_handler(
+            servicer.DeleteDirectory,
+            request_deserializer=dfs__pb2.DirectoryRequest.FromString,
+            response_serializer=dfs__pb2.NamespaceResponse.SerializeToString,
+        ),
+        "Rename": grpc.unary_unary_rpc_method_handler(
+            servicer.Rename,
+            request_deserializer=dfs__pb2.RenameRequest.FromString,
+            response_serializer=dfs__pb2.NamespaceResponse.SerializeToString,
+        ),
+        "GetPartitionMap": grpc.unary_unary_rpc_method_handler(
+            servicer.GetPartitionMap,
+            request_deserializer=dfs__pb2.PartitionMapRequest.FromString,
+            response_serializer=dfs__pb2.PartitionMap.SerializeToString,
+        ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
         "dfs.LeaderService", rpc_method_handlers
@@ -141,6 +355,36 @@ class LeaderService(object):
             _registered_method=True,
         )
 
+    @staticmethod
+    def UploadFileStream(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            "/dfs.LeaderService/UploadFileStream",
+            dfs__pb2.FileUploadFrame.SerializeToString,
+            dfs__pb2.FileUploadResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
     @staticmethod
     def ReadFile(
         request,
@@ -201,6 +445,336 @@ class LeaderService(object):
             _registered_method=True,
         )
 
+    @staticmethod
+    def AllocateChunks(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/AllocateChunks",
+            dfs__pb2.AllocateChunksRequest.SerializeToString,
+            dfs__pb2.AllocateChunksResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def CommitFile(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/CommitFile",
+            dfs__pb2.CommitFileRequest.SerializeToString,
+            dfs__pb2.FileUploadResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def GetFileLocations(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/GetFileLocations",
+            dfs__pb2.FileReadRequest.SerializeToString,
+            dfs__pb2.FileLocationsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def FindChunks(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/FindChunks",
+            dfs__pb2.FindChunksRequest.SerializeToString,
+            dfs__pb2.FindChunksResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def Stat(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/Stat",
+            dfs__pb2.StatRequest.SerializeToString,
+            dfs__pb2.FileStat.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def BatchStat(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/BatchStat",
+            dfs__pb2.BatchStatRequest.SerializeToString,
+            dfs__pb2.BatchStatResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def ListFiles(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/ListFiles",
+            dfs__pb2.ListFilesRequest.SerializeToString,
+            dfs__pb2.ListFilesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def MakeDirectory(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/MakeDirectory",
+            dfs__pb2.DirectoryRequest.SerializeToString,
+            dfs__pb2.NamespaceResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def DeleteDirectory(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/DeleteDirectory",
+            dfs__pb2.DirectoryRequest.SerializeToString,
+            dfs__pb2.NamespaceResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def Rename(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/Rename",
+            dfs__pb2.RenameRequest.SerializeToString,
+            dfs__pb2.NamespaceResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def GetPartitionMap(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            "/dfs.LeaderService/GetPartitionMap",
+            dfs__pb2.PartitionMapRequest.SerializeToString,
+            dfs__pb2.PartitionMap.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
 
 class DataNodeServiceStub(object):
     """Missing associated documentation comment in .proto file."""
@@ -217,6 +791,12 @@ class DataNodeServiceStub(object):
             response_deserializer=dfs__pb2.StoreChunkResponse.FromString,
             _registered_method=True,
         )
+        self.StoreChunkPipeline = channel.stream_unary(
+            "/dfs.DataNodeService/StoreChunkPipeline",
+            request_serializer=dfs__pb2.ChunkFrame.SerializeToString,
+            response_deserializer=dfs__pb2.StoreChunkResponse.FromString,
+            _registered_method=True,
+        )
         self.RetrieveChunk = channel.unary_unary(
             "/dfs.DataNodeService/RetrieveChunk",
             request_serializer=dfs__pb2.ChunkRequest.SerializeToString,
@@ -246,6 +826,12 @@ class DataNodeServiceServicer(object):
         context.set_details("Method not implemented!")
         raise NotImplementedError("Method not implemented!")
 
+    def StoreChunkPipeline(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
     def RetrieveChunk(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -272,6 +858,11 @@ def add_DataNodeServiceServicer_to_server(servicer, server):
             request_deserializer=dfs__pb2.Chunk.FromString,
             response_serializer=dfs__pb2.StoreChunkResponse.SerializeToString,
         ),
+        "StoreChunkPipeline": grpc.stream_unary_rpc_method_handler(
+            servicer.StoreChunkPipeline,
+            request_deserializer=dfs__pb2.ChunkFrame.FromString,
+            response_serializer=dfs__pb2.StoreChunkResponse.SerializeToString,
+        ),
         "RetrieveChunk": grpc.unary_unary_rpc_method_handler(
             servicer.RetrieveChunk,
             request_deserializer=dfs__pb2.ChunkRequest.FromString,
@@ -331,6 +922,36 @@ class DataNodeService(object):
             _registered_method=True,
         )
 
+    @staticmethod
+    def StoreChunkPipeline(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            "/dfs.DataNodeService/StoreChunkPipeline",
+            dfs__pb2.ChunkFrame.SerializeToString,
+            dfs__pb2.StoreChunkResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
     @staticmethod
     def RetrieveChunk(
         request,
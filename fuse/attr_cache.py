@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class AttrCache:
+    def __init__(self, ttl=5.0, negative_ttl=1.0, max_entries=200000):
+        """
+        Time-limited cache of file attributes, including "does not exist"
+        answers, so repeated getattr calls (e.g. ls -l after readdir) do
+        not each cost a round trip to the leader.
+        :param ttl: Seconds attributes of existing paths stay valid
+        :param negative_ttl: Seconds a missing path is remembered
+        :param max_entries: Entries kept before the oldest are dropped
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # name -> (expiry, attrs or None)
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """
+        Look up a path.
+        :return: (found, attrs); attrs is None for a cached missing path
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return False, None
+            expiry, attrs = entry
+            if expiry < time.monotonic():
+                del self._entries[name]
+                return False, None
+            return True, attrs
+
+    def put(self, name, attrs):
+        """
+        Remember the attributes of a path, or None if it does not exist.
+        """
+        ttl = self.ttl if attrs is not None else self.negative_ttl
+        with self._lock:
+            self._entries.pop(name, None)
+            self._entries[name] = (time.monotonic() + ttl, attrs)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, name):
+        """Forget a path and its parent directories, which it may imply."""
+        with self._lock:
+            self._entries.pop(name, None)
+            while "/" in name:
+                name = name.rsplit("/", 1)[0]
+                self._entries.pop(name, None)
+
+    def invalidate_tree(self, name):
+        """Forget a path, everything below it and its parent directories."""
+        prefix = name + "/"
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+        self.invalidate(name)
@@ -0,0 +1,187 @@
+import bisect
+import threading
+from collections import OrderedDict
+from concurrent import futures
+
+# Blocks never straddle a chunk boundary, so each block is one ranged read
+# of a single chunk on the data nodes
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class BlockCache:
+    def __init__(
+        self,
+        fetch,
+        locate,
+        capacity=512 * 1024 * 1024,
+        block_size=BLOCK_SIZE,
+        max_read_ahead=16,
+        workers=4,
+    ):
+        """
+        Chunk-aligned block cache for reads through the mount. Sequential
+        readers get the next blocks fetched in the background, with the
+        read-ahead window doubling while the access pattern stays sequential.
+        Blocks are read from the chunks themselves, never through the file,
+        so a block always holds the bytes of the chunk it is cached under
+        even if the file is rewritten meanwhile.
+        :param fetch: fetch(chunk_id, source, offset, length) -> bytes of a
+                      range of a chunk
+        :param locate: locate(name) -> [(chunk_id, size, source)] of the
+                       file's chunks, source being where fetch finds it
+        :param capacity: Memory budget in bytes for cached blocks
+        :param block_size: Largest block fetched at once
+        :param max_read_ahead: Most blocks read ahead of a sequential reader
+        :param workers: Threads fetching blocks
+        """
+        self.fetch = fetch
+        self.locate = locate
+        self.capacity = capacity
+        self.block_size = block_size
+        # Read-ahead never takes more than half the budget
+        self.max_read_ahead = max(0, min(max_read_ahead, capacity // (2 * block_size)))
+        self._pool = futures.ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        # Blocks are keyed by (chunk_id, offset in chunk): chunk ids are
+        # content hashes, so cached blocks never go stale and files sharing
+        # chunks share blocks
+        self._blocks = OrderedDict()
+        self._bytes = 0
+        self._fetches = {}  # key -> Future of a block being fetched
+        # name -> (file offsets of blocks, block keys, file size, sources)
+        self._layouts = {}
+        # name -> (offset the next sequential read starts at, window)
+        self._streams = {}
+        self.hits = 0
+        self.misses = 0
+        self.read_ahead_blocks = 0
+
+    def _layout(self, name):
+        layout = self._layouts.get(name)
+        if layout is None:
+            layout = self.refresh(name)
+        return layout
+
+    def refresh(self, name):
+        """
+        Look up the current chunks of a file, e.g. when it is opened.
+        :param name: File name
+        :return: (file offsets of blocks, block keys, file size, where each
+                 block's chunk is found)
+        """
+        starts, keys, sources = [], [], []
+        position = 0
+        for chunk_id, size, source in self.locate(name):
+            for chunk_offset in range(0, size, self.block_size):
+                starts.append(position + chunk_offset)
+                keys.append((chunk_id, chunk_offset))
+                sources.append(source)
+            position += size
+        layout = (starts, keys, position, sources)
+        with self._lock:
+            self._layouts[name] = layout
+            self._streams.pop(name, None)
+        return layout
+
+    def forget(self, name):
+        """
+        Drop what is known about a file's layout (its blocks stay cached).
+        :param name: File name
+        """
+        with self._lock:
+            self._layouts.pop(name, None)
+            self._streams.pop(name, None)
+
+    def size(self, name):
+        """Return the size of a file in bytes."""
+        return self._layout(name)[2]
+
+    def read(self, name, offset, size):
+        """
+        Read a range of a file through the cache.
+        :param name: File name
+        :param offset: First byte of the range
+        :param size: Number of bytes wanted
+        :return: The bytes of the range (short at the end of the file)
+        """
+        starts, keys, file_size, sources = self._layout(name)
+        end = min(offset + size, file_size)
+        if offset >= end:
+            return b""
+        first = bisect.bisect_right(starts, offset) - 1
+        last = bisect.bisect_left(starts, end) - 1
+        layout = (starts, keys, file_size, sources)
+        self._read_ahead(name, offset, end, last, layout)
+
+        parts = []
+        for i in range(first, last + 1):
+            block = self._get(i, layout)
+            parts.append(block[max(offset - starts[i], 0) : end - starts[i]])
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def _read_ahead(self, name, offset, end, last, layout):
+        with self._lock:
+            expected, window = self._streams.get(name, (0, 0))
+            if abs(offset - expected) <= self.block_size:
+                # Sequential (give or take reads the kernel issues out of
+                # order): grow the window up to the limit
+                window = min(max(window * 2, 1), self.max_read_ahead)
+            else:
+                window = 0
+            self._streams[name] = (end, window)
+        for i in range(last + 1, min(last + 1 + window, len(layout[0]))):
+            self._start_fetch(i, layout, read_ahead=True)
+
+    def _block_length(self, i, starts, file_size):
+        return (starts[i + 1] if i + 1 < len(starts) else file_size) - starts[i]
+
+    def _start_fetch(self, i, layout, read_ahead=False):
+        # Future of block i, starting a fetch unless it is cached or underway
+        starts, keys, file_size, sources = layout
+        key = keys[i]
+        with self._lock:
+            if key in self._blocks:
+                return None
+            fetch = self._fetches.get(key)
+            if fetch is not None:
+                return fetch
+            chunk_id, chunk_offset = key
+            fetch = self._pool.submit(
+                self.fetch,
+                chunk_id,
+                sources[i],
+                chunk_offset,
+                self._block_length(i, starts, file_size),
+            )
+            self._fetches[key] = fetch
+            if read_ahead:
+                self.read_ahead_blocks += 1
+        fetch.add_done_callback(lambda fetch: self._finish(key, fetch))
+        return fetch
+
+    def _finish(self, key, fetch):
+        with self._lock:
+            del self._fetches[key]
+            if fetch.exception() is not None:
+                return
+            data = fetch.result()
+            self._blocks[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.capacity and len(self._blocks) > 1:
+                _, old = self._blocks.popitem(last=False)
+                self._bytes -= len(old)
+
+    def _get(self, i, layout):
+        keys = layout[1]
+        with self._lock:
+            block = self._blocks.get(keys[i])
+            if block is not None:
+                self._blocks.move_to_end(keys[i])
+                self.hits += 1
+                return block
+            self.misses += 1
+        fetch = self._start_fetch(i, layout)
+        if fetch is None:
+            # Landed in the cache between the two checks
+            return self._get(i, layout)
+        return fetch.result()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: dfs.proto
+# Protobuf Python Version: 5.28.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    5,
+    28,
+    1,
+    '',
+    'dfs.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\tdfs.proto\x12\x03\x64\x66s\"4\n\x11\x46ileUploadRequest\x12\x11\n\tfile_name\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\"%\n\x10\x46ileUploadHeader\x12\x11\n\tfile_name\x18\x01 \x01(\t\"S\n\x0f\x46ileUploadFrame\x12\'\n\x06header\x18\x01 \x01(\x0b\x32\x15.dfs.FileUploadHeaderH\x00\x12\x0e\n\x04\x64\x61ta\x18\x02 \x01(\x0cH\x00\x42\x07\n\x05\x66rame\"6\n\x12\x46ileUploadResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"D\n\x0f\x46ileReadRequest\x12\x11\n\tfile_name\x18\x01 \x01(\t\x12\x0e\n\x06offset\x18\x02 \x01(\x04\x12\x0e\n\x06length\x18\x03 \x01(\x04\" \n\x10\x46ileReadResponse\x12\x0c\n\x04\x64\x61ta\x18\x01 \x01(\x0c\"&\n\x11\x46ileDeleteRequest\x12\x11\n\tfile_name\x18\x01 \x01(\t\"6\n\x12\x46ileDeleteResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"C\n\rChunkLocation\x12\x10\n\x08\x63hunk_id\x18\x01 \x01(\t\x12\x0c\n\x04size\x18\x02 \x01(\x04\x12\x12\n\ndata_nodes\x18\x03 \x03(\t\"N\n\x15\x41llocateChunksRequest\x12\x11\n\tfile_name\x18\x01 \x01(\t\x12\"\n\x06\x63hunks\x18\x02 \x03(\x0b\x32\x12.dfs.ChunkLocation\"P\n\x16\x41llocateChunksResponse\x12\"\n\x06\x63hunks\x18\x01 \x03(\x0b\x32\x12.dfs.ChunkLocation\x12\x12\n\nblock_pool\x18\x02 \x01(\t\"J\n\x11\x43ommitFileRequest\x12\x11\n\tfile_name\x18\x01 \x01(\t\x12\"\n\x06\x63hunks\x18\x02 \x03(\x0b\x32\x12.dfs.ChunkLocation\"O\n\x15\x46ileLocationsResponse\x12\"\n\x06\x63hunks\x18\x01 \x03(\x0b\x32\x12.dfs.ChunkLocation\x12\x12\n\nblock_pool\x18\x02 \x01(\t\"&\n\x11\x46indChunksRequest\x12\x11\n\tchunk_ids\x18\x01 \x03(\t\"0\n\x12\x46indChunksResponse\x12\x1a\n\x12\x65xisting_chunk_ids\x18\x01 \x03(\t\"`\n\x08\x46ileStat\x12\x11\n\tfile_name\x18\x01 \x01(\t\x12\x0e\n\x06\x65xists\x18\x02 \x01(\x08\x12\x14\n\x0cis_directory\x18\x03 \x01(\x08\x12\x0c\n\x04size\x18\x04 \x01(\x04\x12\r\n\x05mtime\x18\x05 \x01(\x01\" \n\x0bStatRequest\x12\x11\n\tfile_name\x18\x01 \x01(\t\"&\n\x10\x42\x61tchStatRequest\x12\x12\n\nfile_names\x18\x01 \x03(\t\"1\n\x11\x42\x61tchStatResponse\x12\x1c\n\x05stats\x18\x01 \x03(\x0b\x32\r.dfs.FileStat\"\\\n\x10ListFilesRequest\x12\x11\n\tdirectory\x18\x01 \x01(\t\x12\x12\n\npage_token\x18\x02 \x01(\t\x12\x11\n\tpage_size\x18\x03 \x01(\r\x12\x0e\n\x06prefix\x18\x04 \x01(\t\"L\n\x11ListFilesResponse\x12\x1e\n\x07\x65ntries\x18\x01 \x03(\x0b\x32\r.dfs.FileStat\x12\x17\n\x0fnext_page_token\x18\x02 \x01(\t\"8\n\x10\x44irectoryRequest\x12\x11\n\tdirectory\x18\x01 \x01(\t\x12\x11\n\trecursive\x18\x02 \x01(\x08\"/\n\rRenameRequest\x12\x0e\n\x06source\x18\x01 \x01(\t\x12\x0e\n\x06target\x18\x02 \x01(\t\"$\n\x11NamespaceResponse\x12\x0f\n\x07message\x18\x01 \x01(\t\"\x15\n\x13PartitionMapRequest\")\n\tPartition\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0e\n\x06leader\x18\x02 \x01(\t\"\xa6\x01\n\x0cPartitionMap\x12\"\n\npartitions\x18\x01 \x03(\x0b\x32\x0e.dfs.Partition\x12\x31\n\x08subtrees\x18\x02 \x03(\x0b\x32\x1f.dfs.PartitionMap.SubtreesEntry\x12\x0e\n\x06spread\x18\x03 \x03(\t\x1a/\n\rSubtreesEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t:\x02\x38\x01\";\n\x05\x43hunk\x12\x10\n\x08\x63hunk_id\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\x0c\x12\x12\n\nblock_pool\x18\x03 \x01(\t\"O\n\x13\x43hunkPipelineHeader\x12\x10\n\x08\x63hunk_id\x18\x01 \x01(\t\x12\x12\n\ndownstream\x18\x02 \x03(\t\x12\x12\n\nblock_pool\x18\x03 \x01(\t\"Q\n\nChunkFrame\x12*\n\x06header\x18\x01 \x01(\x0b\x32\x18.dfs.ChunkPipelineHeaderH\x00\x12\x0e\n\x04\x64\x61ta\x18\x02 \x01(\x0cH\x00\x42\x07\n\x05\x66rame\"6\n\x12StoreChunkResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"T\n\x0c\x43hunkRequest\x12\x10\n\x08\x63hunk_id\x18\x01 \x01(\t\x12\x0e\n\x06offset\x18\x02 \x01(\x04\x12\x0e\n\x06length\x18\x03 \x01(\x04\x12\x12\n\nblock_pool\x18\x04 \x01(\t\"7\n\x13\x44\x65leteChunkResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t\"\x12\n\x10HeartbeatRequest\"\x82\x01\n\x11HeartbeatResponse\x12\r\n\x05\x61live\x18\x01 \x01(\x08\x12\x30\n\x05stats\x18\x02 \x03(\x0b\x32!.dfs.HeartbeatResponse.StatsEntry\x1a,\n\nStatsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x04:\x02\x38\x01\x32\xb5\x07\n\rLeaderService\x12=\n\nUploadFile\x12\x16.dfs.FileUploadRequest\x1a\x17.dfs.FileUploadResponse\x12\x43\n\x10UploadFileStream\x12\x14.dfs.FileUploadFrame\x1a\x17.dfs.FileUploadResponse(\x01\x12\x39\n\x08ReadFile\x12\x14.dfs.FileReadRequest\x1a\x15.dfs.FileReadResponse0\x01\x12=\n\nDeleteFile\x12\x16.dfs.FileDeleteRequest\x1a\x17.dfs.FileDeleteResponse\x12I\n\x0e\x41llocateChunks\x12\x1a.dfs.AllocateChunksRequest\x1a\x1b.dfs.AllocateChunksResponse\x12=\n\nCommitFile\x12\x16.dfs.CommitFileRequest\x1a\x17.dfs.FileUploadResponse\x12\x44\n\x10GetFileLocations\x12\x14.dfs.FileReadRequest\x1a\x1a.dfs.FileLocationsResponse\x12=\n\nFindChunks\x12\x16.dfs.FindChunksRequest\x1a\x17.dfs.FindChunksResponse\x12\'\n\x04Stat\x12\x10.dfs.StatRequest\x1a\r.dfs.FileStat\x12:\n\tBatchStat\x12\x15.dfs.BatchStatRequest\x1a\x16.dfs.BatchStatResponse\x12:\n\tListFiles\x12\x15.dfs.ListFilesRequest\x1a\x16.dfs.ListFilesResponse\x12>\n\rMakeDirectory\x12\x15.dfs.DirectoryRequest\x1a\x16.dfs.NamespaceResponse\x12@\n\x0f\x44\x65leteDirectory\x12\x15.dfs.DirectoryRequest\x1a\x16.dfs.NamespaceResponse\x12\x34\n\x06Rename\x12\x12.dfs.RenameRequest\x1a\x16.dfs.NamespaceResponse\x12>\n\x0fGetPartitionMap\x12\x18.dfs.PartitionMapRequest\x1a\x11.dfs.PartitionMap2\xae\x02\n\x0f\x44\x61taNodeService\x12\x31\n\nStoreChunk\x12\n.dfs.Chunk\x1a\x17.dfs.StoreChunkResponse\x12@\n\x12StoreChunkPipeline\x12\x0f.dfs.ChunkFrame\x1a\x17.dfs.StoreChunkResponse(\x01\x12.\n\rRetrieveChunk\x12\x11.dfs.ChunkRequest\x1a\n.dfs.Chunk\x12:\n\x0b\x44\x65leteChunk\x12\x11.dfs.ChunkRequest\x1a\x18.dfs.DeleteChunkResponse\x12:\n\tHeartbeat\x12\x15.dfs.HeartbeatRequest\x1a\x16.dfs.HeartbeatResponseb\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'dfs_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_PARTITIONMAP_SUBTREESENTRY']._loaded_options = None
+  _globals['_PARTITIONMAP_SUBTREESENTRY']._serialized_options = b'8\001'
+  _globals['_HEARTBEATRESPONSE_STATSENTRY']._loaded_options = None
+  _globals['_HEARTBEATRESPONSE_STATSENTRY']._serialized_options = b'8\001'
+  _globals['_FILEUPLOADREQUEST']._serialized_start=18
+  _globals['_FILEUPLOADREQUEST']._serialized_end=70
+  _globals['_FILEUPLOADHEADER']._serialized_start=72
+  _globals['_FILEUPLOADHEADER']._serialized_end=109
+  _globals['_FILEUPLOADFRAME']._serialized_start=111
+  _globals['_FILEUPLOADFRAME']._serialized_end=194
+  _globals['_FILEUPLOADRESPONSE']._serialized_start=196
+  _globals['_FILEUPLOADRESPONSE']._serialized_end=250
+  _globals['_FILEREADREQUEST']._serialized_start=252
+  _globals['_FILEREADREQUEST']._serialized_end=320
+  _globals['_FILEREADRESPONSE']._serialized_start=322
+  _globals['_FILEREADRESPONSE']._serialized_end=354
+  _globals['_FILEDELETEREQUEST']._serialized_start=356
+  _globals['_FILEDELETEREQUEST']._serialized_end=394
+  _globals['_FILEDELETERESPONSE']._serialized_start=396
+  _globals['_FILEDELETERESPONSE']._serialized_end=450
+  _globals['_CHUNKLOCATION']._serialized_start=452
+  _globals['_CHUNKLOCATION']._serialized_end=519
+  _globals['_ALLOCATECHUNKSREQUEST']._serialized_start=521
+  _globals['_ALLOCATECHUNKSREQUEST']._serialized_end=599
+  _globals['_ALLOCATECHUNKSRESPONSE']._serialized_start=601
+  _globals['_ALLOCATECHUNKSRESPONSE']._serialized_end=681
+  _globals['_COMMITFILEREQUEST']._serialized_start=683
+  _globals['_COMMITFILEREQUEST']._serialized_end=757
+  _globals['_FILELOCATIONSRESPONSE']._serialized_start=759
+  _globals['_FILELOCATIONSRESPONSE']._serialized_end=838
+  _globals['_FINDCHUNKSREQUEST']._serialized_start=840
+  _globals['_FINDCHUNKSREQUEST']._serialized_end=878
+  _globals['_FINDCHUNKSRESPONSE']._serialized_start=880
+  _globals['_FINDCHUNKSRESPONSE']._serialized_end=928
+  _globals['_FILESTAT']._serialized_start=930
+  _globals['_FILESTAT']._serialized_end=1026
+  _globals['_STATREQUEST']._serialized_start=1028
+  _globals['_STATREQUEST']._serialized_end=1060
+  _globals['_BATCHSTATREQUEST']._serialized_start=1062
+  _globals['_BATCHSTATREQUEST']._serialized_end=1100
+  _globals['_BATCHSTATRESPONSE']._serialized_start=1102
+  _globals['_BATCHSTATRESPONSE']._serialized_end=1151
+  _globals['_LISTFILESREQUEST']._serialized_start=1153
+  _globals['_LISTFILESREQUEST']._serialized_end=1245
+  _globals['_LISTFILESRESPONSE']._serialized_start=1247
+  _globals['_LISTFILESRESPONSE']._serialized_end=1323
+  _globals['_DIRECTORYREQUEST']._serialized_start=1325
+  _globals['_DIRECTORYREQUEST']._serialized_end=1381
+  _globals['_RENAMEREQUEST']._serialized_start=1383
+  _globals['_RENAMEREQUEST']._serialized_end=1430
+  _globals['_NAMESPACERESPONSE']._serialized_start=1432
+  _globals['_NAMESPACERESPONSE']._serialized_end=1468
+  _globals['_PARTITIONMAPREQUEST']._serialized_start=1470
+  _globals['_PARTITIONMAPREQUEST']._serialized_end=1491
+  _globals['_PARTITION']._serialized_start=1493
+  _globals['_PARTITION']._serialized_end=1534
+  _globals['_PARTITIONMAP']._serialized_start=1537
+  _globals['_PARTITIONMAP']._serialized_end=1703
+  _globals['_PARTITIONMAP_SUBTREESENTRY']._serialized_start=1656
+  _globals['_PARTITIONMAP_SUBTREESENTRY']._serialized_end=1703
+  _globals['_CHUNK']._serialized_start=1705
+  _globals['_CHUNK']._serialized_end=1764
+  _globals['_CHUNKPIPELINEHEADER']._serialized_start=1766
+  _globals['_CHUNKPIPELINEHEADER']._serialized_end=1845
+  _globals['_CHUNKFRAME']._serialized_start=1847
+  _globals['_CHUNKFRAME']._serialized_end=1928
+  _globals['_STORECHUNKRESPONSE']._serialized_start=1930
+  _globals['_STORECHUNKRESPONSE']._serialized_end=1984
+  _globals['_CHUNKREQUEST']._serialized_start=1986
+  _globals['_CHUNKREQUEST']._serialized_end=2070
+  _globals['_DELETECHUNKRESPONSE']._serialized_start=2072
+  _globals['_DELETECHUNKRESPONSE']._serialized_end=2127
+  _globals['_HEARTBEATREQUEST']._serialized_start=2129
+  _globals['_HEARTBEATREQUEST']._serialized_end=2147
+  _globals['_HEARTBEATRESPONSE']._serialized_start=2150
+  _globals['_HEARTBEATRESPONSE']._serialized_end=2280
+  _globals['_HEARTBEATRESPONSE_STATSENTRY']._serialized_start=2236
+  _globals['_HEARTBEATRESPONSE_STATSENTRY']._serialized_end=2280
+  _globals['_LEADERSERVICE']._serialized_start=2283
+  _globals['_LEADERSERVICE']._serialized_end=3232
+  _globals['_DATANODESERVICE']._serialized_start=3235
+  _globals['_DATANODESERVICE']._serialized_end=3537
+# @@protoc_insertion_point(module_scope)
@@ -1,46 +1,432 @@
-from fuse import FUSE, Operations
+import errno
+import itertools
+import os
+import stat
+import threading
+import time
+
+import grpc
+import dfs_pb2
+import dfs_pb2_grpc
+from fuse import FUSE, FuseOSError, Operations
+
+from attr_cache import AttrCache
+from block_cache import BlockCache
+from partition_map import PartitionMap
+from write_buffer import WriteBuffer
+
+# A full 64MB chunk plus protobuf framing must fit in a single message
+MAX_MESSAGE_LENGTH = 65 * 1024 * 1024
+CHANNEL_OPTIONS = [
+    ("grpc.max_send_message_length", MAX_MESSAGE_LENGTH),
+    ("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH),
+]
+# Entries asked for per ListFiles call
+LIST_PAGE_SIZE = 10000
 
 
 class DistributedFileSystem(Operations):
     def __init__(self):
         # Initialize connection to leader node
-        self.channel = grpc.insecure_channel("leader_node_address")
+        self.channel = grpc.insecure_channel(
+            os.getenv("LEADER_ADDRESS", "leader:5000"), options=CHANNEL_OPTIONS)
         self.stub = dfs_pb2_grpc.LeaderServiceStub(self.channel)
+        # With federated leaders, calls go straight to the leader owning the
+        # path; the partition map is fetched from this leader on first use
+        self.partition_map = None
+        self._map_loaded = False
+        self._leader_stubs = {}
+        self._leader_stubs_lock = threading.Lock()
+        self._data_node_stubs = {}
+        self._data_node_stubs_lock = threading.Lock()
+        # Reads go through a chunk-aligned block cache with read-ahead
+        self.block_cache = BlockCache(
+            self._fetch_chunk,
+            self._locate,
+            capacity=int(os.getenv(
+                "BLOCK_CACHE_BYTES", str(512 * 1024 * 1024))),
+            max_read_ahead=int(os.getenv("READ_AHEAD_BLOCKS", "16")),
+        )
+        # getattr answers (and misses), filled by Stat and readdir
+        self.attr_cache = AttrCache(
+            ttl=float(os.getenv("ATTR_CACHE_TTL", "5")),
+            negative_ttl=float(os.getenv("NEGATIVE_CACHE_TTL", "1")),
+        )
+        # Files open for writing: fh -> WriteBuffer, uploaded on flush
+        self.spill_size = int(os.getenv(
+            "WRITE_BUFFER_BYTES", str(64 * 1024 * 1024)))
+        self._buffers = {}
+        self._buffers_lock = threading.Lock()
+        self._next_fh = itertools.count(1)
+
+    @staticmethod
+    def _name(path):
+        # Mount paths are absolute; file names on the leader are not
+        return path.lstrip("/")
+
+    def _leader_stub(self, address):
+        with self._leader_stubs_lock:
+            stub = self._leader_stubs.get(address)
+            if stub is None:
+                stub = dfs_pb2_grpc.LeaderServiceStub(grpc.insecure_channel(
+                    address, options=CHANNEL_OPTIONS))
+                self._leader_stubs[address] = stub
+            return stub
+
+    def _data_node_stub(self, address):
+        with self._data_node_stubs_lock:
+            stub = self._data_node_stubs.get(address)
+            if stub is None:
+                stub = dfs_pb2_grpc.DataNodeServiceStub(grpc.insecure_channel(
+                    address, options=CHANNEL_OPTIONS))
+                self._data_node_stubs[address] = stub
+            return stub
+
+    def _refresh_partition_map(self):
+        try:
+            response = self.stub.GetPartitionMap(
+                dfs_pb2.PartitionMapRequest())
+        except grpc.RpcError as e:
+            # A leader from before federation owns everything
+            if e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+            response = dfs_pb2.PartitionMap()
+        self.partition_map = PartitionMap.from_proto(response)
+        self._map_loaded = True
+
+    def _stubs_for(self, name):
+        # Stubs of the leaders holding name: its owner, or every leader for
+        # a shared directory such as the root, whose entries are spread
+        # over the partitions
+        if not self._map_loaded:
+            self._refresh_partition_map()
+        if self.partition_map is None:
+            return [self.stub]
+        address = self.partition_map.leader_of(name)
+        if address is None:
+            return [self._leader_stub(address) for address in
+                    dict.fromkeys(self.partition_map.partitions.values())]
+        return [self._leader_stub(address)]
+
+    def _route(self, name, call):
+        # Run call(stub) on the leader owning name. A leader that does not
+        # own it names the owner: the map is stale, so refresh it and retry
+        try:
+            return call(self._stubs_for(name)[0])
+        except grpc.RpcError as e:
+            leader = dict(e.trailing_metadata() or ()).get("leader")
+            if leader is None:
+                raise
+            self._refresh_partition_map()
+            return call(self._leader_stub(leader))
+
+    def _fetch_chunk(self, chunk_id, source, offset, length):
+        # Read a range of a chunk from the first replica that has it. Going
+        # by chunk rather than by file keeps a rewrite of the file from
+        # landing its new bytes under the old chunk's cache key
+        data_nodes, block_pool = source
+        request = dfs_pb2.ChunkRequest(
+            chunk_id=chunk_id, offset=offset, length=length,
+            block_pool=block_pool)
+        for data_node in data_nodes:
+            try:
+                data = self._data_node_stub(data_node).RetrieveChunk(
+                    request).data
+            except grpc.RpcError:
+                continue
+            if len(data) == length:
+                return data
+        # No replica could serve it
+        raise FuseOSError(errno.EIO)
+
+    def _locate(self, name):
+        try:
+            response = self._route(name, lambda stub: stub.GetFileLocations(
+                dfs_pb2.FileReadRequest(file_name=name)))
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.NOT_FOUND:
+                raise FuseOSError(errno.ENOENT)
+            raise
+        return [(chunk.chunk_id, chunk.size,
+                 (list(chunk.data_nodes), response.block_pool))
+                for chunk in response.chunks]
+
+    def _call(self, name, call, stub=None):
+        # Run a namespace RPC on the leader owning name, or on stub, raising
+        # the errno the leader reports
+        try:
+            if stub is not None:
+                return call(stub)
+            return self._route(name, call)
+        except grpc.RpcError as e:
+            for key, value in e.trailing_metadata() or ():
+                if key == "errno":
+                    raise FuseOSError(int(value))
+            raise
+
+    def _open_buffer(self, name):
+        # Buffer of a file with unflushed writes, if any handle has one
+        with self._buffers_lock:
+            for buffer in self._buffers.values():
+                if buffer.name == name and buffer.dirty:
+                    return buffer
+        return None
+
+    def _new_handle(self, buffer=None):
+        fh = next(self._next_fh)
+        if buffer is not None:
+            with self._buffers_lock:
+                self._buffers[fh] = buffer
+        return fh
+
+    def _load(self, buffer):
+        # Writes that do not replace the whole file start from its contents
+        if buffer.loaded:
+            return
+        buffer.loaded = True
+        try:
+            layout = self.block_cache.refresh(buffer.name)
+        except FuseOSError:
+            return
+        file_size = layout[2]
+        offset = 0
+        while offset < file_size:
+            data = self.block_cache.read(buffer.name, offset, 4 * 1024 * 1024)
+            buffer.write(offset, data)
+            offset += len(data)
+        buffer.dirty = False
+
+    def _upload(self, buffer):
+        # Send the whole file in one streamed upload
+        if not buffer.dirty:
+            return
+        def frames():
+            return itertools.chain(
+                [dfs_pb2.FileUploadFrame(header=dfs_pb2.FileUploadHeader(
+                    file_name=buffer.name))],
+                (dfs_pb2.FileUploadFrame(data=data)
+                 for data in buffer.frames()),
+            )
+        response = self._route(
+            buffer.name, lambda stub: stub.UploadFileStream(frames()))
+        if not response.success:
+            raise FuseOSError(errno.EIO)
+        buffer.dirty = False
+        self.block_cache.forget(buffer.name)
+        self.attr_cache.invalidate(buffer.name)
+
+    @staticmethod
+    def _attrs(file_stat):
+        # getattr result for a FileStat, None if the path does not exist
+        if not file_stat.exists:
+            return None
+        times = dict(st_ctime=file_stat.mtime, st_mtime=file_stat.mtime,
+                     st_atime=file_stat.mtime)
+        if file_stat.is_directory:
+            return dict(st_mode=stat.S_IFDIR | 0o755, st_nlink=2, **times)
+        return dict(st_mode=stat.S_IFREG | 0o644, st_nlink=1,
+                    st_size=file_stat.size, **times)
 
     def getattr(self, path, fh=None):
-        # Implement getattr by querying metadata
-        pass
+        name = self._name(path)
+        if not name:
+            now = time.time()
+            return dict(st_mode=stat.S_IFDIR | 0o755, st_nlink=2,
+                        st_ctime=now, st_mtime=now, st_atime=now)
+        buffer = self._open_buffer(name)
+        if buffer is not None:
+            now = time.time()
+            return dict(st_mode=stat.S_IFREG | 0o644, st_nlink=1,
+                        st_size=buffer.size,
+                        st_ctime=now, st_mtime=now, st_atime=now)
+        found, attrs = self.attr_cache.get(name)
+        if not found:
+            request = dfs_pb2.StatRequest(file_name=name)
+            stubs = self._stubs_for(name)
+            if len(stubs) > 1:
+                # A shared directory exists if any partition holds it
+                attrs = next(
+                    (attrs for attrs in (self._attrs(stub.Stat(request))
+                                         for stub in stubs)
+                     if attrs is not None), None)
+            else:
+                attrs = self._attrs(self._route(
+                    name, lambda stub: stub.Stat(request)))
+            self.attr_cache.put(name, attrs)
+        if attrs is None:
+            raise FuseOSError(errno.ENOENT)
+        return attrs
 
     def readdir(self, path, fh):
-        # Implement readdir by listing files/directories
-        pass
+        # Page through the listing; the attributes that come with it
+        # answer the getattr calls that usually follow (ls -l)
+        directory = self._name(path)
+        prefix = directory + "/" if directory else ""
+        names = [".", ".."]
+        stubs = self._stubs_for(directory)
+        if len(stubs) > 1:
+            # Each leader lists its own partition's entries of a shared
+            # directory; a shared subdirectory may show up on several
+            entries = {}
+            for stub in stubs:
+                for entry in self._list(stub, directory):
+                    entries.setdefault(entry.file_name, entry)
+            entries = entries.values()
+        else:
+            entries = self._route(
+                directory, lambda stub: self._list(stub, directory))
+        for entry in entries:
+            names.append(entry.file_name)
+            self.attr_cache.put(prefix + entry.file_name, self._attrs(entry))
+        return names
+
+    @staticmethod
+    def _list(stub, directory):
+        entries = []
+        page_token = ""
+        while True:
+            response = stub.ListFiles(dfs_pb2.ListFilesRequest(
+                directory=directory, page_token=page_token,
+                page_size=LIST_PAGE_SIZE))
+            entries.extend(response.entries)
+            page_token = response.next_page_token
+            if not page_token:
+                return entries
 
     def open(self, path, flags):
-        # Implement open (may not need to do anything)
-        pass
+        name = self._name(path)
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            buffer = WriteBuffer(name, self.spill_size)
+            if flags & os.O_TRUNC:
+                buffer.loaded = True
+                buffer.dirty = True
+            return self._new_handle(buffer)
+        # Pick up the file's current chunks; cached blocks of unchanged
+        # chunks are reused
+        self.block_cache.refresh(name)
+        return self._new_handle()
+
+    def create(self, path, mode, fi=None):
+        buffer = WriteBuffer(self._name(path), self.spill_size)
+        buffer.loaded = True
+        buffer.dirty = True
+        return self._new_handle(buffer)
 
     def read(self, path, size, offset, fh):
-        # Implement read by calling ReadFile on leader
-        response = self.stub.ReadFile(dfs_pb2.FileReadRequest(file_name=path))
-        return response.data[offset: offset + size]
+        buffer = self._buffers.get(fh)
+        if buffer is not None:
+            with buffer.lock:
+                self._load(buffer)
+                return buffer.read(offset, size)
+        return self.block_cache.read(self._name(path), offset, size)
 
     def write(self, path, data, offset, fh):
-        # Implement write by sending data to leader
-        response = self.stub.UploadFile(
-            dfs_pb2.FileUploadRequest(file_name=path, data=data)
-        )
-        return len(data)
+        # Buffered until flush/fsync/release uploads the whole file
+        buffer = self._buffers.get(fh)
+        if buffer is None:
+            raise FuseOSError(errno.EBADF)
+        with buffer.lock:
+            self._load(buffer)
+            return buffer.write(offset, data)
 
-    def create(self, path, mode, fi=None):
-        # Implement create (may be similar to write)
-        pass
+    def truncate(self, path, length, fh=None):
+        buffer = self._buffers.get(fh) if fh else None
+        if buffer is not None:
+            with buffer.lock:
+                self._load(buffer)
+                buffer.truncate(length)
+            return 0
+        # truncate(2) on a path: rewrite the file right away
+        buffer = WriteBuffer(self._name(path), self.spill_size)
+        try:
+            self._load(buffer)
+            buffer.truncate(length)
+            self._upload(buffer)
+        finally:
+            buffer.close()
+        return 0
+
+    def flush(self, path, fh):
+        buffer = self._buffers.get(fh)
+        if buffer is not None:
+            with buffer.lock:
+                self._upload(buffer)
+        return 0
+
+    def fsync(self, path, datasync, fh):
+        return self.flush(path, fh)
+
+    def release(self, path, fh):
+        with self._buffers_lock:
+            buffer = self._buffers.pop(fh, None)
+        if buffer is not None:
+            try:
+                with buffer.lock:
+                    self._upload(buffer)
+            finally:
+                buffer.close()
+        return 0
 
     def unlink(self, path):
         # Implement delete by calling DeleteFile on leader
-        response = self.stub.DeleteFile(
-            dfs_pb2.FileDeleteRequest(file_name=path))
+        name = self._name(path)
+        response = self._route(name, lambda stub: stub.DeleteFile(
+            dfs_pb2.FileDeleteRequest(file_name=name)))
+        self.block_cache.forget(name)
+        self.attr_cache.invalidate(name)
         return 0 if response.success else -1
 
+    def mkdir(self, path, mode):
+        name = self._name(path)
+        self._call(name, lambda stub: stub.MakeDirectory(
+            dfs_pb2.DirectoryRequest(directory=name)))
+        self.attr_cache.invalidate(name)
+        return 0
+
+    def rmdir(self, path):
+        name = self._name(path)
+        def call(stub):
+            return stub.DeleteDirectory(
+                dfs_pb2.DirectoryRequest(directory=name))
+        stubs = self._stubs_for(name)
+        if len(stubs) > 1:
+            # A shared directory goes from every partition holding part of it
+            removed = False
+            for stub in stubs:
+                try:
+                    self._call(name, call, stub)
+                    removed = True
+                except FuseOSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+            if not removed:
+                raise FuseOSError(errno.ENOENT)
+        else:
+            self._call(name, call)
+        self.attr_cache.invalidate_tree(name)
+        return 0
+
+    def rename(self, old, new):
+        old, new = self._name(old), self._name(new)
+        with self._buffers_lock:
+            moved = [buffer for buffer in self._buffers.values()
+                     if buffer.name == old
+                     or buffer.name.startswith(old + "/")]
+        # Files written but not yet flushed must exist before they move
+        for buffer in moved:
+            with buffer.lock:
+                self._upload(buffer)
+        # Renames across partitions fail with EXDEV; mv then copies
+        self._call(old, lambda stub: stub.Rename(
+            dfs_pb2.RenameRequest(source=old, target=new)))
+        # Handles still open on the moved files flush to the new names
+        for buffer in moved:
+            buffer.name = new + buffer.name[len(old):]
+        for name in (old, new):
+            self.block_cache.forget(name)
+            self.attr_cache.invalidate_tree(name)
+        return 0
+
 
 if __name__ == "__main__":
     fuse = FUSE(DistributedFileSystem(),
@@ -0,0 +1,66 @@
+import tempfile
+import threading
+
+# Size of each data frame streamed to the leader on upload
+UPLOAD_FRAME_SIZE = 1024 * 1024
+
+
+class WriteBuffer:
+    def __init__(self, name, spill_size=64 * 1024 * 1024):
+        """
+        Contents of a file opened for writing, kept until they are uploaded
+        as a whole. Held in memory up to spill_size bytes, then spilled to
+        a local temporary file. Writes may come at any offset: skipped
+        ranges read back as zeros.
+        :param name: File name on the leader
+        :param spill_size: Bytes kept in memory before spilling to disk
+        """
+        self.name = name
+        self.size = 0
+        self.dirty = False
+        self.loaded = False
+        self.lock = threading.Lock()
+        self._file = tempfile.SpooledTemporaryFile(max_size=spill_size)
+
+    def write(self, offset, data):
+        """
+        Write data at offset, zero-filling any gap after the current end.
+        :return: Number of bytes written
+        """
+        self._file.seek(offset)
+        self._file.write(data)
+        self.size = max(self.size, offset + len(data))
+        self.dirty = True
+        return len(data)
+
+    def read(self, offset, size):
+        self._file.seek(offset)
+        return self._file.read(max(min(size, self.size - offset), 0))
+
+    def truncate(self, length):
+        """Cut the file to length bytes, or zero-extend it to that size."""
+        if length < self.size:
+            self._file.truncate(length)
+        elif length > self.size:
+            # Writing the last byte fills the gap before it with zeros
+            self._file.seek(length - 1)
+            self._file.write(b"\0")
+        self.size = length
+        self.dirty = True
+
+    def frames(self, frame_size=UPLOAD_FRAME_SIZE):
+        """
+        Read the whole buffer back in order.
+        :return: Generator of up to frame_size bytes per item
+        """
+        self._file.seek(0)
+        remaining = self.size
+        while remaining > 0:
+            data = self._file.read(min(frame_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,39 @@
+import os
+import sys
+import time
+
+import chunk_hash
+
+CHUNK_SIZES = [4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024]
+# Hash at least this many bytes per measurement so short runs do not dominate
+MIN_BYTES = 512 * 1024 * 1024
+
+
+def bench(algorithm, chunk_size):
+    # Single-threaded throughput in MB/s for one chunk size
+    hasher = chunk_hash.get_hasher(algorithm)
+    chunk = os.urandom(chunk_size)
+    hasher(chunk)  # Warm up
+    rounds = max(1, MIN_BYTES // chunk_size)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        hasher(chunk)
+    elapsed = time.perf_counter() - started
+    return rounds * chunk_size / elapsed / (1024 * 1024)
+
+
+def main():
+    algorithms = chunk_hash.available_algorithms()
+    missing = sorted(set(chunk_hash.ALGORITHMS) - set(algorithms))
+    if missing:
+        print(f"Skipping (not installed): {', '.join(missing)}", file=sys.stderr)
+
+    print("Chunk hash throughput per core (MB/s)")
+    print(f"{'algorithm':<10}" + "".join(f"{s >> 20:>8}MB" for s in CHUNK_SIZES))
+    for algorithm in algorithms:
+        results = [bench(algorithm, size) for size in CHUNK_SIZES]
+        print(f"{algorithm:<10}" + "".join(f"{r:>10.0f}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from metadata_store import MetadataManager
+from namespace import Namespace
+
+BACKENDS = {
+    "sqlite": lambda root: MetadataManager(os.path.join(root, "metadata.db")),
+    "memory": lambda root: Namespace(os.path.join(root, "namespace")),
+}
+THREAD_COUNTS = [1, 4, 16]
+# Each registered file: CHUNKS_PER_FILE add_chunk calls plus one add_file,
+# then one get_chunks_for_file and one stat reading it back
+FILES_PER_THREAD = 250
+CHUNKS_PER_FILE = 4
+DATA_NODES = json.dumps(["datanode1:5001", "datanode2:5001"])
+
+
+def worker(metadata, thread, errors):
+    try:
+        for i in range(FILES_PER_THREAD):
+            chunk_ids = [
+                hashlib.sha256(f"{thread}-{i}-{c}".encode()).hexdigest()
+                for c in range(CHUNKS_PER_FILE)
+            ]
+            for chunk_id in chunk_ids:
+                metadata.add_chunk(chunk_id, DATA_NODES, chunk_id, 1 << 20)
+            file_name = f"bench/{thread}/file{i}"
+            metadata.add_file(file_name, json.dumps(chunk_ids))
+            metadata.get_chunks_for_file(file_name)
+            metadata.stat(file_name)
+    except Exception as e:
+        errors.append(e)
+
+
+def bench(backend, thread_count):
+    # Metadata operations per second with thread_count concurrent clients
+    with tempfile.TemporaryDirectory() as root:
+        metadata = BACKENDS[backend](root)
+        errors = []
+        threads = [
+            threading.Thread(target=worker, args=(metadata, t, errors))
+            for t in range(thread_count)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        metadata.close()
+    ops = thread_count * FILES_PER_THREAD * (CHUNKS_PER_FILE + 3)
+    return ops / elapsed, errors
+
+
+def main():
+    print("Metadata operations per second")
+    print(f"{'backend':>8}{'threads':>8}{'ops/s':>10}  errors")
+    for backend in BACKENDS:
+        for thread_count in THREAD_COUNTS:
+            rate, errors = bench(backend, thread_count)
+            error = f"{len(errors)} ({type(errors[0]).__name__})" if errors else "0"
+            print(f"{backend:>8}{thread_count:>8}{rate:>10.0f}  {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import hashlib
+
+import numpy as np
+
+# Gear table: one pseudo-random 32-bit value per byte value. Derived from
+# SHA-256 so chunk boundaries are stable across processes and releases.
+GEAR = np.array(
+    [
+        int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little")
+        for i in range(256)
+    ],
+    dtype=np.uint32,
+)
+# A 32-bit gear hash only depends on the last 32 bytes it has seen
+WINDOW = 32
+# Bytes hashed per numpy pass while looking for a cut point; small enough
+# for the working arrays to stay in cache
+SCAN_BLOCK_SIZE = 32 * 1024
+
+
+class ContentDefinedChunker:
+    def __init__(
+        self,
+        min_size=4 * 1024 * 1024,
+        avg_size=16 * 1024 * 1024,
+        max_size=64 * 1024 * 1024,
+    ):
+        """
+        FastCDC-style content-defined chunking with a gear rolling hash.
+        Cut points depend only on the bytes around them, so inserting or
+        deleting bytes only changes the chunks next to the edit.
+        :param min_size: Smallest chunk produced (except a file's last chunk)
+        :param avg_size: Target average chunk size
+        :param max_size: Largest chunk produced
+        """
+        if not WINDOW * 2 <= min_size <= avg_size <= max_size:
+            raise ValueError("CDC sizes must satisfy 64 <= min <= avg <= max")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        # Normalized chunking: a stricter mask before the average size and a
+        # looser one after it pull chunk sizes towards the average. Masks use
+        # the high bits, which mix in the most bytes of the window.
+        bits = min(max(round(np.log2(avg_size)), 3), WINDOW - 2)
+        self.mask_small = self._high_bits(bits + 2)
+        self.mask_large = self._high_bits(bits - 2)
+
+    @staticmethod
+    def _high_bits(count):
+        return np.uint32(((1 << count) - 1) << (WINDOW - count))
+
+    @staticmethod
+    def _gear_hashes(data, start, end):
+        # Gear hash h[i] = (h[i-1] << 1) + GEAR[b[i]] (mod 2^32) of every
+        # position in [start, end), computed for the whole block at once: the
+        # hash sums GEAR[b[i-k]] << k over the 32-byte window, and doubling
+        # the window each pass gets there in log2(32) = 5 vector passes.
+        first = start - (WINDOW - 1)
+        raw = np.frombuffer(data, dtype=np.uint8, count=end - first, offset=first)
+        h = np.take(GEAR, raw)
+        shift = 1
+        while shift < WINDOW:
+            h[shift:] += h[:-shift] << np.uint32(shift)
+            shift *= 2
+        return h[WINDOW - 1 :]
+
+    def _find(self, data, start, end, mask):
+        # First position in [start, end) whose hash has all mask bits clear
+        for block_start in range(start, end, SCAN_BLOCK_SIZE):
+            block_end = min(block_start + SCAN_BLOCK_SIZE, end)
+            hits = np.flatnonzero(
+                (self._gear_hashes(data, block_start, block_end) & mask) == 0
+            )
+            if hits.size:
+                return block_start + int(hits[0])
+        return None
+
+    def find_cut(self, data, start=0, final=False):
+        """
+        Find where the chunk starting at data[start] ends.
+        :param data: Bytes-like buffer
+        :param start: Offset of the chunk's first byte in data
+        :param final: Whether data holds everything left of the file
+        :return: Chunk length, or None if more data is needed to decide
+        """
+        available = len(data) - start
+        if available <= self.min_size:
+            return available if final else None
+        limit = min(available, self.max_size)
+        # Candidate cuts come after byte positions min_size-1 .. limit-2
+        for lo, hi, mask in (
+            (self.min_size - 1, self.avg_size - 1, self.mask_small),
+            (self.avg_size - 1, limit - 1, self.mask_large),
+        ):
+            hi = min(hi, limit - 1)
+            if lo < hi:
+                position = self._find(data, start + lo, start + hi, mask)
+                if position is not None:
+                    return position - start + 1
+        if available >= self.max_size or final:
+            return limit
+        return None
@@ -1,29 +1,165 @@
 import json
-import hashlib
-import random
+import queue
+import threading
+from collections import deque
+from concurrent import futures
+
+import grpc
+import dfs_pb2
+import dfs_pb2_grpc
+import chunk_hash
+from hash_ring import HashRing
+from replica_selector import ReplicaSelector
+from single_flight import SingleFlight
+
+# A full 64MB chunk plus protobuf framing must fit in a single message
+MAX_MESSAGE_LENGTH = 65 * 1024 * 1024
+CHANNEL_OPTIONS = [
+    ("grpc.max_send_message_length", MAX_MESSAGE_LENGTH),
+    ("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH),
+]
+# Size of each data frame sent down a replication pipeline
+PIPELINE_FRAME_SIZE = 1024 * 1024
+
+
+class ReplicationError(Exception):
+    pass
+
+
+class ChunkUnavailableError(Exception):
+    pass
 
 
 class ChunkManager:
-    def __init__(self, data_nodes, replication_factor=2):
+    def __init__(
+        self,
+        data_nodes,
+        replication_factor=2,
+        max_in_flight=2,
+        rpc_timeout=60,
+        replication_mode="pipeline",
+        read_ahead=4,
+        read_ahead_bytes=256 * 1024 * 1024,
+        read_threads=16,
+        hedge_percentile=95,
+        weights=None,
+        chunker=None,
+        hash_algorithm=chunk_hash.DEFAULT_ALGORITHM,
+        block_pool="",
+    ):
         """
         Initialize the ChunkManager.
         :param data_nodes: List of active data node addresses (e.g., ["node1:5001", "node2:5001"])
         :param replication_factor: Number of replicas for each chunk
+        :param max_in_flight: Number of chunks of one file being replicated at once
+        :param rpc_timeout: Seconds to wait for a data node to answer
+        :param replication_mode: "pipeline" sends each chunk once to the first
+                                 replica, which forwards it down the chain;
+                                 "fanout" sends it to every replica directly
+        :param read_ahead: Number of chunks a streaming read fetches ahead
+        :param read_ahead_bytes: Cap on the bytes a streaming read holds ahead
+        :param read_threads: Threads shared by all read-ahead fetches
+        :param hedge_percentile: Replica latency percentile after which a read
+                                 is also sent to a second replica (0 disables)
+        :param weights: Optional {data_node: weight} for uneven placement
+        :param chunker: Optional ContentDefinedChunker; without one files are
+                        cut at fixed chunk_size offsets
+        :param hash_algorithm: Content hash for new chunk ids: "sha256",
+                               "blake3" or "xxh3"
+        :param block_pool: Block pool on the data nodes this leader's chunks
+                           are stored in; "" for the default pool
         """
+        if replication_mode not in ("pipeline", "fanout"):
+            raise ValueError(f"Unknown replication mode: {replication_mode}")
         self.data_nodes = data_nodes
+        self.ring = HashRing(data_nodes, weights=weights)
         self.replication_factor = replication_factor
+        self.chunker = chunker
+        self.hash_algorithm = hash_algorithm
+        self.block_pool = block_pool
+        self._hasher = chunk_hash.get_hasher(hash_algorithm)
+        self.replication_mode = replication_mode
+        self.max_in_flight = max_in_flight
+        self.rpc_timeout = rpc_timeout
+        self.read_ahead = read_ahead
+        self.read_ahead_bytes = read_ahead_bytes
+        self._stubs = {}
+        self._stubs_lock = threading.Lock()
+        self._read_pool = futures.ThreadPoolExecutor(max_workers=read_threads)
+        self.replica_selector = ReplicaSelector(hedge_percentile=hedge_percentile)
+        # Concurrent reads of the same chunk range share one fetch
+        self._fetches = SingleFlight()
+
+    def get_stub(self, data_node):
+        """
+        Return the long-lived DataNodeService stub for a data node, opening
+        its channel on first use.
+        :param data_node: Data node address
+        :return: DataNodeServiceStub
+        """
+        stub = self._stubs.get(data_node)
+        if stub is None:
+            with self._stubs_lock:
+                stub = self._stubs.get(data_node)
+                if stub is None:
+                    channel = grpc.insecure_channel(data_node, options=CHANNEL_OPTIONS)
+                    stub = dfs_pb2_grpc.DataNodeServiceStub(channel)
+                    self._stubs[data_node] = stub
+        return stub
 
     def shard_file(self, file_data, chunk_size=64 * 1024 * 1024):
         """
         Split file data into chunks.
         :param file_data: Binary file data
         :param chunk_size: Maximum size of each chunk (default 64MB)
-        :return: List of chunks
+        :return: Generator of chunks
         """
-        chunks = [
-            file_data[i : i + chunk_size] for i in range(0, len(file_data), chunk_size)
-        ]
-        return chunks
+        if self.chunker is not None:
+            start = 0
+            while start < len(file_data):
+                length = self.chunker.find_cut(file_data, start, final=True)
+                yield file_data[start : start + length]
+                start += length
+            return
+
+        for i in range(0, len(file_data), chunk_size):
+            yield file_data[i : i + chunk_size]
+
+    def stream_chunks(self, data_stream, chunk_size=64 * 1024 * 1024):
+        """
+        Cut a stream of binary blocks into chunks as the bytes arrive.
+        Only the chunk currently being filled is buffered.
+        :param data_stream: Iterable of binary blocks (e.g. upload frames)
+        :param chunk_size: Maximum size of each chunk (default 64MB)
+        :return: Generator of chunks
+        """
+        if self.chunker is not None:
+            yield from self._stream_content_defined(data_stream)
+            return
+
+        buffer = bytearray()
+        for block in data_stream:
+            buffer += block
+            while len(buffer) >= chunk_size:
+                yield bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+        if buffer:
+            yield bytes(buffer)
+
+    def _stream_content_defined(self, data_stream):
+        # A cut point is only searched for once a whole max-size window is
+        # buffered, so no byte is hashed more than once per chunk
+        buffer = bytearray()
+        for block in data_stream:
+            buffer += block
+            while len(buffer) >= self.chunker.max_size:
+                length = self.chunker.find_cut(buffer)
+                yield bytes(buffer[:length])
+                del buffer[:length]
+        while buffer:
+            length = self.chunker.find_cut(buffer, final=True)
+            yield bytes(buffer[:length])
+            del buffer[:length]
 
     def generate_chunk_id(self, chunk_data):
         """
@@ -31,7 +167,7 @@ class ChunkManager:
         :param chunk_data: Binary data of the chunk
         :return: Chunk ID (hash string)
         """
-        return hashlib.sha256(chunk_data).hexdigest()
+        return chunk_hash.make_chunk_id(self._hasher(chunk_data), self.hash_algorithm)
 
     def assign_data_nodes(self, chunk_id):
         """
@@ -39,19 +175,273 @@ class ChunkManager:
         :param chunk_id: The ID of the chunk
         :return: List of data node addresses
         """
-        chunk_hash = int(hashlib.sha256(chunk_id.encode()).hexdigest(), 16)
-        random.seed(chunk_hash)  # Seed the random generator with the hash
-        nodes = random.sample(
-            self.data_nodes, min(len(self.data_nodes), self.replication_factor)
-        )
-        return nodes
+        # The id already is a uniform content hash; use its tail as the ring
+        # position instead of hashing it a second time
+        position = int(chunk_id[-16:], 16)
+        return self.ring.get_nodes_at(position, self.replication_factor)
+
+    def add_data_node(self, data_node, weight=1):
+        """
+        Start placing chunks on a data node (or change its weight).
+        :param data_node: Data node address
+        :param weight: Relative share of chunks the node should receive
+        """
+        self.ring.add_node(data_node, weight)
+        self.data_nodes = self.ring.nodes
+
+    def remove_data_node(self, data_node):
+        """
+        Stop placing chunks on a data node.
+        :param data_node: Data node address
+        """
+        self.ring.remove_node(data_node)
+        self.data_nodes = self.ring.nodes
 
     def replicate_chunk(self, chunk_id, chunk_data, data_nodes):
         """
-        Send the chunk to its assigned data nodes (this is a stub for actual gRPC communication).
+        Send the chunk to all of its assigned data nodes.
         :param chunk_id: ID of the chunk
         :param chunk_data: Binary data of the chunk
         :param data_nodes: List of data nodes
+        :raises ReplicationError: If any replica could not be stored
+        """
+        calls = self._send_replicas(chunk_id, chunk_data, data_nodes)
+        self._wait_replicas(chunk_id, calls)
+
+    def replicate_chunks(self, chunks):
+        """
+        Replicate a sequence of chunks, keeping up to max_in_flight chunks
+        (with all of their replicas) on the wire at once.
+        :param chunks: Iterable of (chunk_id, chunk_data, data_nodes)
+        :return: Generator of (chunk_id, size, data_nodes) in input order,
+                 each yielded once every replica has acknowledged it
+        :raises ReplicationError: If any replica could not be stored
+        """
+        pending = deque()
+        try:
+            for chunk_id, chunk_data, data_nodes in chunks:
+                if len(pending) >= self.max_in_flight:
+                    yield self._finish_replicas(pending.popleft())
+                calls = self._send_replicas(chunk_id, chunk_data, data_nodes)
+                pending.append((chunk_id, len(chunk_data), data_nodes, calls))
+            while pending:
+                yield self._finish_replicas(pending.popleft())
+        finally:
+            # Abandon whatever is still on the wire if the upload failed
+            for _, _, _, calls in pending:
+                for _, call in calls:
+                    call.cancel()
+
+    def delete_chunks(self, chunks):
         """
-        print(f"Replicating chunk {chunk_id} to nodes: {data_nodes}")
-        # Actual gRPC calls to store the chunk on the data nodes would go here.
+        Delete chunks from every data node holding them. Best effort: a
+        replica that is missing or unreachable is skipped.
+        :param chunks: Iterable of (chunk_id, data_nodes)
+        """
+        calls = [
+            self.get_stub(node).DeleteChunk.future(
+                dfs_pb2.ChunkRequest(chunk_id=chunk_id, block_pool=self.block_pool),
+                timeout=self.rpc_timeout,
+            )
+            for chunk_id, data_nodes in chunks
+            for node in data_nodes
+        ]
+        for call in calls:
+            try:
+                call.result()
+            except grpc.RpcError:
+                pass
+
+    def retrieve_chunk(self, chunk_id, data_nodes, offset=0, length=0):
+        """
+        Fetch a chunk, or a byte range of it, from its best replica. If that
+        replica is slower than usual the read is hedged to the next one and
+        whichever answers first wins; failed replicas fall over to the rest.
+        Concurrent calls for the same range share a single fetch.
+        :param chunk_id: ID of the chunk
+        :param data_nodes: Data nodes holding a replica of the chunk
+        :param offset: First byte of the range within the chunk
+        :param length: Number of bytes to read, 0 to read to the end
+        :return: Binary data of the chunk range
+        :raises ChunkUnavailableError: If no replica could be read
+        """
+        return self._fetches.do(
+            (chunk_id, offset, length),
+            self._fetch_chunk,
+            chunk_id,
+            data_nodes,
+            offset,
+            length,
+        )
+
+    def locate_chunk(self, chunk_id):
+        """
+        Find a chunk the metadata has no record of by asking every data node
+        for it, e.g. when upgrading metadata that never recorded chunks.
+        :param chunk_id: ID of the chunk
+        :return: (data nodes holding it, size in bytes), or None if no data
+                 node answered with it
+        """
+        holders = []
+        size = None
+        for node in self.data_nodes:
+            # The first holder sends the whole chunk to measure it; the
+            # others only need to show they have it
+            request = dfs_pb2.ChunkRequest(
+                chunk_id=chunk_id,
+                length=0 if size is None else 1,
+                block_pool=self.block_pool,
+            )
+            try:
+                data = (
+                    self.get_stub(node)
+                    .RetrieveChunk(request, timeout=self.rpc_timeout)
+                    .data
+                )
+            except grpc.RpcError:
+                continue
+            holders.append(node)
+            if size is None:
+                size = len(data)
+        return (holders, size) if holders else None
+
+    def _fetch_chunk(self, chunk_id, data_nodes, offset, length):
+        request = dfs_pb2.ChunkRequest(
+            chunk_id=chunk_id,
+            offset=offset,
+            length=length,
+            block_pool=self.block_pool,
+        )
+        candidates = deque(self.replica_selector.rank(data_nodes, length))
+        answers = queue.SimpleQueue()
+        calls = {}
+        errors = []
+
+        def send(node):
+            started = self.replica_selector.begin(node)
+            call = self.get_stub(node).RetrieveChunk.future(
+                request, timeout=self.rpc_timeout
+            )
+
+            def done(call):
+                self.replica_selector.end(
+                    node,
+                    started,
+                    length,
+                    success=call.code() == grpc.StatusCode.OK,
+                    cancelled=call.cancelled(),
+                )
+                answers.put((node, call))
+
+            calls[node] = call
+            call.add_done_callback(done)
+
+        if candidates:
+            send(candidates.popleft())
+        hedged = False
+        try:
+            while calls:
+                wait = None
+                if candidates and not hedged:
+                    wait = self.replica_selector.hedge_delay(next(iter(calls)), length)
+                try:
+                    node, call = answers.get(timeout=wait)
+                except queue.Empty:
+                    # The replica is slow; race it against the next best one
+                    hedged = True
+                    send(candidates.popleft())
+                    continue
+                del calls[node]
+                try:
+                    return call.result().data
+                except grpc.RpcError as e:
+                    errors.append(f"{node}: {e.details()}")
+                    if candidates and not calls:
+                        send(candidates.popleft())
+        finally:
+            for call in calls.values():
+                call.cancel()
+        raise ChunkUnavailableError(
+            f"No replica of chunk {chunk_id} could be read ({'; '.join(errors)})"
+        )
+
+    def retrieve_ranges(self, ranges):
+        """
+        Fetch a sequence of chunk ranges in order, keeping up to read_ahead
+        of them (and at most read_ahead_bytes) in flight ahead of the caller.
+        :param ranges: Iterable of (chunk_id, data_nodes, offset, length)
+        :return: Generator of binary data, one item per range, in order
+        :raises ChunkUnavailableError: If no replica of a chunk could be read
+        """
+        pending = deque()
+        pending_bytes = 0
+        try:
+            for chunk_id, data_nodes, offset, length in ranges:
+                # Hand data to the caller until the next fetch fits in the window
+                while pending and (
+                    len(pending) >= self.read_ahead
+                    or pending_bytes + length > self.read_ahead_bytes
+                ):
+                    fetch, size = pending.popleft()
+                    pending_bytes -= size
+                    yield fetch.result()
+                fetch = self._read_pool.submit(
+                    self.retrieve_chunk, chunk_id, data_nodes, offset, length
+                )
+                pending.append((fetch, length))
+                pending_bytes += length
+            while pending:
+                fetch, _ = pending.popleft()
+                yield fetch.result()
+        finally:
+            # The reader went away; drop fetches that have not started yet
+            for fetch, _ in pending:
+                fetch.cancel()
+
+    def _send_replicas(self, chunk_id, chunk_data, data_nodes):
+        if self.replication_mode == "pipeline":
+            # One copy leaves the leader; the chain acks once all replicas commit
+            frames = self._pipeline_frames(chunk_id, chunk_data, data_nodes[1:])
+            stub = self.get_stub(data_nodes[0])
+            call = stub.StoreChunkPipeline.future(frames, timeout=self.rpc_timeout)
+            return [(data_nodes[0], call)]
+
+        request = dfs_pb2.Chunk(
+            chunk_id=chunk_id, data=chunk_data, block_pool=self.block_pool
+        )
+        return [
+            (
+                node,
+                self.get_stub(node).StoreChunk.future(
+                    request, timeout=self.rpc_timeout
+                ),
+            )
+            for node in data_nodes
+        ]
+
+    def _pipeline_frames(self, chunk_id, chunk_data, downstream):
+        yield dfs_pb2.ChunkFrame(
+            header=dfs_pb2.ChunkPipelineHeader(
+                chunk_id=chunk_id, downstream=downstream, block_pool=self.block_pool
+            )
+        )
+        for i in range(0, len(chunk_data), PIPELINE_FRAME_SIZE):
+            yield dfs_pb2.ChunkFrame(data=chunk_data[i : i + PIPELINE_FRAME_SIZE])
+
+    def _finish_replicas(self, replication):
+        chunk_id, size, data_nodes, calls = replication
+        self._wait_replicas(chunk_id, calls)
+        return chunk_id, size, data_nodes
+
+    def _wait_replicas(self, chunk_id, calls):
+        for node, call in calls:
+            try:
+                response = call.result()
+            except grpc.RpcError as e:
+                raise ReplicationError(
+                    f"Failed to store chunk {chunk_id} on {node}: {e.details()}"
+                )
+            if not response.success:
+                raise ReplicationError(
+                    f"Failed to store chunk {chunk_id} on {node}: {response.message}"
+                )
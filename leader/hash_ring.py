@@ -0,0 +1,92 @@
+import bisect
+import hashlib
+import threading
+
+
+class HashRing:
+    def __init__(self, nodes=(), weights=None, vnodes=128):
+        """
+        Consistent-hash ring that places keys on data nodes. Each node owns
+        vnodes * weight points on the ring, so adding or removing one node
+        only moves the keys next to its points (about 1/N of them).
+        :param nodes: Initial node addresses
+        :param weights: Optional {node: weight}; nodes default to weight 1
+        :param vnodes: Ring points per unit of weight
+        """
+        self.vnodes = vnodes
+        self._weights = {}
+        self._lock = threading.Lock()
+        # (sorted point hashes, owning node per point); replaced as a whole on
+        # membership changes so lookups can read it without locking
+        self._ring = ([], [])
+        weights = weights or {}
+        for node in nodes:
+            self._weights[node] = weights.get(node, 1)
+        self._rebuild()
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def _rebuild(self):
+        points = sorted(
+            (self._hash(f"{node}#{i}"), node)
+            for node, weight in self._weights.items()
+            for i in range(max(1, round(self.vnodes * weight)))
+        )
+        self._ring = ([h for h, _ in points], [node for _, node in points])
+
+    @property
+    def nodes(self):
+        return list(self._weights)
+
+    def add_node(self, node, weight=1):
+        """
+        Add a node to the ring, or change its weight.
+        :param node: Node address
+        :param weight: Relative share of keys the node should own
+        """
+        with self._lock:
+            self._weights[node] = weight
+            self._rebuild()
+
+    def remove_node(self, node):
+        """
+        Remove a node from the ring; only the keys it owned move.
+        :param node: Node address
+        """
+        with self._lock:
+            if self._weights.pop(node, None) is not None:
+                self._rebuild()
+
+    def get_nodes(self, key, count):
+        """
+        Find the nodes responsible for a key: the owners of the first
+        distinct points clockwise from the key's hash.
+        :param key: Key to place
+        :param count: Number of distinct nodes wanted
+        :return: List of up to count node addresses, primary first
+        """
+        return self.get_nodes_at(self._hash(key), count)
+
+    def get_nodes_at(self, position, count):
+        """
+        Like get_nodes, for a key that is already a uniform 64-bit hash
+        (e.g. taken from a content-hash chunk id), so it is not hashed again.
+        :param position: Position on the ring, 0 <= position < 2**64
+        :param count: Number of distinct nodes wanted
+        :return: List of up to count node addresses, primary first
+        """
+        hashes, owners = self._ring
+        if not hashes:
+            return []
+        count = min(count, len(self._weights))
+        start = bisect.bisect(hashes, position)
+        nodes = []
+        for i in range(len(hashes)):
+            node = owners[(start + i) % len(hashes)]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == count:
+                    break
+        return nodes
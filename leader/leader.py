@@ -1,42 +1,284 @@
+import errno
 import json
+import threading
 import grpc
 from concurrent import futures
 import dfs_pb2_grpc
-from metadata_store import MetadataManager
-from chunk_manager import ChunkManager
+from metadata_store import (
+    CHUNK_LEASE,
+    DEFAULT_PAGE_SIZE,
+    MetadataManager,
+    MissingChunksError,
+    _path_error,
+)
+from namespace import Namespace
+from partition_map import PartitionMap
+from chunk_manager import ChunkManager, ChunkUnavailableError, ReplicationError
+from cdc import ContentDefinedChunker
+import chunk_hash
 
 # Import generated gRPC classes
 import dfs_pb2
 import os
 
+# Most entries one ListFiles page may return
+MAX_PAGE_SIZE = 10000
+# Files of recursively deleted directories removed per metadata write
+PURGE_BATCH_SIZE = 1000
+# Seconds between checks for deleted directories left to purge
+PURGE_INTERVAL = 60
+# gRPC status for the errno of a failed namespace operation
+STATUS_CODES = {
+    errno.ENOENT: grpc.StatusCode.NOT_FOUND,
+    errno.EEXIST: grpc.StatusCode.ALREADY_EXISTS,
+    errno.EINVAL: grpc.StatusCode.INVALID_ARGUMENT,
+}
+
 
 class LeaderService(dfs_pb2_grpc.LeaderServiceServicer):
     def __init__(self):
-        self.metadata_manager = MetadataManager()
-        data_nodes = os.getenv("DATA_NODES", "").split(",")
+        # Federation: PARTITIONS lists every leader as name=address and
+        # PARTITION names this one; without them this leader owns the whole
+        # namespace. SUBTREES pins directories, at any depth, to partitions;
+        # SPREAD lists directories whose entries are partitioned one by one.
+        self.partition = os.getenv("PARTITION", "")
+        self.partition_map = None
+        if os.getenv("PARTITIONS"):
+            self.partition_map = PartitionMap.parse(
+                os.getenv("PARTITIONS"),
+                os.getenv("SUBTREES", ""),
+                os.getenv("SPREAD", ""),
+            )
+            if self.partition not in self.partition_map.partitions:
+                raise ValueError(
+                    f"PARTITION '{self.partition}' is not one of PARTITIONS."
+                )
+        data_nodes = [node for node in os.getenv("DATA_NODES", "").split(",") if node]
         if not data_nodes:
             raise ValueError(
                 "No data nodes provided. Set DATA_NODES environment variable."
             )
-        self.chunk_manager = ChunkManager(data_nodes=data_nodes, replication_factor=2)
+        # Optional placement weights, e.g. "datanode1:5001=2,datanode2:5001=1"
+        weights = {
+            node: float(weight)
+            for node, weight in (
+                entry.rsplit("=", 1)
+                for entry in os.getenv("DATA_NODE_WEIGHTS", "").split(",")
+                if entry
+            )
+        }
+        # CHUNKING=cdc cuts chunks at content-defined boundaries so edits only
+        # change the chunks around them; the default cuts at fixed offsets
+        chunker = None
+        if os.getenv("CHUNKING", "fixed") == "cdc":
+            chunker = ContentDefinedChunker(
+                min_size=int(os.getenv("CDC_MIN_SIZE", str(4 * 1024 * 1024))),
+                avg_size=int(os.getenv("CDC_AVG_SIZE", str(16 * 1024 * 1024))),
+                max_size=int(os.getenv("CDC_MAX_SIZE", str(64 * 1024 * 1024))),
+            )
+        self.chunk_manager = ChunkManager(
+            data_nodes=data_nodes,
+            replication_factor=2,
+            max_in_flight=int(os.getenv("MAX_INFLIGHT_CHUNKS", "2")),
+            replication_mode=os.getenv("REPLICATION_MODE", "pipeline"),
+            read_ahead=int(os.getenv("READ_AHEAD_CHUNKS", "4")),
+            read_ahead_bytes=int(os.getenv("READ_AHEAD_BYTES", str(256 * 1024 * 1024))),
+            hedge_percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+            weights=weights,
+            chunker=chunker,
+            hash_algorithm=os.getenv("CHUNK_HASH", chunk_hash.DEFAULT_ALGORITHM),
+            # Data nodes are shared by all partitions; each stores its chunks
+            # in its own block pool, named after it unless BLOCK_POOL is set
+            block_pool=os.getenv("BLOCK_POOL", self.partition),
+        )
+        # METADATA_BACKEND=memory keeps the namespace in memory, made durable
+        # by an edit log and checkpoint images; the default is SQLite.
+        # CHUNK_LEASE is how many seconds an upload has to commit its file
+        # before chunks it stored or reused, and no file references, go.
+        chunk_lease = float(os.getenv("CHUNK_LEASE", str(CHUNK_LEASE)))
+        if os.getenv("METADATA_BACKEND", "sqlite") == "memory":
+            self.metadata_manager = Namespace(
+                os.getenv("METADATA_DIR", "namespace"),
+                checkpoint_every=int(os.getenv("CHECKPOINT_EDITS", "100000")),
+                chunk_lease=chunk_lease,
+            )
+        else:
+            # Chunks a database from before chunk sizes were kept has no
+            # size for are looked up on the data nodes when it is upgraded
+            self.metadata_manager = MetadataManager(
+                chunk_lease=chunk_lease,
+                locate_chunk=self.chunk_manager.locate_chunk,
+            )
+        if self.partition_map is not None:
+            self._report_foreign_entries()
+        # Recursive directory deletes return at once; a background thread
+        # removes the files below them (also after a restart)
+        self._purge_requested = threading.Event()
+        self._purger = threading.Thread(target=self._purge_loop, daemon=True)
+        self._purger.start()
+
+    def _report_foreign_entries(self):
+        # Entries of shared directories stored here before the namespace
+        # was partitioned (or the map changed) are only served again once
+        # pinned here
+        directories = [""]
+        while directories:
+            directory = directories.pop()
+            page_token = ""
+            while True:
+                entries, page_token = self.metadata_manager.list_directory(
+                    directory, page_token, MAX_PAGE_SIZE
+                )
+                for name, is_directory, *_ in entries:
+                    path = f"{directory}/{name}" if directory else name
+                    if is_directory and self.partition_map.is_shared(path):
+                        directories.append(path)
+                    elif not self._owns(path):
+                        print(
+                            f"'{path}' is stored here but belongs to partition "
+                            f"{self.partition_map.partition_of(path)}; add "
+                            f"{path}={self.partition} to SUBTREES to serve it"
+                        )
+                if not page_token:
+                    break
+
+    def _place_chunks(self, chunks, chunk_ids):
+        # Assign each new chunk to its data nodes; chunks that are already
+        # stored are only linked into the file, not sent again. Claiming
+        # them leases them, so they are still there when the file commits.
+        placed = set()
+        for chunk in chunks:
+            chunk_id = self.chunk_manager.generate_chunk_id(chunk)
+            chunk_ids.append(chunk_id)
+            if chunk_id in placed or self.metadata_manager.claim_chunks([chunk_id]):
+                continue
+            placed.add(chunk_id)
+            assigned_nodes = self.chunk_manager.assign_data_nodes(chunk_id)
+            yield chunk_id, chunk, assigned_nodes
+
+    def _store_chunks(self, chunks):
+        # Replicate several chunks at a time, acknowledged in file order
+        chunk_ids = []
+        placed = self._place_chunks(chunks, chunk_ids)
+        for chunk_id, size, data_nodes in self.chunk_manager.replicate_chunks(placed):
+            self.metadata_manager.add_chunk(
+                chunk_id,
+                json.dumps(data_nodes),
+                chunk_id,
+                size,
+                chunk_hash.algorithm_of(chunk_id),
+            )
+        return chunk_ids
+
+    def _commit_file(self, file_name, chunk_ids):
+        # Chunks only the replaced version of the file used can go now
+        orphans = self.metadata_manager.add_file(file_name, json.dumps(chunk_ids))
+        self.chunk_manager.delete_chunks(orphans)
+
+    def _purge_loop(self):
+        while True:
+            try:
+                orphans, remaining = self.metadata_manager.purge_deleted(
+                    PURGE_BATCH_SIZE
+                )
+                self.chunk_manager.delete_chunks(orphans)
+            except Exception as e:
+                # Keep the thread alive: the next round retries
+                print(f"Purging deleted files failed: {e!r}")
+                remaining = False
+            if not remaining:
+                self._purge_requested.wait(PURGE_INTERVAL)
+                self._purge_requested.clear()
+
+    @staticmethod
+    def _abort(context, error):
+        # Fail the call with the status matching an OSError of the
+        # namespace, passing its errno on for POSIX clients
+        context.set_trailing_metadata((("errno", str(error.errno)),))
+        context.abort(
+            STATUS_CODES.get(error.errno, grpc.StatusCode.FAILED_PRECONDITION),
+            str(error),
+        )
+
+    def _owns(self, path):
+        # The root is shared: every partition has its own top-level entries
+        if self.partition_map is None:
+            return True
+        return self.partition_map.partition_of(path) in (None, self.partition)
+
+    def _shared(self, path):
+        # Directories other than the root that every partition holds part of
+        return (
+            self.partition_map is not None
+            and any(part for part in path.split("/"))
+            and self.partition_map.is_shared(path)
+        )
+
+    def _check_owner(self, context, *paths):
+        # Turn away paths another partition owns, naming its leader so the
+        # client can update its partition map and retry there
+        for path in paths:
+            if not self._owns(path):
+                partition = self.partition_map.partition_of(path)
+                leader = self.partition_map.partitions[partition]
+                context.set_trailing_metadata(
+                    (("partition", partition), ("leader", leader))
+                )
+                context.abort(
+                    grpc.StatusCode.FAILED_PRECONDITION,
+                    f"'{path}' belongs to partition {partition} on {leader}",
+                )
+
+    def GetPartitionMap(self, request, context):
+        if self.partition_map is None:
+            return dfs_pb2.PartitionMap()
+        return self.partition_map.to_proto()
 
     def UploadFile(self, request, context):
         file_name = request.file_name
+        self._check_owner(context, file_name)
         file_data = request.data
 
         # Shard file into chunks
         chunks = self.chunk_manager.shard_file(file_data)
-        chunk_ids = []
+        try:
+            chunk_ids = self._store_chunks(chunks)
+        except ReplicationError as e:
+            return dfs_pb2.FileUploadResponse(success=False, message=str(e))
 
-        # Assign chunks to nodes and replicate
-        for chunk in chunks:
-            chunk_id = self.chunk_manager.generate_chunk_id(chunk)
-            assigned_nodes = self.chunk_manager.assign_data_nodes(chunk_id)
-            self.chunk_manager.replicate_chunk(chunk_id, chunk, assigned_nodes)
-            chunk_ids.append(chunk_id)
+        # Update metadata
+        try:
+            self._commit_file(file_name, chunk_ids)
+        except (OSError, MissingChunksError) as e:
+            return dfs_pb2.FileUploadResponse(success=False, message=str(e))
+        return dfs_pb2.FileUploadResponse(
+            success=True, message=f"File '{file_name}' uploaded successfully."
+        )
+
+    def UploadFileStream(self, request_iterator, context):
+        # The first frame names the file, the rest carry its data
+        header = next(request_iterator, None)
+        if header is None or header.WhichOneof("frame") != "header":
+            context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT,
+                "Upload stream must start with a header frame",
+            )
+        file_name = header.header.file_name
+        self._check_owner(context, file_name)
+
+        # Cut chunks as the data frames arrive instead of buffering the file
+        data_stream = (frame.data for frame in request_iterator)
+        chunks = self.chunk_manager.stream_chunks(data_stream)
+        try:
+            chunk_ids = self._store_chunks(chunks)
+        except ReplicationError as e:
+            return dfs_pb2.FileUploadResponse(success=False, message=str(e))
 
         # Update metadata
-        self.metadata_manager.add_file(file_name, json.dumps(chunk_ids))
+        try:
+            self._commit_file(file_name, chunk_ids)
+        except (OSError, MissingChunksError) as e:
+            return dfs_pb2.FileUploadResponse(success=False, message=str(e))
         return dfs_pb2.FileUploadResponse(
             success=True, message=f"File '{file_name}' uploaded successfully."
         )
@@ -53,20 +295,196 @@ class LeaderService(dfs_pb2_grpc.LeaderServiceServicer):
 
     def ReadFile(self, request, context):
         file_name = request.file_name
-        chunks = self.metadata_manager.get_chunks_for_file(file_name)
-        for chunk in chunks:
-            yield dfs_pb2.FileReadResponse(
-                data=self.chunk_manager.retrieve_chunk(chunk)
-            )
+        self._check_owner(context, file_name)
+        # Only fetch the part of each chunk that falls inside the range
+        ranges = self.metadata_manager.get_file_range(
+            file_name, request.offset, request.length
+        )
+        if ranges is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"File '{file_name}' not found")
+        fetches = self.chunk_manager.retrieve_ranges(ranges)
+        try:
+            for data in fetches:
+                yield dfs_pb2.FileReadResponse(data=data)
+        except ChunkUnavailableError as e:
+            context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+        finally:
+            fetches.close()
 
     def DeleteFile(self, request, context):
         file_name = request.file_name
-        self.chunk_manager.delete_chunks(file_name)
-        self.metadata_manager.delete_file_metadata(file_name)
+        self._check_owner(context, file_name)
+        orphans = self.metadata_manager.delete_file_metadata(file_name)
+        if orphans is None:
+            return dfs_pb2.FileDeleteResponse(
+                success=False, message=f"File '{file_name}' not found"
+            )
+        # Chunks still linked into other files stay on the data nodes
+        self.chunk_manager.delete_chunks(orphans)
         return dfs_pb2.FileDeleteResponse(
             success=True, message="File deleted successfully"
         )
 
+    @staticmethod
+    def _check_chunk_ids(context, chunks):
+        # Chunk ids from clients pick ring positions and data node keys
+        for chunk in chunks:
+            if not chunk_hash.is_valid_chunk_id(chunk.chunk_id):
+                context.abort(
+                    grpc.StatusCode.INVALID_ARGUMENT,
+                    f"Invalid chunk id: {chunk.chunk_id!r}",
+                )
+
+    def AllocateChunks(self, request, context):
+        # Placement only: the client ships the bytes to the data nodes itself
+        self._check_owner(context, request.file_name)
+        self._check_chunk_ids(context, request.chunks)
+        return dfs_pb2.AllocateChunksResponse(
+            chunks=[
+                dfs_pb2.ChunkLocation(
+                    chunk_id=chunk.chunk_id,
+                    size=chunk.size,
+                    data_nodes=self.chunk_manager.assign_data_nodes(chunk.chunk_id),
+                )
+                for chunk in request.chunks
+            ],
+            block_pool=self.chunk_manager.block_pool,
+        )
+
+    def CommitFile(self, request, context):
+        file_name = request.file_name
+        self._check_owner(context, file_name)
+        self._check_chunk_ids(context, request.chunks)
+        for chunk in request.chunks:
+            # Deduplicated chunks come without data nodes: nothing new was stored
+            if chunk.data_nodes:
+                self.metadata_manager.add_chunk(
+                    chunk.chunk_id,
+                    json.dumps(list(chunk.data_nodes)),
+                    chunk.chunk_id,
+                    chunk.size,
+                    chunk_hash.algorithm_of(chunk.chunk_id),
+                )
+        # Chunks the client found through FindChunks are leased for it; any
+        # that are gone all the same (e.g. the lease ran out) fail the commit
+        chunk_ids = [chunk.chunk_id for chunk in request.chunks]
+        try:
+            self._commit_file(file_name, chunk_ids)
+        except (OSError, MissingChunksError) as e:
+            return dfs_pb2.FileUploadResponse(success=False, message=str(e))
+        return dfs_pb2.FileUploadResponse(
+            success=True, message=f"File '{file_name}' committed successfully."
+        )
+
+    def GetFileLocations(self, request, context):
+        file_name = request.file_name
+        self._check_owner(context, file_name)
+        chunks = self.metadata_manager.get_chunks_for_file(file_name)
+        if chunks is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"File '{file_name}' not found")
+        return dfs_pb2.FileLocationsResponse(
+            chunks=[
+                dfs_pb2.ChunkLocation(
+                    chunk_id=chunk_id, size=size, data_nodes=data_nodes
+                )
+                for chunk_id, data_nodes, size in chunks
+            ],
+            block_pool=self.chunk_manager.block_pool,
+        )
+
+    def FindChunks(self, request, context):
+        # Lease what is found, so it is still stored when the client commits
+        existing = self.metadata_manager.claim_chunks(request.chunk_ids)
+        return dfs_pb2.FindChunksResponse(
+            existing_chunk_ids=[
+                chunk_id for chunk_id in request.chunk_ids if chunk_id in existing
+            ]
+        )
+
+    @staticmethod
+    def _file_stat(file_name, stat):
+        if stat is None:
+            return dfs_pb2.FileStat(file_name=file_name, exists=False)
+        size, mtime, is_directory = stat
+        return dfs_pb2.FileStat(
+            file_name=file_name,
+            exists=True,
+            is_directory=is_directory,
+            size=size,
+            mtime=mtime,
+        )
+
+    def Stat(self, request, context):
+        file_name = request.file_name.strip("/")
+        self._check_owner(context, file_name)
+        return self._file_stat(file_name, self.metadata_manager.stat(file_name))
+
+    def BatchStat(self, request, context):
+        file_names = [file_name.strip("/") for file_name in request.file_names]
+        self._check_owner(context, *file_names)
+        stats = self.metadata_manager.stat_many(file_names)
+        return dfs_pb2.BatchStatResponse(
+            stats=[self._file_stat(name, stats[name]) for name in file_names]
+        )
+
+    def ListFiles(self, request, context):
+        # The root lists only the top-level names of this partition; a
+        # federated client merges the listings of every leader
+        self._check_owner(context, request.directory)
+        page_size = min(request.page_size or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        entries, next_page_token = self.metadata_manager.list_directory(
+            request.directory, request.page_token, page_size, request.prefix
+        )
+        return dfs_pb2.ListFilesResponse(
+            entries=[
+                self._file_stat(name, (size, mtime, is_directory))
+                for name, is_directory, size, mtime in entries
+            ],
+            next_page_token=next_page_token,
+        )
+
+    def MakeDirectory(self, request, context):
+        self._check_owner(context, request.directory)
+        try:
+            self.metadata_manager.make_directory(request.directory)
+        except OSError as e:
+            self._abort(context, e)
+        return dfs_pb2.NamespaceResponse(
+            message=f"Directory '{request.directory}' created."
+        )
+
+    def DeleteDirectory(self, request, context):
+        self._check_owner(context, request.directory)
+        try:
+            self.metadata_manager.delete_directory(request.directory, request.recursive)
+        except OSError as e:
+            self._abort(context, e)
+        self._purge_requested.set()
+        return dfs_pb2.NamespaceResponse(
+            message=f"Directory '{request.directory}' deleted."
+        )
+
+    def Rename(self, request, context):
+        self._check_owner(context, request.source)
+        try:
+            if not self._owns(request.target):
+                # Like a rename across file systems: clients copy instead
+                raise _path_error(
+                    errno.EXDEV, request.target, "Belongs to another partition"
+                )
+            for path in (request.source, request.target):
+                # Only this partition's part of a shared directory would move
+                if self._shared(path):
+                    raise _path_error(errno.EXDEV, path, "Spans partitions")
+            orphans = self.metadata_manager.rename(request.source, request.target)
+        except OSError as e:
+            self._abort(context, e)
+        # A replaced target file may have held the last reference to chunks
+        self.chunk_manager.delete_chunks(orphans)
+        return dfs_pb2.NamespaceResponse(
+            message=f"'{request.source}' renamed to '{request.target}'."
+        )
+
 
 # Start gRPC server
 
@@ -1,52 +1,884 @@
 # metadata_store.py
 
+import contextlib
+import errno
+import json
+import os
+import queue
 import sqlite3
+import threading
+import time
+from concurrent import futures
+
+# Entries ListFiles returns per page unless asked for fewer
+DEFAULT_PAGE_SIZE = 1000
+# Most queued writes committed together in one transaction
+GROUP_COMMIT_SIZE = 256
+# Inode of the root directory, and of the hidden directory that deleted
+# directory trees wait in until they are purged
+ROOT_INODE = 1
+TRASH_INODE = 2
+# Seconds a chunk is kept without any file referencing it, once an upload
+# has stored it or found it already stored; the upload must commit its file
+# within this time
+CHUNK_LEASE = 3600
+
+
+class MissingChunksError(Exception):
+    """A file lists chunks the metadata does not hold (any more)."""
+
+    def __init__(self, chunk_ids):
+        super().__init__(f"Unknown chunks: {', '.join(sorted(chunk_ids))}")
+        self.chunk_ids = chunk_ids
+
+
+def _prefix_end(prefix):
+    # Smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _split_path(path):
+    # "/a//b/" -> ["a", "b"]; the root is []
+    return [part for part in path.split("/") if part]
+
+
+def _path_error(code, path, message=None):
+    # OSError (FileNotFoundError, NotADirectoryError, ...) for a path
+    return OSError(code, message or os.strerror(code), path)
 
 
 class MetadataManager:
-    def __init__(self, db_path="metadata.db"):
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self._initialize_tables()
-
-    def _initialize_tables(self):
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS files (
-            file_name TEXT PRIMARY KEY,
-            chunk_ids TEXT
-        )
-        """)
-        self.cursor.execute("""
+    def __init__(self, db_path="metadata.db",
+                 group_commit_size=GROUP_COMMIT_SIZE, chunk_lease=CHUNK_LEASE,
+                 locate_chunk=None):
+        """
+        SQLite metadata store, safe to use from many threads. The database
+        runs in WAL mode: every thread reads through its own connection
+        without blocking the writer, and all writes go through one writer
+        thread that commits whatever has queued up in a single transaction
+        (group commit), so concurrent registrations share one fsync.
+
+        The namespace is a tree of inodes indexed by (parent, name): a path
+        resolves one component at a time, a directory lists with a range
+        scan of its own children, and a rename moves one row whatever lies
+        below it.
+
+        A chunk that an upload stores, or finds already stored, is leased
+        for chunk_lease seconds: until the upload's file references it, it
+        is not deleted even if no other file uses it.
+        :param db_path: Path of the database file
+        :param group_commit_size: Most writes committed together
+        :param chunk_lease: Seconds an unreferenced chunk is kept for an
+                            upload that stored or claimed it
+        :param locate_chunk: Optional locate_chunk(chunk_id) -> (data_nodes,
+                             size) or None, asked for the chunks of files in
+                             a database from before chunk sizes were kept
+        """
+        self.db_path = db_path
+        self.group_commit_size = group_commit_size
+        self.chunk_lease = chunk_lease
+        self.locate_chunk = locate_chunk
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._initialize_tables(self._writer.cursor())
+        self._writes = queue.SimpleQueue()
+        self._writer_thread = threading.Thread(
+            target=self._write_loop, daemon=True)
+        self._writer_thread.start()
+
+    def _connect(self):
+        # Transactions are managed explicitly; the sqlite3 statement cache
+        # keeps the fixed queries below prepared
+        conn = sqlite3.connect(
+            self.db_path, isolation_level=None, check_same_thread=False,
+            cached_statements=256)
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _initialize_tables(self, cursor):
+        cursor.execute("BEGIN")
+        cursor.execute("""
         CREATE TABLE IF NOT EXISTS chunks (
             chunk_id TEXT PRIMARY KEY,
             data_nodes TEXT,
-            checksum TEXT
+            checksum TEXT,
+            size INTEGER,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            hash_algorithm TEXT NOT NULL DEFAULT 'sha256',
+            leased_until REAL NOT NULL DEFAULT 0
+        )
+        """)
+        # The first version's chunks table only had the first three columns
+        self._ensure_column(cursor, "chunks", "size", "INTEGER")
+        self._ensure_column(
+            cursor, "chunks", "ref_count", "INTEGER NOT NULL DEFAULT 0")
+        self._ensure_column(
+            cursor, "chunks", "hash_algorithm",
+            "TEXT NOT NULL DEFAULT 'sha256'")
+        self._ensure_column(
+            cursor, "chunks", "leased_until", "REAL NOT NULL DEFAULT 0")
+        # Unreferenced chunks, for purge_deleted() to collect once their
+        # lease runs out
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS chunks_unreferenced "
+            "ON chunks (leased_until) WHERE ref_count <= 0")
+        # The first version kept files in a flat table keyed by full path,
+        # each with a JSON list of its chunk ids
+        migrate = self._table_exists(cursor, "files")
+        if migrate:
+            cursor.execute("ALTER TABLE files RENAME TO flat_files")
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS inodes (
+            id INTEGER PRIMARY KEY,
+            parent INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            is_directory INTEGER NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            mtime REAL NOT NULL DEFAULT 0
         )
         """)
-        self.conn.commit()
+        cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS inodes_children "
+            "ON inodes (parent, name)")
+        cursor.execute(
+            "INSERT OR IGNORE INTO inodes (id, parent, name, is_directory) "
+            "VALUES (?, 0, '', 1), (?, 0, '.trash', 1)",
+            (ROOT_INODE, TRASH_INODE))
+        # Chunks of each file, one row per chunk: seq orders them and the
+        # (inode, offset) index maps a byte offset to its chunk
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS file_chunks (
+            inode INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            chunk_id TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            PRIMARY KEY (inode, seq)
+        )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS file_chunks_offset "
+            "ON file_chunks (inode, offset)")
+        if migrate:
+            self._migrate_flat_files(cursor)
+            self._count_refs(cursor)
+        cursor.execute("COMMIT")
+
+    def _table_exists(self, cursor, table):
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            (table,))
+        return cursor.fetchone() is not None
+
+    def _ensure_column(self, cursor, table, column, definition):
+        # Bring tables created by older versions up to the current schema;
+        # returns whether the column had to be added
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column in [row[1] for row in cursor.fetchall()]:
+            return False
+        cursor.execute(
+            f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+
+    def _count_refs(self, cursor):
+        # Set every chunk's reference count to the number of times file
+        # layouts (deleted trees waiting to be purged included) list it
+        cursor.execute("UPDATE chunks SET ref_count = 0")
+        counts = cursor.connection.execute(
+            "SELECT chunk_id, count(*) FROM file_chunks GROUP BY chunk_id")
+        cursor.executemany(
+            "UPDATE chunks SET ref_count=? WHERE chunk_id=?",
+            ((count, chunk_id) for chunk_id, count in counts))
+
+    def _migrate_flat_files(self, cursor):
+        # Build the directory tree from the full paths of the flat table
+        files = [
+            (file_name, json.loads(chunk_ids or "[]"))
+            for file_name, chunk_ids in cursor.connection.execute(
+                "SELECT file_name, chunk_ids FROM flat_files "
+                "ORDER BY file_name")]
+        self._locate_unsized(cursor, {
+            chunk_id for _, chunk_ids in files for chunk_id in chunk_ids})
+        for file_name, chunk_ids in files:
+            parts = _split_path(file_name)
+            if not parts:
+                continue
+            self._move_aside(cursor, parts[:-1])
+            parent = self._make_directories(cursor, parts[:-1], 0.0)
+            if self._child(cursor, parent, parts[-1]):
+                # "a" and "/a" name the same file now; keep the first
+                continue
+            inode = self._create_inode(cursor, parent, parts[-1], False, 0.0)
+            size = self._write_layout(
+                cursor, inode, chunk_ids, self._chunk_sizes(cursor, chunk_ids))
+            cursor.execute(
+                "UPDATE inodes SET size=? WHERE id=?", (size, inode))
+        cursor.execute("DROP TABLE flat_files")
+
+    def _locate_unsized(self, cursor, chunk_ids):
+        # Files used to be stored without registering their chunks, so the
+        # chunks table may lack them (or their sizes): find them on the data
+        # nodes, and refuse to upgrade rather than lay files out with chunks
+        # of unknown size
+        sizes = self._chunk_sizes(cursor, chunk_ids)
+        lost = set()
+        for chunk_id in chunk_ids:
+            if sizes.get(chunk_id) is not None:
+                continue
+            found = self.locate_chunk(chunk_id) if self.locate_chunk else None
+            if found is None:
+                lost.add(chunk_id)
+                continue
+            data_nodes, size = found
+            cursor.execute(
+                """
+                INSERT INTO chunks (chunk_id, data_nodes, checksum, size)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(chunk_id) DO UPDATE SET
+                    data_nodes=excluded.data_nodes, size=excluded.size
+                """,
+                (chunk_id, json.dumps(data_nodes), chunk_id, size))
+        if lost:
+            print(f"Cannot upgrade {self.db_path}: the size of some chunks "
+                  "is unknown and no data node holds them")
+            raise MissingChunksError(lost)
+
+    def _move_aside(self, cursor, parts):
+        # A flat name could be both a file and a directory ("a" and "a/b"):
+        # the directory keeps the name and the file becomes "a~<inode>"
+        parent = ROOT_INODE
+        for part in parts:
+            inode = self._child(cursor, parent, part)
+            if inode is None:
+                return
+            if not inode[1]:
+                cursor.execute(
+                    "UPDATE inodes SET name=? WHERE id=?",
+                    (f"{part}~{inode[0]}", inode[0]))
+                return
+            parent = inode[0]
+
+    def close(self):
+        """Commit queued writes and close all connections."""
+        self._writes.put(None)
+        self._writer_thread.join()
+        self._writer.close()
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+
+    # -- tree --------------------------------------------------------------
+
+    def _child(self, cursor, parent, name):
+        # (id, is_directory, size, mtime) of an entry of a directory
+        cursor.execute(
+            "SELECT id, is_directory, size, mtime FROM inodes "
+            "WHERE parent=? AND name=?",
+            (parent, name))
+        return cursor.fetchone()
+
+    def _resolve(self, cursor, parts):
+        # (id, is_directory, size, mtime) of the inode at a path, or None
+        if not parts:
+            cursor.execute(
+                "SELECT id, is_directory, size, mtime FROM inodes WHERE id=?",
+                (ROOT_INODE,))
+            return cursor.fetchone()
+        inode = (ROOT_INODE, True)
+        for part in parts:
+            if not inode[1]:
+                return None
+            inode = self._child(cursor, inode[0], part)
+            if inode is None:
+                return None
+        return inode
+
+    def _resolve_file(self, cursor, file_name):
+        # Inode ID of a file, None if there is no file at that path
+        inode = self._resolve(cursor, _split_path(file_name))
+        return inode[0] if inode is not None and not inode[1] else None
+
+    def _create_inode(self, cursor, parent, name, is_directory, mtime):
+        cursor.execute(
+            "INSERT INTO inodes (parent, name, is_directory, mtime) "
+            "VALUES (?, ?, ?, ?)",
+            (parent, name, int(is_directory), mtime))
+        return cursor.lastrowid
+
+    def _make_directories(self, cursor, parts, mtime):
+        # Inode ID of the directory at parts, creating what is missing
+        parent = ROOT_INODE
+        for i, part in enumerate(parts):
+            inode = self._child(cursor, parent, part)
+            if inode is None:
+                parent = self._create_inode(cursor, parent, part, True, mtime)
+            elif not inode[1]:
+                raise _path_error(errno.ENOTDIR, "/".join(parts[:i + 1]))
+            else:
+                parent = inode[0]
+        return parent
+
+    def _has_children(self, cursor, inode):
+        cursor.execute("SELECT 1 FROM inodes WHERE parent=? LIMIT 1", (inode,))
+        return cursor.fetchone() is not None
+
+    # -- writes ------------------------------------------------------------
+
+    def _write(self, operation, *args):
+        # Queue a write for the writer thread and wait until it is committed
+        done = futures.Future()
+        self._writes.put((operation, args, done))
+        return done.result()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._writes.get()]
+            # Everything that queued up while the last commit ran goes into
+            # this transaction
+            while len(batch) < self.group_commit_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [write for write in batch if write is not None]
+            if batch:
+                self._commit_batch(batch)
+            if stop:
+                return
+
+    def _commit_batch(self, batch):
+        cursor = self._writer.cursor()
+        results = []
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for operation, args, done in batch:
+                # A failing write is rolled back alone; the others commit
+                cursor.execute("SAVEPOINT write")
+                try:
+                    results.append((done, operation(cursor, *args), None))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write")
+                    results.append((done, None, e))
+                cursor.execute("RELEASE write")
+            cursor.execute("COMMIT")
+        except Exception as e:
+            if self._writer.in_transaction:
+                self._writer.execute("ROLLBACK")
+            for _, _, done in batch:
+                done.set_exception(e)
+            return
+        for done, result, error in results:
+            if error is not None:
+                done.set_exception(error)
+            else:
+                done.set_result(result)
 
     def add_file(self, file_name, chunk_ids):
-        self.cursor.execute(
-            "INSERT INTO files VALUES (?, ?)", (file_name, chunk_ids))
-        self.conn.commit()
-
-    def add_chunk(self, chunk_id, data_nodes, checksum):
-        self.cursor.execute(
-            "INSERT INTO chunks VALUES (?, ?, ?)", (chunk_id,
-                                                    data_nodes, checksum)
+        """
+        Create or replace a file and take a reference on each of its chunks.
+        Missing parent directories are created.
+        Returns [(chunk_id, data_nodes)] of chunks the replaced version held
+        the last reference to; they should be deleted from the data nodes.
+        :raises NotADirectoryError: If a parent on the path is a file
+        :raises IsADirectoryError: If the path is a directory
+        :raises MissingChunksError: If a chunk is not (or no longer) stored
+        """
+        return self._write(self._add_file, file_name, chunk_ids)
+
+    def _add_file(self, cursor, file_name, chunk_ids):
+        parts = _split_path(file_name)
+        if not parts:
+            raise _path_error(errno.EISDIR, file_name)
+        # A file must never silently lose the bytes of a chunk that was
+        # deleted under it
+        chunk_ids = json.loads(chunk_ids)
+        sizes = self._chunk_sizes(cursor, chunk_ids)
+        missing = set(chunk_ids) - set(sizes)
+        if missing:
+            raise MissingChunksError(missing)
+        mtime = time.time()
+        parent = self._make_directories(cursor, parts[:-1], mtime)
+        inode = self._child(cursor, parent, parts[-1])
+        old_chunk_ids = None
+        if inode is None:
+            inode = self._create_inode(cursor, parent, parts[-1], False, mtime)
+        elif inode[1]:
+            raise _path_error(errno.EISDIR, file_name)
+        else:
+            inode = inode[0]
+            old_chunk_ids = self._get_file_chunks(cursor, inode)
+            cursor.execute("DELETE FROM file_chunks WHERE inode=?", (inode,))
+        size = self._write_layout(cursor, inode, chunk_ids, sizes)
+        cursor.execute(
+            "UPDATE inodes SET size=?, mtime=? WHERE id=?",
+            (size, mtime, inode))
+        self._add_refs(cursor, chunk_ids, 1)
+        orphans = []
+        if old_chunk_ids is not None:
+            orphans = self._release_chunks(cursor, old_chunk_ids, mtime)
+        return orphans
+
+    def _write_layout(self, cursor, inode, chunk_ids, sizes):
+        # Insert the file_chunks rows of a file; returns the file size
+        rows = []
+        offset = 0
+        for seq, chunk_id in enumerate(chunk_ids):
+            length = sizes[chunk_id]
+            rows.append((inode, seq, chunk_id, offset, length))
+            offset += length
+        cursor.executemany(
+            "INSERT INTO file_chunks (inode, seq, chunk_id, offset, length) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
         )
-        self.conn.commit()
+        return offset
 
-    def get_file_chunks(self, file_name):
-        self.cursor.execute(
-            "SELECT chunk_ids FROM files WHERE file_name=?", (file_name,)
+    def add_chunk(self, chunk_id, data_nodes, checksum, size=None,
+                  hash_algorithm="sha256"):
+        """
+        Register a stored chunk, leased until the file using it commits.
+        """
+        self._write(self._add_chunk, chunk_id, data_nodes, checksum, size,
+                    hash_algorithm)
+
+    def _add_chunk(self, cursor, chunk_id, data_nodes, checksum, size,
+                   hash_algorithm):
+        # Keep the reference count of a chunk that is already stored
+        cursor.execute(
+            """
+            INSERT INTO chunks
+                (chunk_id, data_nodes, checksum, size, hash_algorithm,
+                 leased_until)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(chunk_id) DO UPDATE SET
+                data_nodes=excluded.data_nodes,
+                checksum=excluded.checksum,
+                size=excluded.size,
+                hash_algorithm=excluded.hash_algorithm,
+                leased_until=max(leased_until, excluded.leased_until)
+            """,
+            (chunk_id, data_nodes, checksum, size, hash_algorithm,
+             time.time() + self.chunk_lease),
         )
-        result = self.cursor.fetchone()
-        return result[0] if result else None
 
-    def get_chunk_nodes(self, chunk_id):
-        self.cursor.execute(
-            "SELECT data_nodes FROM chunks WHERE chunk_id=?", (chunk_id,)
+    def claim_chunks(self, chunk_ids):
+        """
+        Find which chunks are already stored, leasing each one found so it
+        is not deleted before the file that reuses it commits. The check
+        and the lease are one transaction.
+        :return: The subset of chunk_ids that are stored
+        """
+        # Chunks that are not stored need no lease: the upload stores them
+        if not self.find_existing_chunks(chunk_ids):
+            return set()
+        return self._write(self._claim_chunks, list(chunk_ids))
+
+    def _claim_chunks(self, cursor, chunk_ids):
+        leased_until = time.time() + self.chunk_lease
+        existing = set()
+        for chunk_id in set(chunk_ids):
+            cursor.execute(
+                "UPDATE chunks SET leased_until=max(leased_until, ?) "
+                "WHERE chunk_id=?",
+                (leased_until, chunk_id))
+            if cursor.rowcount:
+                existing.add(chunk_id)
+        return existing
+
+    def delete_file_metadata(self, file_name):
+        """
+        Remove a file and drop its chunk references. Returns
+        [(chunk_id, data_nodes)] of chunks no file references any more, or
+        None if there is no file at that path.
+        """
+        return self._write(self._delete_file, file_name)
+
+    def _delete_file(self, cursor, file_name):
+        inode = self._resolve_file(cursor, file_name)
+        if inode is None:
+            return None
+        return self._remove_file(cursor, inode)
+
+    def _remove_file(self, cursor, inode):
+        chunk_ids = self._get_file_chunks(cursor, inode)
+        cursor.execute("DELETE FROM file_chunks WHERE inode=?", (inode,))
+        cursor.execute("DELETE FROM inodes WHERE id=?", (inode,))
+        return self._release_chunks(cursor, chunk_ids, time.time())
+
+    def make_directory(self, directory):
+        """
+        Create a directory, and any missing parents.
+        :raises FileExistsError: If something exists at that path
+        :raises NotADirectoryError: If a parent on the path is a file
+        """
+        self._write(self._make_directory, directory)
+
+    def _make_directory(self, cursor, directory):
+        parts = _split_path(directory)
+        if self._resolve(cursor, parts) is not None:
+            raise _path_error(errno.EEXIST, directory)
+        self._make_directories(cursor, parts, time.time())
+
+    def rename(self, source, target):
+        """
+        Move a file or directory. A directory moves as a single entry,
+        however much lies below it. As with rename(2), an existing target
+        file, or empty target directory, is replaced.
+        Returns [(chunk_id, data_nodes)] of chunks only a replaced target
+        file referenced.
+        :raises FileNotFoundError: If source or the target's parent is
+                                   missing
+        :raises IsADirectoryError: If a file would replace a directory
+        :raises NotADirectoryError: If a directory would replace a file, or
+                                    the target's parent is a file
+        :raises OSError: ENOTEMPTY if the target is a non-empty directory,
+                         EINVAL if a directory would move below itself
+        """
+        return self._write(self._rename, source, target)
+
+    def _rename(self, cursor, source, target):
+        source_parts = _split_path(source)
+        target_parts = _split_path(target)
+        if not source_parts or not target_parts:
+            raise _path_error(
+                errno.EINVAL, source, "Cannot rename the root directory")
+        parent = self._resolve(cursor, source_parts[:-1])
+        inode = (self._child(cursor, parent[0], source_parts[-1])
+                 if parent is not None and parent[1] else None)
+        if inode is None:
+            raise _path_error(errno.ENOENT, source)
+        target_parent = self._resolve(cursor, target_parts[:-1])
+        if target_parent is None:
+            raise _path_error(errno.ENOENT, target)
+        if not target_parent[1]:
+            raise _path_error(errno.ENOTDIR, target)
+        if inode[1]:
+            # A directory cannot move into its own subtree
+            ancestor = target_parent[0]
+            while ancestor != ROOT_INODE:
+                if ancestor == inode[0]:
+                    raise _path_error(
+                        errno.EINVAL, target,
+                        "Cannot move a directory below itself")
+                cursor.execute(
+                    "SELECT parent FROM inodes WHERE id=?", (ancestor,))
+                ancestor = cursor.fetchone()[0]
+
+        orphans = []
+        existing = self._child(cursor, target_parent[0], target_parts[-1])
+        if existing is not None:
+            if existing[0] == inode[0]:
+                return orphans
+            if existing[1] and not inode[1]:
+                raise _path_error(errno.EISDIR, target)
+            if inode[1] and not existing[1]:
+                raise _path_error(errno.ENOTDIR, target)
+            if existing[1]:
+                if self._has_children(cursor, existing[0]):
+                    raise _path_error(errno.ENOTEMPTY, target)
+                cursor.execute(
+                    "DELETE FROM inodes WHERE id=?", (existing[0],))
+            else:
+                orphans = self._remove_file(cursor, existing[0])
+        cursor.execute(
+            "UPDATE inodes SET parent=?, name=? WHERE id=?",
+            (target_parent[0], target_parts[-1], inode[0]))
+        return orphans
+
+    def delete_directory(self, directory, recursive=False):
+        """
+        Delete a directory. With recursive, a non-empty directory is
+        unlinked from the tree at once and what was below it is removed
+        afterwards by purge_deleted().
+        :raises FileNotFoundError: If the directory does not exist
+        :raises NotADirectoryError: If the path is a file
+        :raises OSError: ENOTEMPTY if the directory is not empty and
+                         recursive is not set, EINVAL for the root
+        """
+        self._write(self._delete_directory, directory, recursive)
+
+    def _delete_directory(self, cursor, directory, recursive):
+        parts = _split_path(directory)
+        if not parts:
+            raise _path_error(
+                errno.EINVAL, directory, "Cannot delete the root directory")
+        inode = self._resolve(cursor, parts)
+        if inode is None:
+            raise _path_error(errno.ENOENT, directory)
+        if not inode[1]:
+            raise _path_error(errno.ENOTDIR, directory)
+        if not self._has_children(cursor, inode[0]):
+            cursor.execute("DELETE FROM inodes WHERE id=?", (inode[0],))
+        elif not recursive:
+            raise _path_error(errno.ENOTEMPTY, directory)
+        else:
+            cursor.execute(
+                "UPDATE inodes SET parent=?, name=? WHERE id=?",
+                (TRASH_INODE, str(inode[0]), inode[0]))
+
+    def purge_deleted(self, limit=1000):
+        """
+        Remove up to limit files of recursively deleted directories, or
+        once none are left, forget up to limit chunks that no file
+        references and whose lease has run out (e.g. stored for an upload
+        that never committed).
+        :return: ([(chunk_id, data_nodes)] of chunks no file references any
+                 more, whether anything is left to purge)
+        """
+        return self._write(self._purge_deleted, limit)
+
+    def _purge_deleted(self, cursor, limit):
+        subtree = """
+            WITH RECURSIVE subtree(id, is_directory) AS (
+                SELECT id, is_directory FROM inodes WHERE parent=?
+                UNION ALL
+                SELECT inodes.id, inodes.is_directory
+                FROM inodes JOIN subtree ON inodes.parent = subtree.id
+                WHERE subtree.is_directory
+            )
+        """
+        cursor.execute(
+            subtree + "SELECT id FROM subtree WHERE NOT is_directory LIMIT ?",
+            (TRASH_INODE, limit))
+        files = [row[0] for row in cursor.fetchall()]
+        now = time.time()
+        if files:
+            chunk_ids = []
+            for inode in files:
+                chunk_ids.extend(self._get_file_chunks(cursor, inode))
+                cursor.execute(
+                    "DELETE FROM file_chunks WHERE inode=?", (inode,))
+                cursor.execute("DELETE FROM inodes WHERE id=?", (inode,))
+            return self._release_chunks(cursor, chunk_ids, now), True
+        # Only directories are left of the deleted trees
+        cursor.execute(
+            "DELETE FROM inodes WHERE id IN (" + subtree
+            + "SELECT id FROM subtree)", (TRASH_INODE,))
+        cursor.execute(
+            "SELECT chunk_id, data_nodes FROM chunks "
+            "WHERE ref_count <= 0 AND leased_until <= ? LIMIT ?",
+            (now, limit))
+        orphans = [(chunk_id, json.loads(data_nodes or "[]"))
+                   for chunk_id, data_nodes in cursor.fetchall()]
+        cursor.executemany(
+            "DELETE FROM chunks WHERE chunk_id=?",
+            [(chunk_id,) for chunk_id, _ in orphans])
+        return orphans, len(orphans) == limit
+
+    def _add_refs(self, cursor, chunk_ids, delta):
+        cursor.executemany(
+            "UPDATE chunks SET ref_count = ref_count + ? WHERE chunk_id=?",
+            [(delta, chunk_id) for chunk_id in chunk_ids],
+        )
+
+    def _release_chunks(self, cursor, chunk_ids, now):
+        # Drop one reference per occurrence and forget unreferenced chunks;
+        # a leased chunk stays until purge_deleted() finds its lease over
+        self._add_refs(cursor, chunk_ids, -1)
+        orphans = []
+        for chunk_id in set(chunk_ids):
+            cursor.execute(
+                "SELECT data_nodes FROM chunks "
+                "WHERE chunk_id=? AND ref_count <= 0 AND leased_until <= ?",
+                (chunk_id, now),
+            )
+            result = cursor.fetchone()
+            if result:
+                orphans.append((chunk_id, json.loads(result[0] or "[]")))
+                cursor.execute(
+                    "DELETE FROM chunks WHERE chunk_id=?", (chunk_id,))
+        return orphans
+
+    # -- reads -------------------------------------------------------------
+
+    @contextlib.contextmanager
+    def _reading(self):
+        # A read transaction on this thread's own connection, so multi-query
+        # reads see one consistent snapshot
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._readers_lock:
+                self._readers.append(conn)
+        conn.execute("BEGIN")
+        try:
+            yield conn.cursor()
+        finally:
+            conn.execute("COMMIT")
+
+    def _chunk_sizes(self, cursor, chunk_ids):
+        sizes = {}
+        distinct = list(set(chunk_ids))
+        for i in range(0, len(distinct), 500):
+            batch = distinct[i:i + 500]
+            cursor.execute(
+                "SELECT chunk_id, size FROM chunks WHERE chunk_id IN (%s)"
+                % ",".join("?" * len(batch)),
+                batch,
+            )
+            sizes.update(cursor.fetchall())
+        return sizes
+
+    def find_existing_chunks(self, chunk_ids):
+        """Return the subset of chunk_ids that are already stored."""
+        chunk_ids = list(chunk_ids)
+        existing = set()
+        with self._reading() as cursor:
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[i:i + 500]
+                cursor.execute(
+                    "SELECT chunk_id FROM chunks WHERE chunk_id IN (%s)"
+                    % ",".join("?" * len(batch)),
+                    batch,
+                )
+                existing.update(row[0] for row in cursor.fetchall())
+        return existing
+
+    def _get_file_chunks(self, cursor, inode):
+        cursor.execute(
+            "SELECT chunk_id FROM file_chunks WHERE inode=? ORDER BY seq",
+            (inode,)
         )
-        result = self.cursor.fetchone()
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_file_chunks(self, file_name):
+        """Return the chunk IDs of a file in file order, or None."""
+        with self._reading() as cursor:
+            inode = self._resolve_file(cursor, file_name)
+            if inode is None:
+                return None
+            return self._get_file_chunks(cursor, inode)
+
+    def get_chunk_nodes(self, chunk_id):
+        with self._reading() as cursor:
+            cursor.execute(
+                "SELECT data_nodes FROM chunks WHERE chunk_id=?", (chunk_id,)
+            )
+            result = cursor.fetchone()
         return result[0] if result else None
+
+    def get_chunks_for_file(self, file_name):
+        """Return [(chunk_id, data_nodes, size)] in file order, or None."""
+        with self._reading() as cursor:
+            inode = self._resolve_file(cursor, file_name)
+            if inode is None:
+                return None
+            cursor.execute(
+                "SELECT f.chunk_id, c.data_nodes, f.length "
+                "FROM file_chunks f LEFT JOIN chunks c USING (chunk_id) "
+                "WHERE f.inode=? ORDER BY f.seq",
+                (inode,)
+            )
+            rows = cursor.fetchall()
+        return [
+            (chunk_id, json.loads(data_nodes) if data_nodes else [], size)
+            for chunk_id, data_nodes, size in rows
+        ]
+
+    def get_file_range(self, file_name, offset=0, length=0):
+        """
+        Map a byte range of a file onto the chunks that cover it. The chunk
+        holding the first byte is found with one probe of the offset index;
+        only the chunks inside the range are read after it.
+        :param file_name: Name of the file
+        :param offset: First byte of the range
+        :param length: Number of bytes in the range, 0 for the rest of the
+                       file
+        :return: [(chunk_id, data_nodes, offset_in_chunk, length_in_chunk)]
+                 in file order, or None if the file does not exist
+        """
+        end = offset + length if length else None
+        with self._reading() as cursor:
+            inode = self._resolve_file(cursor, file_name)
+            if inode is None:
+                return None
+            cursor.execute(
+                "SELECT offset FROM file_chunks "
+                "WHERE inode=? AND offset <= ? "
+                "ORDER BY offset DESC LIMIT 1",
+                (inode, offset)
+            )
+            result = cursor.fetchone()
+            query = "SELECT f.chunk_id, c.data_nodes, f.offset, f.length " \
+                    "FROM file_chunks f LEFT JOIN chunks c USING (chunk_id) " \
+                    "WHERE f.inode=? AND f.offset >= ? AND f.length > 0"
+            params = [inode, result[0] if result else 0]
+            if end is not None:
+                query += " AND f.offset < ?"
+                params.append(end)
+            cursor.execute(query + " ORDER BY f.offset", params)
+            rows = cursor.fetchall()
+        ranges = []
+        for chunk_id, data_nodes, chunk_start, size in rows:
+            chunk_end = chunk_start + size
+            if chunk_end <= offset:
+                continue
+            start = max(offset, chunk_start)
+            stop = chunk_end if end is None else min(end, chunk_end)
+            ranges.append(
+                (chunk_id, json.loads(data_nodes) if data_nodes else [],
+                 start - chunk_start, stop - start))
+        return ranges
+
+    def stat(self, file_name):
+        """
+        Return (size, mtime, is_directory) of a file or directory, or None
+        if nothing exists at that path. The root "" always exists.
+        """
+        with self._reading() as cursor:
+            return self._stat(cursor, file_name)
+
+    def _stat(self, cursor, file_name):
+        inode = self._resolve(cursor, _split_path(file_name))
+        if inode is None:
+            return None
+        return (inode[2], inode[3], bool(inode[1]))
+
+    def stat_many(self, file_names):
+        """Return {file_name: stat(file_name)} for several paths at once."""
+        with self._reading() as cursor:
+            return {file_name: self._stat(cursor, file_name)
+                    for file_name in file_names}
+
+    def list_directory(self, directory, page_token="",
+                       page_size=DEFAULT_PAGE_SIZE, prefix=""):
+        """
+        List the entries of a directory in name order, with one range scan
+        of the (parent, name) index per page.
+        :param directory: Directory path, "" for the root
+        :param page_token: Token returned with the previous page
+        :param page_size: Most entries to return
+        :param prefix: Only list entries whose name starts with this
+        :return: ([(name, is_directory, size, mtime)], next page token),
+                 the token being "" after the last page
+        """
+        with self._reading() as cursor:
+            inode = self._resolve(cursor, _split_path(directory))
+            if inode is None or not inode[1]:
+                return [], ""
+            # The token is the last name of the previous page
+            query = "SELECT name, is_directory, size, mtime FROM inodes " \
+                    "WHERE parent=? AND name >= ?"
+            params = [inode[0], prefix]
+            if page_token:
+                query += " AND name > ?"
+                params.append(page_token)
+            if prefix:
+                query += " AND name < ?"
+                params.append(_prefix_end(prefix))
+            cursor.execute(
+                query + " ORDER BY name LIMIT ?", params + [page_size + 1])
+            rows = cursor.fetchall()
+        entries = [(name, bool(is_directory), size, mtime)
+                   for name, is_directory, size, mtime in rows[:page_size]]
+        if len(rows) > page_size:
+            return entries, entries[-1][0]
+        return entries, ""
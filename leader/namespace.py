@@ -0,0 +1,903 @@
+import bisect
+import errno
+import itertools
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from array import array
+from concurrent import futures
+
+from metadata_store import (
+    CHUNK_LEASE,
+    DEFAULT_PAGE_SIZE,
+    GROUP_COMMIT_SIZE,
+    MissingChunksError,
+    _path_error,
+    _split_path,
+)
+
+
+class _File:
+    __slots__ = ("chunk_ids", "offsets", "size", "mtime")
+
+    def __init__(self, chunk_ids, offsets, size, mtime):
+        self.chunk_ids = chunk_ids  # tuple of chunk IDs in file order
+        self.offsets = offsets  # array of the file offset each chunk starts at
+        self.size = size
+        self.mtime = mtime
+
+
+class _Directory:
+    __slots__ = ("parent", "children", "names", "mtime")
+
+    def __init__(self, parent, mtime):
+        self.parent = parent  # None for the root and detached directories
+        self.children = {}  # name -> _File or _Directory
+        self.names = []  # the same names, sorted, for paged listing
+        self.mtime = mtime
+
+
+class _Chunk:
+    __slots__ = (
+        "data_nodes",
+        "checksum",
+        "size",
+        "ref_count",
+        "hash_algorithm",
+        "leased_until",
+    )
+
+    def __init__(
+        self, data_nodes, checksum, size, ref_count, hash_algorithm, leased_until
+    ):
+        self.data_nodes = data_nodes
+        self.checksum = checksum
+        self.size = size
+        self.ref_count = ref_count
+        self.hash_algorithm = hash_algorithm
+        self.leased_until = leased_until  # kept unreferenced until then
+
+
+class Namespace:
+    """
+    The whole namespace (directory tree, chunk lists, chunk locations) held
+    in memory, with the same interface as MetadataManager. Every change is
+    appended to an edit log, and synced, before it is applied; concurrent
+    changes share one fsync. Every checkpoint_every edits the log moves on
+    to a new segment and a checkpoint image of the namespace as of the end
+    of the old one is written in the background; the segments it covers are
+    then deleted, so a restart loads the image and replays only the edits
+    made since.
+    """
+
+    # magic, transaction ID, payload length, payload crc32
+    RECORD_HEADER = struct.Struct("<4sQII")
+    MAGIC = b"DFSE"
+    IMAGE_FILE = "image.json"
+    # An edit log segment, named by the txid of its first edit
+    SEGMENT_FILE = "edits.{}.log"
+
+    def __init__(
+        self,
+        root="namespace",
+        checkpoint_every=100000,
+        group_commit_size=GROUP_COMMIT_SIZE,
+        chunk_lease=CHUNK_LEASE,
+    ):
+        """
+        :param root: Directory holding the checkpoint image and edit log
+        :param checkpoint_every: Write a checkpoint after this many edits
+        :param group_commit_size: Most edits synced together
+        :param chunk_lease: Seconds an unreferenced chunk is kept for an
+                            upload that stored or claimed it
+        """
+        self.root = root
+        self.checkpoint_every = checkpoint_every
+        self.group_commit_size = group_commit_size
+        self.chunk_lease = chunk_lease
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+        self._lock = threading.Lock()
+        self._tree = _Directory(None, 0.0)
+        # Recursively deleted directories, unlinked from the tree and
+        # waiting for purge_deleted()
+        self._trash = []
+        self._chunks = {}  # chunk_id -> _Chunk
+        # Chunks no file references, for purge_deleted() to forget once
+        # their lease runs out
+        self._unreferenced = set()
+        self._node_sets = {}  # one shared tuple per distinct replica set
+        self._txid = 0
+        self._edits = 0
+        self._log = None
+        self._log_path = None
+        # Set if a failed batch could not be cut from the log again
+        self._log_error = None
+        self._recover()
+
+        # Images are written one at a time, off the writer thread
+        self._checkpointer = futures.ThreadPoolExecutor(max_workers=1)
+        self._checkpointing = None  # Future of the image being written
+
+        self._writes = queue.SimpleQueue()
+        self._writer_thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer_thread.start()
+
+    # -- recovery ----------------------------------------------------------
+
+    def _recover(self):
+        # Load the last checkpoint, then replay the edits made after it
+        image_path = os.path.join(self.root, self.IMAGE_FILE)
+        if os.path.exists(image_path):
+            with open(image_path) as f:
+                image = json.load(f)
+            self._txid = image["txid"]
+            # [chunk_id, data_nodes, checksum, size, refs, algorithm,
+            #  leased_until]
+            for chunk_id, data_nodes, *fields in image["chunks"]:
+                self._chunks[chunk_id] = _Chunk(self._node_set(data_nodes), *fields)
+            self._tree = self._load_tree(image["tree"])
+            self._trash = [self._load_tree(entries) for entries in image["trash"]]
+            self._unreferenced = {
+                chunk_id
+                for chunk_id, chunk in self._chunks.items()
+                if chunk.ref_count <= 0
+            }
+
+        for _, path in self._edit_logs():
+            self._replay_log(path)
+        # New edits go to a segment of their own
+        self._roll_log()
+
+    def _edit_logs(self):
+        # [(txid of the first edit, path)] of the edit logs in txid order
+        logs = []
+        for name in os.listdir(self.root):
+            parts = name.split(".")
+            if (
+                len(parts) == 3
+                and parts[1].isdigit()
+                and name == self.SEGMENT_FILE.format(parts[1])
+            ):
+                logs.append((int(parts[1]), os.path.join(self.root, name)))
+        return sorted(logs)
+
+    def _replay_log(self, path):
+        offset = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(self.RECORD_HEADER.size)
+                if len(header) < self.RECORD_HEADER.size:
+                    break
+                magic, txid, length, crc = self.RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if (
+                    magic != self.MAGIC
+                    or len(payload) != length
+                    or zlib.crc32(payload) != crc
+                ):
+                    break
+                # Edits up to the image's txid are already in it: segments
+                # are only deleted after the image is safely written
+                if txid > self._txid:
+                    try:
+                        self._apply(json.loads(payload))
+                    except Exception:
+                        # It failed, leaving no trace, when it was made
+                        pass
+                    self._txid = txid
+                    self._edits += 1
+                offset = f.tell()
+        # Drop an edit torn by a crash so the log ends on a boundary
+        if os.path.getsize(path) > offset:
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+    def _dump_tree(self, directory, depth=0, name="", entries=None):
+        # Preorder entries in name order: [depth, name, mtime] for a
+        # directory, plus [chunk_ids, offsets, size] for a file. Files keep
+        # the layout they were written with.
+        if entries is None:
+            entries = []
+        entries.append([depth, name, directory.mtime])
+        for child_name in directory.names:
+            child = directory.children[child_name]
+            if isinstance(child, _Directory):
+                self._dump_tree(child, depth + 1, child_name, entries)
+            else:
+                entries.append(
+                    [
+                        depth + 1,
+                        child_name,
+                        child.mtime,
+                        child.chunk_ids,
+                        child.offsets.tolist(),
+                        child.size,
+                    ]
+                )
+        return entries
+
+    def _load_tree(self, entries):
+        path = []  # directories from the top of the tree to the current one
+        for entry in entries:
+            depth, name, mtime = entry[:3]
+            del path[depth:]
+            parent = path[-1] if path else None
+            if len(entry) == 3:
+                node = _Directory(parent, mtime)
+            else:
+                chunk_ids, offsets, size = entry[3:]
+                node = _File(tuple(chunk_ids), array("q", offsets), size, mtime)
+            if parent is not None:
+                # Entries come in name order, so names stays sorted
+                parent.children[name] = node
+                parent.names.append(name)
+            if isinstance(node, _Directory):
+                path.append(node)
+        return path[0]
+
+    def _roll_log(self):
+        # Move on to a segment starting at the next txid, so the segments
+        # before it end at the current one
+        path = os.path.join(self.root, self.SEGMENT_FILE.format(self._txid + 1))
+        if path == self._log_path:
+            return
+        log = open(path, "ab")
+        if self._log is not None:
+            self._log.close()
+        self._log, self._log_path = log, path
+
+    def _snapshot(self):
+        # Runs on the writer thread, between batches, so nothing changes
+        # while the image is taken: returns the image as of self._txid
+        chunks = [
+            [
+                chunk_id,
+                chunk.data_nodes,
+                chunk.checksum,
+                chunk.size,
+                chunk.ref_count,
+                chunk.hash_algorithm,
+                chunk.leased_until,
+            ]
+            for chunk_id, chunk in self._chunks.items()
+        ]
+        return {
+            "txid": self._txid,
+            "chunks": chunks,
+            "tree": self._dump_tree(self._tree),
+            "trash": [self._dump_tree(directory) for directory in self._trash],
+        }
+
+    def _start_checkpoint(self):
+        # Snapshot the namespace and move the log on to a new segment: the
+        # image and the segments from then on hold every edit
+        image = self._snapshot()
+        self._roll_log()
+        self._edits = 0
+        return image
+
+    def _write_image(self, image):
+        # Runs on the checkpointer, while edits carry on into the new segment
+        image_path = os.path.join(self.root, self.IMAGE_FILE)
+        with open(image_path + ".tmp", "w") as f:
+            json.dump(image, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(image_path + ".tmp", image_path)
+        for first_txid, path in self._edit_logs():
+            if first_txid <= image["txid"]:
+                os.remove(path)
+
+    def _checkpoint(self):
+        # Called by the writer thread after each batch
+        if self._checkpointing is not None:
+            if not self._checkpointing.done():
+                return
+            error = self._checkpointing.exception()
+            self._checkpointing = None
+            if error is not None:
+                # The segments still hold everything; try again now rather
+                # than stop accepting writes
+                print(f"Writing checkpoint failed: {error!r}")
+                self._edits = max(self._edits, self.checkpoint_every)
+        if self._edits >= self.checkpoint_every:
+            try:
+                image = self._start_checkpoint()
+            except OSError as e:
+                print(f"Starting checkpoint failed: {e!r}")
+                return
+            self._checkpointing = self._checkpointer.submit(self._write_image, image)
+
+    def close(self):
+        """Sync queued edits, write a checkpoint and close the edit log."""
+        self._writes.put(None)
+        self._writer_thread.join()
+        # Let an image being written finish before writing the last one
+        self._checkpointer.shutdown()
+        self._write_image(self._start_checkpoint())
+        self._log.close()
+
+    # -- tree --------------------------------------------------------------
+
+    def _resolve(self, parts):
+        # The _File or _Directory at a path, or None
+        node = self._tree
+        for part in parts:
+            if not isinstance(node, _Directory):
+                return None
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def _resolve_file(self, file_name):
+        node = self._resolve(_split_path(file_name))
+        return node if isinstance(node, _File) else None
+
+    def _make_directories(self, parts, mtime):
+        # The directory at parts, creating what is missing
+        directory = self._tree
+        for i, part in enumerate(parts):
+            node = directory.children.get(part)
+            if node is None:
+                node = _Directory(directory, mtime)
+                self._link(directory, part, node)
+            elif not isinstance(node, _Directory):
+                raise _path_error(errno.ENOTDIR, "/".join(parts[: i + 1]))
+            directory = node
+        return directory
+
+    def _link(self, directory, name, node):
+        directory.children[name] = node
+        bisect.insort(directory.names, name)
+        if isinstance(node, _Directory):
+            node.parent = directory
+
+    def _unlink(self, directory, name):
+        node = directory.children.pop(name)
+        del directory.names[bisect.bisect_left(directory.names, name)]
+        if isinstance(node, _Directory):
+            node.parent = None
+        return node
+
+    # -- edits -------------------------------------------------------------
+
+    def _write(self, *edit):
+        # Queue an edit for the writer thread and wait until it is durable
+        done = futures.Future()
+        self._writes.put((edit, done))
+        return done.result()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < self.group_commit_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [write for write in batch if write is not None]
+            if batch:
+                self._commit_batch(batch)
+            if stop:
+                return
+
+    def _commit_batch(self, batch):
+        # The batch is synced to the log before any of it is applied, so
+        # readers never see a change the log could lose. Edits check
+        # everything before changing anything: one that fails is logged all
+        # the same, and fails again without a trace when the log is replayed.
+        if self._log_error is not None:
+            for _, done in batch:
+                done.set_exception(self._log_error)
+            return
+        records = []
+        txid = self._txid
+        for edit, _ in batch:
+            txid += 1
+            payload = json.dumps(edit).encode()
+            records.append(
+                self.RECORD_HEADER.pack(
+                    self.MAGIC, txid, len(payload), zlib.crc32(payload)
+                )
+            )
+            records.append(payload)
+        size = self._log.tell()
+        try:
+            self._log.write(b"".join(records))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+        except Exception as e:
+            self._cut_log(size)
+            for _, done in batch:
+                done.set_exception(e)
+            return
+        results = []
+        with self._lock:
+            for edit, done in batch:
+                try:
+                    results.append((done, self._apply(edit), None))
+                except Exception as e:
+                    results.append((done, None, e))
+            self._txid = txid
+        self._edits += len(batch)
+        for done, result, error in results:
+            if error is not None:
+                done.set_exception(error)
+            else:
+                done.set_result(result)
+        self._checkpoint()
+
+    def _cut_log(self, size):
+        # Drop whatever part of a failed batch reached the log, so it is
+        # not replayed; if that fails too, accept no more edits
+        try:
+            try:
+                self._log.close()
+            except OSError:
+                pass
+            self._log = open(self._log_path, "ab")
+            self._log.truncate(size)
+            os.fsync(self._log.fileno())
+        except OSError as e:
+            print(f"Edit log {self._log_path} is unusable: {e!r}")
+            self._log_error = e
+
+    def _apply(self, edit):
+        # Called with the lock held, or during recovery
+        return getattr(self, "_apply_" + edit[0])(*edit[1:])
+
+    # Edits logged before chunk leases carry no times; their chunks were
+    # never leased, so any time releases them as before
+
+    def _apply_add_chunk(
+        self, chunk_id, data_nodes, checksum, size, hash_algorithm, leased_until=0.0
+    ):
+        chunk = self._chunks.get(chunk_id)
+        ref_count = 0
+        if chunk is not None:
+            ref_count = chunk.ref_count
+            leased_until = max(leased_until, chunk.leased_until)
+        self._chunks[chunk_id] = _Chunk(
+            self._node_set(data_nodes),
+            checksum,
+            size,
+            ref_count,
+            hash_algorithm,
+            leased_until,
+        )
+        if ref_count <= 0:
+            self._unreferenced.add(chunk_id)
+
+    def _apply_claim_chunks(self, chunk_ids, leased_until):
+        existing = set()
+        for chunk_id in chunk_ids:
+            chunk = self._chunks.get(chunk_id)
+            if chunk is not None:
+                chunk.leased_until = max(chunk.leased_until, leased_until)
+                existing.add(chunk_id)
+        return existing
+
+    def _apply_add_file(self, file_name, chunk_ids, mtime):
+        parts = _split_path(file_name)
+        if not parts:
+            raise _path_error(errno.EISDIR, file_name)
+        # A file must never silently lose the bytes of a chunk that was
+        # deleted under it
+        missing = {chunk_id for chunk_id in chunk_ids if chunk_id not in self._chunks}
+        if missing:
+            raise MissingChunksError(missing)
+        directory = self._make_directories(parts[:-1], mtime)
+        old = directory.children.get(parts[-1])
+        if isinstance(old, _Directory):
+            raise _path_error(errno.EISDIR, file_name)
+        file = self._layout(chunk_ids, mtime)
+        if old is None:
+            self._link(directory, parts[-1], file)
+        else:
+            directory.children[parts[-1]] = file
+        for chunk_id in chunk_ids:
+            self._chunks[chunk_id].ref_count += 1
+            self._unreferenced.discard(chunk_id)
+        return self._release_chunks(old.chunk_ids, mtime) if old is not None else []
+
+    def _apply_delete_file(self, file_name, now=0.0):
+        parts = _split_path(file_name)
+        directory = self._resolve(parts[:-1])
+        if not parts or not isinstance(directory, _Directory):
+            return None
+        if not isinstance(directory.children.get(parts[-1]), _File):
+            return None
+        return self._release_chunks(self._unlink(directory, parts[-1]).chunk_ids, now)
+
+    def _apply_make_directory(self, directory, mtime):
+        parts = _split_path(directory)
+        if self._resolve(parts) is not None:
+            raise _path_error(errno.EEXIST, directory)
+        self._make_directories(parts, mtime)
+
+    def _apply_rename(self, source, target, now=0.0):
+        source_parts = _split_path(source)
+        target_parts = _split_path(target)
+        if not source_parts or not target_parts:
+            raise _path_error(errno.EINVAL, source, "Cannot rename the root directory")
+        parent = self._resolve(source_parts[:-1])
+        node = (
+            parent.children.get(source_parts[-1])
+            if isinstance(parent, _Directory)
+            else None
+        )
+        if node is None:
+            raise _path_error(errno.ENOENT, source)
+        target_parent = self._resolve(target_parts[:-1])
+        if target_parent is None:
+            raise _path_error(errno.ENOENT, target)
+        if not isinstance(target_parent, _Directory):
+            raise _path_error(errno.ENOTDIR, target)
+        if isinstance(node, _Directory):
+            # A directory cannot move into its own subtree
+            ancestor = target_parent
+            while ancestor is not None:
+                if ancestor is node:
+                    raise _path_error(
+                        errno.EINVAL, target, "Cannot move a directory below itself"
+                    )
+                ancestor = ancestor.parent
+
+        orphans = []
+        existing = target_parent.children.get(target_parts[-1])
+        if existing is not None:
+            if existing is node:
+                return orphans
+            if isinstance(existing, _Directory) and isinstance(node, _File):
+                raise _path_error(errno.EISDIR, target)
+            if isinstance(node, _Directory) and isinstance(existing, _File):
+                raise _path_error(errno.ENOTDIR, target)
+            if isinstance(existing, _Directory) and existing.names:
+                raise _path_error(errno.ENOTEMPTY, target)
+            self._unlink(target_parent, target_parts[-1])
+            if isinstance(existing, _File):
+                orphans = self._release_chunks(existing.chunk_ids, now)
+        self._unlink(parent, source_parts[-1])
+        self._link(target_parent, target_parts[-1], node)
+        return orphans
+
+    def _apply_delete_directory(self, directory, recursive):
+        parts = _split_path(directory)
+        if not parts:
+            raise _path_error(
+                errno.EINVAL, directory, "Cannot delete the root directory"
+            )
+        node = self._resolve(parts)
+        if node is None:
+            raise _path_error(errno.ENOENT, directory)
+        if not isinstance(node, _Directory):
+            raise _path_error(errno.ENOTDIR, directory)
+        if node.names and not recursive:
+            raise _path_error(errno.ENOTEMPTY, directory)
+        self._unlink(node.parent, parts[-1])
+        if node.names:
+            self._trash.append(node)
+
+    def _apply_purge(self, limit, now=0.0):
+        chunk_ids = []
+        while self._trash and limit > 0:
+            limit = self._purge_directory(self._trash[0], limit, chunk_ids)
+            if not self._trash[0].names:
+                self._trash.pop(0)
+        return self._release_chunks(chunk_ids, now), bool(self._trash)
+
+    def _apply_forget_chunks(self, chunk_ids, now):
+        # Chunks purge_deleted() found unreferenced with their lease over;
+        # one may have been claimed or referenced again since
+        orphans = []
+        for chunk_id in chunk_ids:
+            chunk = self._chunks.get(chunk_id)
+            if chunk is not None and chunk.ref_count <= 0 and chunk.leased_until <= now:
+                orphans.append((chunk_id, list(chunk.data_nodes)))
+                del self._chunks[chunk_id]
+                self._unreferenced.discard(chunk_id)
+        return orphans
+
+    def _purge_directory(self, directory, limit, chunk_ids):
+        # Remove up to limit files below directory, emptied directories
+        # with them; returns what is left of limit
+        while directory.names and limit > 0:
+            name = directory.names[-1]
+            child = directory.children[name]
+            if isinstance(child, _Directory):
+                limit = self._purge_directory(child, limit, chunk_ids)
+                if child.names:
+                    break
+            else:
+                chunk_ids.extend(child.chunk_ids)
+                limit -= 1
+            directory.names.pop()
+            del directory.children[name]
+        return limit
+
+    def _release_chunks(self, chunk_ids, now):
+        # Drop one reference per occurrence and forget unreferenced chunks;
+        # a leased chunk stays until purge_deleted() finds its lease over
+        for chunk_id in chunk_ids:
+            chunk = self._chunks.get(chunk_id)
+            if chunk is not None:
+                chunk.ref_count -= 1
+        orphans = []
+        for chunk_id in set(chunk_ids):
+            chunk = self._chunks.get(chunk_id)
+            if chunk is None or chunk.ref_count > 0:
+                continue
+            if chunk.leased_until <= now:
+                orphans.append((chunk_id, list(chunk.data_nodes)))
+                del self._chunks[chunk_id]
+                self._unreferenced.discard(chunk_id)
+            else:
+                self._unreferenced.add(chunk_id)
+        return orphans
+
+    def _node_set(self, data_nodes):
+        # Chunks share a handful of replica sets; keep one copy of each
+        data_nodes = tuple(data_nodes)
+        return self._node_sets.setdefault(data_nodes, data_nodes)
+
+    def _layout(self, chunk_ids, mtime):
+        offsets = array("q")
+        position = 0
+        for chunk_id in chunk_ids:
+            offsets.append(position)
+            position += self._chunks[chunk_id].size
+        return _File(tuple(chunk_ids), offsets, position, mtime)
+
+    def add_file(self, file_name, chunk_ids):
+        """
+        Create or replace a file and take a reference on each of its chunks.
+        Missing parent directories are created.
+        Returns [(chunk_id, data_nodes)] of chunks the replaced version held
+        the last reference to; they should be deleted from the data nodes.
+        :raises NotADirectoryError: If a parent on the path is a file
+        :raises IsADirectoryError: If the path is a directory
+        :raises MissingChunksError: If a chunk is not (or no longer) stored
+        """
+        return self._write("add_file", file_name, json.loads(chunk_ids), time.time())
+
+    def add_chunk(
+        self, chunk_id, data_nodes, checksum, size=None, hash_algorithm="sha256"
+    ):
+        """
+        Register a stored chunk, leased until the file using it commits.
+        """
+        self._write(
+            "add_chunk",
+            chunk_id,
+            json.loads(data_nodes),
+            checksum,
+            size,
+            hash_algorithm,
+            time.time() + self.chunk_lease,
+        )
+
+    def claim_chunks(self, chunk_ids):
+        """
+        Find which chunks are already stored, leasing each one found so it
+        is not deleted before the file that reuses it commits. The check
+        and the lease are one edit.
+        :return: The subset of chunk_ids that are stored
+        """
+        # Chunks that are not stored need no lease: the upload stores them
+        if not self.find_existing_chunks(chunk_ids):
+            return set()
+        return self._write(
+            "claim_chunks", sorted(set(chunk_ids)), time.time() + self.chunk_lease
+        )
+
+    def delete_file_metadata(self, file_name):
+        """
+        Remove a file and drop its chunk references. Returns
+        [(chunk_id, data_nodes)] of chunks no file references any more, or
+        None if there is no file at that path.
+        """
+        return self._write("delete_file", file_name, time.time())
+
+    def make_directory(self, directory):
+        """
+        Create a directory, and any missing parents.
+        :raises FileExistsError: If something exists at that path
+        :raises NotADirectoryError: If a parent on the path is a file
+        """
+        self._write("make_directory", directory, time.time())
+
+    def rename(self, source, target):
+        """
+        Move a file or directory. A directory moves as a single entry,
+        however much lies below it. As with rename(2), an existing target
+        file, or empty target directory, is replaced.
+        Returns [(chunk_id, data_nodes)] of chunks only a replaced target
+        file referenced.
+        :raises FileNotFoundError: If source or the target's parent is missing
+        :raises IsADirectoryError: If a file would replace a directory
+        :raises NotADirectoryError: If a directory would replace a file, or
+                                    the target's parent is a file
+        :raises OSError: ENOTEMPTY if the target is a non-empty directory,
+                         EINVAL if a directory would move below itself
+        """
+        return self._write("rename", source, target, time.time())
+
+    def delete_directory(self, directory, recursive=False):
+        """
+        Delete a directory. With recursive, a non-empty directory is
+        unlinked from the tree at once and what was below it is removed
+        afterwards by purge_deleted().
+        :raises FileNotFoundError: If the directory does not exist
+        :raises NotADirectoryError: If the path is a file
+        :raises OSError: ENOTEMPTY if the directory is not empty and
+                         recursive is not set, EINVAL for the root
+        """
+        self._write("delete_directory", directory, recursive)
+
+    def purge_deleted(self, limit=1000):
+        """
+        Remove up to limit files of recursively deleted directories, or
+        once none are left, forget up to limit chunks that no file
+        references and whose lease has run out (e.g. stored for an upload
+        that never committed).
+        :return: ([(chunk_id, data_nodes)] of chunks no file references any
+                 more, whether anything is left to purge)
+        """
+        now = time.time()
+        with self._lock:
+            if self._trash:
+                expired = None
+            else:
+                expired = list(
+                    itertools.islice(
+                        (
+                            chunk_id
+                            for chunk_id in self._unreferenced
+                            if self._chunks[chunk_id].leased_until <= now
+                        ),
+                        limit,
+                    )
+                )
+                if not expired:
+                    return [], False
+        if expired is None:
+            orphans, remaining = self._write("purge", limit, now)
+            # Unreferenced chunks are swept once the trash is empty
+            return orphans, remaining or bool(self._unreferenced)
+        # The edit names the chunks, so a replay forgets the same ones
+        return self._write("forget_chunks", expired, now), len(expired) == limit
+
+    # -- reads -------------------------------------------------------------
+
+    def find_existing_chunks(self, chunk_ids):
+        """Return the subset of chunk_ids that are already stored."""
+        with self._lock:
+            return {chunk_id for chunk_id in chunk_ids if chunk_id in self._chunks}
+
+    def get_file_chunks(self, file_name):
+        """Return the chunk IDs of a file in file order, or None."""
+        with self._lock:
+            file = self._resolve_file(file_name)
+            return list(file.chunk_ids) if file is not None else None
+
+    def get_chunk_nodes(self, chunk_id):
+        with self._lock:
+            chunk = self._chunks.get(chunk_id)
+            return json.dumps(list(chunk.data_nodes)) if chunk is not None else None
+
+    def _chunk_nodes(self, chunk_id):
+        chunk = self._chunks.get(chunk_id)
+        return list(chunk.data_nodes) if chunk is not None else []
+
+    def get_chunks_for_file(self, file_name):
+        """Return [(chunk_id, data_nodes, size)] in file order, or None."""
+        with self._lock:
+            file = self._resolve_file(file_name)
+            if file is None:
+                return None
+            ends = file.offsets[1:].tolist() + [file.size]
+            return [
+                (chunk_id, self._chunk_nodes(chunk_id), end - start)
+                for chunk_id, start, end in zip(file.chunk_ids, file.offsets, ends)
+            ]
+
+    def get_file_range(self, file_name, offset=0, length=0):
+        """
+        Map a byte range of a file onto the chunks that cover it, finding
+        the chunk holding the first byte by binary search.
+        :param file_name: Name of the file
+        :param offset: First byte of the range
+        :param length: Number of bytes in the range, 0 for the rest of the file
+        :return: [(chunk_id, data_nodes, offset_in_chunk, length_in_chunk)]
+                 in file order, or None if the file does not exist
+        """
+        with self._lock:
+            file = self._resolve_file(file_name)
+            if file is None:
+                return None
+            end = min(offset + length, file.size) if length else file.size
+            ranges = []
+            index = max(bisect.bisect_right(file.offsets, offset) - 1, 0)
+            while index < len(file.offsets) and file.offsets[index] < end:
+                chunk_start = file.offsets[index]
+                chunk_end = (
+                    file.offsets[index + 1]
+                    if index + 1 < len(file.offsets)
+                    else file.size
+                )
+                if chunk_end > offset and chunk_end > chunk_start:
+                    start = max(offset, chunk_start)
+                    ranges.append(
+                        (
+                            file.chunk_ids[index],
+                            self._chunk_nodes(file.chunk_ids[index]),
+                            start - chunk_start,
+                            min(end, chunk_end) - start,
+                        )
+                    )
+                index += 1
+            return ranges
+
+    def stat(self, file_name):
+        """
+        Return (size, mtime, is_directory) of a file or directory, or None
+        if nothing exists at that path. The root "" always exists.
+        """
+        with self._lock:
+            return self._stat(file_name)
+
+    def _stat(self, file_name):
+        node = self._resolve(_split_path(file_name))
+        if node is None:
+            return None
+        if isinstance(node, _Directory):
+            return (0, node.mtime, True)
+        return (node.size, node.mtime, False)
+
+    def stat_many(self, file_names):
+        """Return {file_name: stat(file_name)} for several paths at once."""
+        with self._lock:
+            return {file_name: self._stat(file_name) for file_name in file_names}
+
+    def list_directory(
+        self, directory, page_token="", page_size=DEFAULT_PAGE_SIZE, prefix=""
+    ):
+        """
+        List the entries of a directory in name order, starting each page
+        with a binary search of the directory's sorted names.
+        :param directory: Directory path, "" for the root
+        :param page_token: Token returned with the previous page
+        :param page_size: Most entries to return
+        :param prefix: Only list entries whose name starts with this
+        :return: ([(name, is_directory, size, mtime)], next page token),
+                 the token being "" after the last page
+        """
+        entries = []
+        with self._lock:
+            node = self._resolve(_split_path(directory))
+            if not isinstance(node, _Directory):
+                return entries, ""
+            names = node.names
+            # The token is the last name of the previous page
+            if page_token:
+                index = bisect.bisect_right(names, max(page_token, prefix))
+            else:
+                index = bisect.bisect_left(names, prefix)
+            while index < len(names) and names[index].startswith(prefix):
+                if len(entries) == page_size:
+                    return entries, entries[-1][0]
+                child = node.children[names[index]]
+                if isinstance(child, _Directory):
+                    entries.append((names[index], True, 0, child.mtime))
+                else:
+                    entries.append((names[index], False, child.size, child.mtime))
+                index += 1
+        return entries, ""
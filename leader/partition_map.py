@@ -0,0 +1,124 @@
+import hashlib
+
+import dfs_pb2
+
+
+def _parts(path):
+    return [part for part in path.split("/") if part]
+
+
+class PartitionMap:
+    def __init__(self, partitions, subtrees=None, spread=None):
+        """
+        Which leader owns which part of the namespace. Paths are partitioned
+        by their top-level name, so a directory and everything below it live
+        on one leader and listing, rename and recursive delete stay local to
+        it. A path pinned in subtrees, at any depth, belongs with everything
+        below it to that partition; any other top-level name goes to the
+        partition it hashes highest with (rendezvous hashing: adding a
+        partition only moves the names it wins). A directory in spread has
+        its entries hashed one by one like the root's, so e.g. dated
+        subdirectories of one directory land on different leaders.
+
+        The root, spread directories and the directories above a pinned or
+        spread path are shared: each partition holds its own entries of
+        them, clients merge their listings, and they cannot be renamed.
+        :param partitions: {partition name: leader address}
+        :param subtrees: Optional {path: partition name}
+        :param spread: Optional paths of directories whose entries are
+                       partitioned one by one
+        """
+        self.partitions = dict(partitions)
+        self.subtrees = {
+            "/".join(_parts(path)): partition
+            for path, partition in dict(subtrees or {}).items()
+        }
+        self.spread = ["/".join(_parts(path)) for path in spread or ()]
+        for path, partition in self.subtrees.items():
+            if partition not in self.partitions:
+                raise ValueError(
+                    f"Subtree '{path}' pinned to unknown partition {partition}"
+                )
+        self._shared = {""}
+        for path in list(self.subtrees) + self.spread:
+            parts = _parts(path)
+            self._shared.update("/".join(parts[:depth]) for depth in range(len(parts)))
+        self._shared.update(self.spread)
+
+    @classmethod
+    def parse(cls, partitions, subtrees="", spread=""):
+        """
+        Build the map from its environment form.
+        :param partitions: e.g. "p0=leader:5000,p1=leader2:5000"
+        :param subtrees: e.g. "home=p1,logs=p0,logs/2024=p1"
+        :param spread: e.g. "logs,data/ingest"
+        """
+        return cls(
+            (entry.split("=", 1) for entry in partitions.split(",") if entry),
+            (entry.split("=", 1) for entry in subtrees.split(",") if entry),
+            [entry for entry in spread.split(",") if entry],
+        )
+
+    @classmethod
+    def from_proto(cls, message):
+        """
+        :param message: PartitionMap from GetPartitionMap
+        :return: PartitionMap, or None if one leader owns the whole namespace
+        """
+        if not message.partitions:
+            return None
+        return cls(
+            ((partition.name, partition.leader) for partition in message.partitions),
+            message.subtrees,
+            message.spread,
+        )
+
+    def to_proto(self):
+        return dfs_pb2.PartitionMap(
+            partitions=[
+                dfs_pb2.Partition(name=name, leader=leader)
+                for name, leader in self.partitions.items()
+            ],
+            subtrees=self.subtrees,
+            spread=self.spread,
+        )
+
+    @staticmethod
+    def _hash(partition, key):
+        key = f"{partition}/{key}".encode()
+        return int.from_bytes(hashlib.md5(key).digest()[:8], "big")
+
+    def partition_of(self, path):
+        """
+        :param path: "/"-separated path
+        :return: Name of the partition owning path, None for a shared
+                 directory such as the root (which every partition holds)
+        """
+        parts = _parts(path)
+        partition = None
+        hashed = True  # the root's entries are hashed one by one
+        for depth in range(1, len(parts) + 1):
+            prefix = "/".join(parts[:depth])
+            if prefix in self.subtrees:
+                partition = self.subtrees[prefix]
+            elif hashed:
+                partition = max(
+                    self.partitions, key=lambda name: self._hash(name, prefix)
+                )
+            if prefix not in self._shared:
+                return partition
+            hashed = prefix in self.spread
+        return None
+
+    def is_shared(self, path):
+        """Whether path is a directory every partition holds part of."""
+        return "/".join(_parts(path)) in self._shared
+
+    def leader_of(self, path):
+        """
+        :param path: "/"-separated path
+        :return: Address of the leader owning path, None for a shared
+                 directory
+        """
+        partition = self.partition_of(path)
+        return self.partitions[partition] if partition is not None else None
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import deque
+
+
+class ReplicaSelector:
+    def __init__(
+        self,
+        hedge_percentile=95,
+        alpha=0.2,
+        window=256,
+        min_samples=16,
+        default_latency=0.0,
+        failure_penalty=1.0,
+    ):
+        """
+        Track per-data-node read latency to pick replicas and hedge slow reads.
+        Latencies are kept per size class so 4KB reads and 64MB reads do not
+        distort each other's estimates.
+        :param hedge_percentile: Latency percentile after which a read is
+                                 duplicated to another replica (0 disables)
+        :param alpha: Weight of the newest sample in the moving average
+        :param window: Number of recent samples kept per node and size class
+        :param min_samples: Samples needed before a node's own percentile is used
+        :param default_latency: Estimate (seconds) for nodes with no samples
+                                yet; 0 makes every node get probed first
+        :param failure_penalty: Latency (seconds) recorded for a failed read
+        """
+        self.hedge_percentile = hedge_percentile
+        self.alpha = alpha
+        self.window = window
+        self.min_samples = min_samples
+        self.default_latency = default_latency
+        self.failure_penalty = failure_penalty
+        self._lock = threading.Lock()
+        self._average = {}  # (node, size_class) -> moving average latency
+        self._samples = {}  # (node, size_class) -> recent latencies
+        self._in_flight = {}  # node -> outstanding reads
+
+    def _size_class(self, length):
+        # Up to 1MB, up to 8MB, and anything larger (0 means a whole chunk)
+        if not length:
+            return 2
+        if length <= 1024 * 1024:
+            return 0
+        return 1 if length <= 8 * 1024 * 1024 else 2
+
+    def rank(self, data_nodes, length=0):
+        """
+        Order replicas from most to least attractive for a read.
+        :param data_nodes: Data nodes holding the chunk
+        :param length: Number of bytes to be read
+        :return: List of data nodes, best first
+        """
+        size_class = self._size_class(length)
+        with self._lock:
+            # Expected latency, scaled up by the queue already waiting on the node
+            scores = {
+                node: self._average.get((node, size_class), self.default_latency)
+                * (self._in_flight.get(node, 0) + 1)
+                for node in data_nodes
+            }
+        return sorted(data_nodes, key=scores.get)
+
+    def hedge_delay(self, data_node, length=0):
+        """
+        Time to wait on a replica before duplicating the read elsewhere.
+        :param data_node: Data node the read was sent to
+        :param length: Number of bytes being read
+        :return: Delay in seconds, or None if hedging is disabled
+        """
+        if not self.hedge_percentile:
+            return None
+        size_class = self._size_class(length)
+        with self._lock:
+            samples = list(self._samples.get((data_node, size_class), ()))
+            if len(samples) < self.min_samples:
+                # Fall back to what every node has seen for this size class
+                samples = [
+                    latency
+                    for (node, cls), node_samples in self._samples.items()
+                    if cls == size_class
+                    for latency in node_samples
+                ]
+        if len(samples) < self.min_samples:
+            return None
+        samples.sort()
+        return samples[int(self.hedge_percentile / 100 * (len(samples) - 1))]
+
+    def begin(self, data_node):
+        """
+        Record the start of a read.
+        :param data_node: Data node being read from
+        :return: Start timestamp to hand back to end()
+        """
+        with self._lock:
+            self._in_flight[data_node] = self._in_flight.get(data_node, 0) + 1
+        return time.monotonic()
+
+    def end(self, data_node, started, length=0, success=True, cancelled=False):
+        """
+        Record the outcome of a read started with begin().
+        :param data_node: Data node that was read from
+        :param started: Timestamp returned by begin()
+        :param length: Number of bytes that were requested
+        :param success: Whether the read returned data
+        :param cancelled: Whether the read was abandoned, e.g. a lost hedge
+        """
+        elapsed = time.monotonic() - started
+        key = (data_node, self._size_class(length))
+        with self._lock:
+            self._in_flight[data_node] -= 1
+            average = self._average.get(key)
+            if cancelled:
+                # An abandoned read was at least this slow; it can only
+                # raise the node's estimate, never lower it
+                if average is not None and elapsed <= average:
+                    return
+                latency = elapsed
+                success = False
+            elif success:
+                latency = elapsed
+            else:
+                latency = max(elapsed, self.failure_penalty)
+            self._average[key] = (
+                latency
+                if average is None
+                else self.alpha * latency + (1 - self.alpha) * average
+            )
+            if success:
+                samples = self._samples.setdefault(key, deque(maxlen=self.window))
+                samples.append(latency)
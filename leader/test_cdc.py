@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from cdc import ContentDefinedChunker
+from chunk_manager import ChunkManager
+
+MIN_SIZE = 1024
+AVG_SIZE = 4096
+MAX_SIZE = 16384
+
+
+def _chunker():
+    return ContentDefinedChunker(MIN_SIZE, AVG_SIZE, MAX_SIZE)
+
+
+def _data(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def _cuts(chunks):
+    # Offsets at which the chunks end
+    position, cuts = 0, []
+    for chunk in chunks:
+        position += len(chunk)
+        cuts.append(position)
+    return cuts
+
+
+def _shard(data, chunker=None):
+    manager = ChunkManager(["node:5001"], chunker=chunker or _chunker())
+    return list(manager.shard_file(data))
+
+
+def test_rejects_inconsistent_sizes():
+    with pytest.raises(ValueError):
+        ContentDefinedChunker(min_size=4096, avg_size=1024, max_size=16384)
+
+
+def test_chunking_is_deterministic():
+    data = _data(256 * 1024)
+    chunks = _shard(data)
+    assert _shard(data) == chunks
+    assert _shard(data, _chunker()) == chunks
+    assert b"".join(chunks) == data
+
+
+def test_chunk_sizes_stay_in_bounds():
+    chunks = _shard(_data(256 * 1024))
+    assert len(chunks) > 10
+    assert all(MIN_SIZE < len(chunk) <= MAX_SIZE for chunk in chunks[:-1])
+    assert 0 < len(chunks[-1]) <= MAX_SIZE
+
+
+def test_find_cut_waits_for_more_data():
+    chunker = _chunker()
+    assert chunker.find_cut(_data(MIN_SIZE)) is None
+    assert chunker.find_cut(_data(MIN_SIZE), final=True) == MIN_SIZE
+    # Zero bytes never hash to a cut, so only max_size ends the chunk
+    assert chunker.find_cut(bytes(MAX_SIZE - 1)) is None
+    assert chunker.find_cut(bytes(MAX_SIZE * 2)) == MAX_SIZE
+
+
+@pytest.mark.parametrize("block_size", [1, 1000, 4096, 65536, 1 << 20])
+def test_streaming_matches_one_shot(block_size):
+    data = _data(200 * 1024, seed=1)
+    manager = ChunkManager(["node:5001"], chunker=_chunker())
+    blocks = (data[i : i + block_size] for i in range(0, len(data), block_size))
+    assert list(manager.stream_chunks(blocks)) == list(manager.shard_file(data))
+
+
+def test_insert_only_moves_nearby_cuts():
+    data = _data(512 * 1024, seed=2)
+    offset = len(data) // 2
+    edited = data[:offset] + b"inserted bytes" + data[offset:]
+    before = _cuts(_shard(data))
+    after = _cuts(_shard(edited))
+
+    # Cuts before the edit stay put and cuts after it shift by the insert
+    assert [cut for cut in after if cut < offset] == [
+        cut for cut in before if cut < offset
+    ]
+    shifted = {cut + len(b"inserted bytes") for cut in before if cut > offset}
+    kept = shifted & set(after)
+    assert len(kept) >= len(shifted) - 2
+    # Only the chunks around the edit differ
+    changed = set(_shard(edited)) - set(_shard(data))
+    assert len(changed) <= 2
@@ -0,0 +1,50 @@
+from hash_ring import HashRing
+
+NODES = [f"node{i}:5001" for i in range(8)]
+KEYS = [f"chunk-{i}" for i in range(20000)]
+
+
+def _owners(ring):
+    return {key: ring.get_nodes(key, 1)[0] for key in KEYS}
+
+
+def test_replicas_are_distinct_nodes():
+    ring = HashRing(NODES)
+    for key in KEYS[:1000]:
+        nodes = ring.get_nodes(key, 3)
+        assert len(nodes) == len(set(nodes)) == 3
+    assert len(ring.get_nodes("key", 20)) == len(NODES)
+    assert HashRing().get_nodes("key", 1) == []
+
+
+def test_placement_is_deterministic():
+    assert _owners(HashRing(NODES)) == _owners(HashRing(reversed(NODES)))
+
+
+def test_adding_a_node_moves_about_one_nth():
+    ring = HashRing(NODES)
+    before = _owners(ring)
+    ring.add_node("node8:5001")
+    after = _owners(ring)
+    moved = [key for key in KEYS if before[key] != after[key]]
+    # Keys only move to the new node, about 1/9 of them
+    assert all(after[key] == "node8:5001" for key in moved)
+    assert abs(len(moved) / len(KEYS) - 1 / 9) < 0.05
+
+
+def test_removing_a_node_moves_only_its_keys():
+    ring = HashRing(NODES)
+    before = _owners(ring)
+    ring.remove_node("node3:5001")
+    after = _owners(ring)
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(before[key] == "node3:5001" for key in moved)
+    assert moved == [key for key in KEYS if before[key] == "node3:5001"]
+    assert abs(len(moved) / len(KEYS) - 1 / 8) < 0.05
+
+
+def test_weights_shift_the_share():
+    ring = HashRing(NODES[:2], weights={NODES[0]: 3})
+    owners = _owners(ring)
+    share = sum(owner == NODES[0] for owner in owners.values()) / len(KEYS)
+    assert abs(share - 0.75) < 0.1
@@ -1,22 +1,157 @@
+import hashlib
+import io
 import grpc
 import dfs_pb2
 import dfs_pb2_grpc
+from partition_map import PartitionMap
+
+FRAME_SIZE = 1024 * 1024  # 1MB per upload frame, well under the gRPC message cap
+CHUNK_SIZE = 64 * 1024 * 1024  # Must match the leader's chunk size
+CHANNEL_OPTIONS = [
+    ("grpc.max_send_message_length", 65 * 1024 * 1024),
+    ("grpc.max_receive_message_length", 65 * 1024 * 1024),
+]
+
+
+def upload_frames(file_name, f):
+    # Header frame first, then the file contents one frame at a time
+    yield dfs_pb2.FileUploadFrame(header=dfs_pb2.FileUploadHeader(file_name=file_name))
+    while True:
+        data = f.read(FRAME_SIZE)
+        if not data:
+            return
+        yield dfs_pb2.FileUploadFrame(data=data)
 
 
 def upload_file(file_name, leader_host="localhost:5000"):
     # Open the file to upload
     with open(file_name, "rb") as f:
-        file_data = f.read()
+        # Connect to the leader gRPC service
+        with grpc.insecure_channel(leader_host) as channel:
+            stub = dfs_pb2_grpc.LeaderServiceStub(channel)
+            response = stub.UploadFileStream(upload_frames(file_name, f))
+            print(response.message)
 
-    # Connect to the leader gRPC service
+
+def upload_dated_files(directory, dates, leader_host="localhost:5000"):
+    # Jobs streaming into dated subdirectories of one top-level directory:
+    # with the directory in SPREAD (or single days pinned in SUBTREES) the
+    # days go to different leaders instead of all hitting one
     with grpc.insecure_channel(leader_host) as channel:
-        stub = dfs_pb2_grpc.LeaderServiceStub(channel)
-        response = stub.UploadFile(
-            dfs_pb2.FileUploadRequest(file_name=file_name, data=file_data)
+        partition_map = PartitionMap.from_proto(
+            dfs_pb2_grpc.LeaderServiceStub(channel).GetPartitionMap(
+                dfs_pb2.PartitionMapRequest()
+            )
+        )
+    leaders = {}
+    for date in dates:
+        file_name = f"{directory}/{date}/part-0"
+        leader = leader_host
+        if partition_map is not None:
+            leader = partition_map.leader_of(file_name)
+        with grpc.insecure_channel(leader) as channel:
+            stub = dfs_pb2_grpc.LeaderServiceStub(channel)
+            response = stub.UploadFileStream(
+                upload_frames(file_name, io.BytesIO(file_name.encode()))
+            )
+        print(f"{file_name} -> {leader}: {response.message}")
+        leaders[file_name] = leader
+    return leaders
+
+
+def chunk_frames(chunk_id, data, downstream, block_pool=""):
+    # Pipelined store: the first data node forwards to the rest of the chain
+    yield dfs_pb2.ChunkFrame(
+        header=dfs_pb2.ChunkPipelineHeader(
+            chunk_id=chunk_id, downstream=downstream, block_pool=block_pool
+        )
+    )
+    for i in range(0, len(data), FRAME_SIZE):
+        yield dfs_pb2.ChunkFrame(data=data[i : i + FRAME_SIZE])
+
+
+def upload_file_direct(file_name, leader_host="localhost:5000"):
+    # First pass: hash every chunk so the leader can tell us which ones it has
+    chunks = []
+    with open(file_name, "rb") as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            chunks.append(
+                dfs_pb2.ChunkLocation(
+                    chunk_id=hashlib.sha256(data).hexdigest(), size=len(data)
+                )
+            )
+
+    with grpc.insecure_channel(leader_host) as channel:
+        leader = dfs_pb2_grpc.LeaderServiceStub(channel)
+        existing = set(
+            leader.FindChunks(
+                dfs_pb2.FindChunksRequest(chunk_ids=[c.chunk_id for c in chunks])
+            ).existing_chunk_ids
+        )
+        # Ask the leader where the new chunks go
+        allocation = leader.AllocateChunks(
+            dfs_pb2.AllocateChunksRequest(
+                file_name=file_name,
+                chunks=[c for c in chunks if c.chunk_id not in existing],
+            )
+        )
+        plan = {placement.chunk_id: placement for placement in allocation.chunks}
+
+        # Second pass: send only the new chunks to the data nodes ourselves
+        committed = []
+        with open(file_name, "rb") as f:
+            for chunk in chunks:
+                data = f.read(CHUNK_SIZE)
+                if chunk.chunk_id not in plan:
+                    committed.append(chunk)  # Already stored, just link it
+                    continue
+                placement = plan.pop(chunk.chunk_id)
+                nodes = list(placement.data_nodes)
+                with grpc.insecure_channel(nodes[0], options=CHANNEL_OPTIONS) as node:
+                    response = dfs_pb2_grpc.DataNodeServiceStub(
+                        node
+                    ).StoreChunkPipeline(
+                        chunk_frames(
+                            chunk.chunk_id, data, nodes[1:], allocation.block_pool
+                        )
+                    )
+                if not response.success:
+                    print(response.message)
+                    return
+                committed.append(placement)
+
+        response = leader.CommitFile(
+            dfs_pb2.CommitFileRequest(file_name=file_name, chunks=committed)
         )
         print(response.message)
 
 
+def read_file_direct(file_name, leader_host="localhost:5000"):
+    # Fetch chunk locations from the leader and read the chunks from the data nodes
+    with grpc.insecure_channel(leader_host) as channel:
+        leader = dfs_pb2_grpc.LeaderServiceStub(channel)
+        locations = leader.GetFileLocations(
+            dfs_pb2.FileReadRequest(file_name=file_name)
+        )
+    for chunk in locations.chunks:
+        for node in chunk.data_nodes:
+            try:
+                with grpc.insecure_channel(node, options=CHANNEL_OPTIONS) as channel:
+                    yield dfs_pb2_grpc.DataNodeServiceStub(channel).RetrieveChunk(
+                        dfs_pb2.ChunkRequest(
+                            chunk_id=chunk.chunk_id, block_pool=locations.block_pool
+                        )
+                    ).data
+                break
+            except grpc.RpcError:
+                continue
+        else:
+            raise IOError(f"No replica of chunk {chunk.chunk_id} could be read")
+
+
 if __name__ == "__main__":
     # Test the file upload
     upload_file("test_file.txt")